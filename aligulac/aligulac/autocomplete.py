@@ -0,0 +1,207 @@
+# {{{ Imports
+from bisect import bisect_left
+import re
+import threading
+
+from django.db.models.signals import (
+    post_delete,
+    post_save,
+)
+
+from ratings.models import (
+    Alias,
+    Event,
+    Group,
+    GroupMembership,
+    Player,
+    TYPE_CATEGORY,
+    TYPE_EVENT,
+)
+from ratings.tools import token_countries
+
+from aligulac.cache import (
+    bump_generation,
+    generation_key,
+    get_generations,
+    update_marker_mtime,
+)
+# }}}
+
+# In-memory prefix index for the auto-complete search box. It's built from a handful of queries the first time
+# it's needed after each update (when the update marker is touched) or after players, teams, aliases or events
+# have been edited (see get_index), and answers queries without touching the database. A term matches a name if
+# it's a prefix of the name, or of any word in it. Player IDs and countries (as codes or names, see
+# token_countries) must match exactly.
+
+# Keys are truncated to this length to keep the index compact. Longer terms are checked against the full names.
+KEY_LENGTH = 12
+WORD_START = re.compile(r'(?:^|(?<=[\s\-_.\[(]))\S')
+
+# {{{ PrefixIndex
+# Indexes a list of items, each with a list of names, a payload and optionally a list of tokens that are only
+# matched exactly (see search). The items should be given in the order results should be returned in.
+class PrefixIndex:
+    def __init__(self, items):
+        pairs = []
+        self.names = []
+        self.payloads = []
+        self.tokens = {}
+        for i, (names, payload, *tokens) in enumerate(items):
+            names = [n.upper() for n in names if n]
+            for name in names:
+                for m in WORD_START.finditer(name):
+                    pairs.append((name[m.start():m.start()+KEY_LENGTH], i))
+            for token in (tokens[0] if tokens else []):
+                self.tokens.setdefault(token, set()).add(i)
+            self.names.append(names)
+            self.payloads.append(payload)
+
+        pairs.sort()
+        self.keys = [k for k, _ in pairs]
+        self.ids = [i for _, i in pairs]
+
+    # {{{ lookup(term, tokens=()): Returns the set of item indices matching the term by name, or having any of
+    # the given tokens
+    def lookup(self, term, tokens=()):
+        term = term.upper()
+        key = term[:KEY_LENGTH]
+        lo = bisect_left(self.keys, key)
+        hi = bisect_left(self.keys, key + '\U0010ffff', lo)
+        ids = set(self.ids[lo:hi])
+        if len(term) > KEY_LENGTH:
+            ids = {i for i in ids if any(term in name for name in self.names[i])}
+        for token in tokens:
+            ids |= self.tokens.get(token, set())
+        return ids
+    # }}}
+
+    # {{{ search(terms, num, accept=None, tokens=None): Returns the payloads of the first num items matching all
+    # the terms and accepted by the given function (if any). A term also matches the items having any of the
+    # tokens returned for it by the tokens function (if any). With no terms, every item matches.
+    def search(self, terms, num, accept=None, tokens=None):
+        ids = None
+        for term in terms:
+            found = self.lookup(term, tokens(term) if tokens is not None else ())
+            ids = found if ids is None else ids & found
+            if not ids:
+                return []
+        ret = []
+        for i in (range(len(self.payloads)) if ids is None else sorted(ids)):
+            if accept is None or accept(self.payloads[i]):
+                ret.append(self.payloads[i])
+                if len(ret) == num:
+                    break
+        return ret
+    # }}}
+# }}}
+
+# {{{ build_index: Builds the player, team and event indices
+def build_index():
+    aliases = {}
+    for a in Alias.objects.values('player_id', 'group_id', 'name'):
+        if a['player_id'] is not None:
+            aliases.setdefault(('player', a['player_id']), []).append(a['name'])
+        if a['group_id'] is not None:
+            aliases.setdefault(('group', a['group_id']), []).append(a['name'])
+
+    teams, team_names = {}, {}
+    for m in (GroupMembership.objects.filter(current=True, group__is_team=True)
+              .values('player_id', 'group_id', 'group__name', 'group__shortname').order_by('id')):
+        teams.setdefault(m['player_id'], []).append((m['group__name'], m['group__shortname']))
+        team_names.setdefault(m['player_id'], []).extend(
+            [m['group__name']] + aliases.get(('group', m['group_id']), [])
+        )
+
+    # Players are ranked like in the search: rated players by current rating, then the rest
+    players = (
+        Player.objects.values('id', 'tag', 'race', 'country', 'name', 'romanized_name', 'current_rating__rating')
+    )
+    players = sorted(players, key=lambda p: (
+        p['current_rating__rating'] is None, -(p['current_rating__rating'] or 0), p['id']
+    ))
+
+    return {
+        'players': PrefixIndex([
+            ([p['tag'], p['name'], p['romanized_name']]
+                    + aliases.get(('player', p['id']), []) + team_names.get(p['id'], []), {
+                'id':       p['id'],
+                'tag':      p['tag'],
+                'race':     p['race'],
+                'country':  p['country'],
+                'aliases':  aliases.get(('player', p['id']), []),
+                'teams':    teams.get(p['id'], []),
+            }, ['id:%i' % p['id']] + (['cc:' + p['country']] if p['country'] else [])) for p in players
+        ]),
+        'teams': PrefixIndex([
+            ([t['name']] + aliases.get(('group', t['id']), []), {
+                'id':   t['id'],
+                'name': t['name'],
+            }) for t in Group.objects.filter(is_team=True).values('id', 'name').order_by('name')
+        ]),
+        'events': PrefixIndex([
+            ([e['fullname']], {
+                'id':       e['id'],
+                'fullname': e['fullname'],
+            }) for e in (Event.objects.filter(type__in=[TYPE_CATEGORY, TYPE_EVENT])
+                         .values('id', 'fullname').order_by('fullname'))
+        ]),
+    }
+# }}}
+
+# {{{ get_index: Returns the index, rebuilding it if the update marker has been touched or the 'autocomplete'
+# generation has been bumped (by saving or deleting any of the indexed objects) since it was built. With a dummy
+# cache backend (in development) the generation is never remembered, so the index is rebuilt for every query.
+_index = {}
+_index_lock = threading.Lock()
+
+def get_index():
+    version = (update_marker_mtime(), get_generations([generation_key('autocomplete')])[0])
+    if _index.get('version') != version:
+        with _index_lock:
+            if _index.get('version') != version:
+                _index['data'] = build_index()
+                _index['version'] = version
+    return _index['data']
+
+def invalidate_index(*args, **kwargs):
+    bump_generation('autocomplete')
+
+for model in [Alias, Event, Group, GroupMembership, Player]:
+    post_save.connect(invalidate_index, sender=model)
+    post_delete.connect(invalidate_index, sender=model)
+# }}}
+
+# {{{ player_tokens(term): The exact tokens a player search term can match: an ID or countries
+def player_tokens(term):
+    tokens = ['id:%i' % int(term)] if term.isdigit() else []
+    return tokens + ['cc:' + c for c in token_countries(term)]
+# }}}
+
+# {{{ autocomplete(terms, search_for): Returns the auto-complete results for the given terms, as a dict with
+# players, teams and events (those that are in search_for). Single-character terms restrict players by race.
+def autocomplete(terms, search_for):
+    index = get_index()
+    num = 10 if len(search_for) == 1 else 5
+
+    data = {}
+    if 'players' in search_for:
+        races = {t.upper() for t in terms if len(t) == 1 and t.upper() in 'PTZRS'}
+        names = [t for t in terms if not (len(t) == 1 and t.upper() in 'PTZRS')]
+        if len(races) > 1:
+            data['players'] = []
+        elif races:
+            race = races.pop()
+            data['players'] = index['players'].search(
+                names, num, accept=lambda p: p['race'] == race, tokens=player_tokens
+            )
+        else:
+            data['players'] = index['players'].search(names, num, tokens=player_tokens)
+
+    if 'teams' in search_for:
+        data['teams'] = index['teams'].search(terms, num)
+
+    if 'events' in search_for:
+        data['events'] = index['events'].search(terms, num)
+
+    return data
+# }}}
@@ -1,5 +1,127 @@
+from functools import wraps
+import hashlib
+import os
+import uuid
+
 from aligulac import settings
-from django.views.decorators.cache import cache_page as django_cache_page
+from django.core.cache import cache
+from django.utils.cache import (
+    get_conditional_response,
+    patch_response_headers,
+)
+from django.utils.http import (
+    http_date,
+    quote_etag,
+)
+
+# {{{ Data generations
+# Cached pages are keyed on the generation tokens of the data they depend on. Instead of clearing the cache
+# after an update, the pipeline bumps the tokens of the data that changed, so that stale entries are never
+# looked up again and expire on their own. The global generation is bumped after every update, the finer
+# generations (e.g. per period or per player) whenever the corresponding data changes.
+GLOBAL = 'global'
+
+def generation_key(scope=GLOBAL, ident=None):
+    if ident is None:
+        return 'generation:%s' % scope
+    return 'generation:%s:%s' % (scope, ident)
+
+def new_token():
+    return uuid.uuid4().hex[:12]
+
+def bump_generation(scope=GLOBAL, ident=None):
+    cache.set(generation_key(scope, ident), new_token(), None)
+
+def bump_generations(scope, idents):
+    cache.set_many({generation_key(scope, ident): new_token() for ident in idents}, None)
+
+def get_generations(keys):
+    tokens = cache.get_many(keys)
+    missing = {key: new_token() for key in keys if key not in tokens}
+    if missing:
+        cache.set_many(missing, None)
+        tokens.update(missing)
+    return [tokens[key] for key in keys]
+
+# Returns the generation keys for a view with the given scopes, called with the given keyword arguments.
+# A scope like 'period' depends on the generation of the period given by the period_id argument, or on the
+# global generation if there is no such argument (e.g. /periods/latest/).
+def view_generation_keys(scopes, kwargs):
+    keys = []
+    for scope in scopes:
+        ident = kwargs.get(scope + '_id')
+        if scope == GLOBAL or ident is None:
+            key = generation_key(GLOBAL)
+        else:
+            key = generation_key(scope, ident)
+        if key not in keys:
+            keys.append(key)
+    return keys
+# }}}
+
+# {{{ update_marker_mtime: Returns the modification time of the file recompute.py touches after each update.
+def update_marker_mtime():
+    try:
+        return os.stat(os.path.join(settings.PROJECT_PATH, 'update')).st_mtime
+    except OSError:
+        return None
+# }}}
+
+# {{{ Conditional GET
+# Responses that only depend on data generations get an ETag derived from the generation tokens (so it changes
+# exactly when a cached copy would be invalidated), and optionally a Last-Modified header. Clients that send them
+# back get a 304 without the response being rendered. Pages and resources showing players don't send
+# Last-Modified, since player edits don't change any timestamp.
+def make_etag(request, tokens):
+    key = '|'.join(list(tokens) + [request.get_full_path(), getattr(request, 'LANGUAGE_CODE', '')])
+    return quote_etag(hashlib.md5(key.encode()).hexdigest()[:20])
+
+def conditional_response(request, tokens, modified, get_response):
+    etag = make_etag(request, tokens)
+    modified = int(modified) if modified is not None else None
+
+    response = get_conditional_response(request, etag=etag, last_modified=modified)
+    if response is None:
+        response = get_response()
+
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        if modified is not None:
+            response['Last-Modified'] = http_date(modified)
+    return response
+# }}}
+
+# {{{ Page cache
+# Rendered pages are cached for anonymous GET and HEAD requests, keyed on the generation tokens, the path with
+# the query string and the language the page is rendered in (as resolved by LocaleMiddleware). Unlike Django's
+# cache_page, the key doesn't include the host, the scheme or the raw Cookie and Accept-Language headers, so all
+# visitors (and warm_cache.py) share one entry per page and language. Responses that use the CSRF token or set
+# cookies are never cached.
+def page_cache_key(request, prefix):
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return 'page:%s:%s:%s' % (prefix, getattr(request, 'LANGUAGE_CODE', ''), path)
+
+def cached_response(request, prefix, seconds, get_response):
+    if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+        return get_response()
+
+    key = page_cache_key(request, prefix)
+    response = cache.get(key)
+    if response is not None:
+        return response
+
+    response = get_response()
+    if (response.status_code != 200 or response.streaming or response.cookies
+            or request.META.get('CSRF_COOKIE_USED')):
+        return response
+
+    patch_response_headers(response, seconds)
+    if callable(getattr(response, 'render', None)):
+        response.add_post_render_callback(lambda r: cache.set(key, r, seconds))
+    else:
+        cache.set(key, response, seconds)
+    return response
+# }}}
 
 def cache_page(view):
     fname = view.__module__ + '.' + view.__name__
@@ -12,4 +134,34 @@ def cache_page(view):
     if seconds is None:
         return view
 
-    return django_cache_page(seconds)(view)
+    scopes = settings.CACHE_GENERATIONS.get(fname, (GLOBAL,))
+    if not scopes:
+        @wraps(view)
+        def constant_handler(request, *args, **kwargs):
+            return cached_response(request, '', seconds, lambda: view(request, *args, **kwargs))
+        return constant_handler
+
+    # Views not listed in CACHE_GENERATIONS may also change without a generation bump (they rely on expiry), so
+    # only the listed ones are validated. They all show players other than the ones in their scopes (opponents,
+    # rating lists), whose names, races and countries can be edited at any time, so they also depend on the
+    # 'players' generation (bumped by Player.save). Otherwise a client could keep getting 304s for a page showing
+    # old player details, since the generations of e.g. old periods hardly ever change.
+    validate = fname in settings.CACHE_GENERATIONS
+
+    @wraps(view)
+    def handler(request, *args, **kwargs):
+        keys = view_generation_keys(scopes, kwargs)
+        if validate:
+            keys.append(generation_key('players'))
+        tokens = get_generations(keys)
+        prefix = '.'.join(tokens)
+        get_response = lambda: cached_response(
+            request, prefix, seconds, lambda: view(request, *args, **kwargs)
+        )
+
+        # Pages for logged in users may differ from what's cached, so they're not validated either
+        if not validate or request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+            return get_response()
+
+        return conditional_response(request, tokens, None, get_response)
+    return handler
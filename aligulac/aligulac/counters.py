@@ -0,0 +1,55 @@
+import atexit
+import threading
+import time
+
+from django.db.models import F
+
+# {{{ BufferedCounter
+# Counts events per object in memory, and adds them to an integer field of the objects in batches: at most every
+# flush_seconds seconds or flush_count events (per process), and when the process exits. One UPDATE is made per
+# distinct count.
+#
+# atexit handlers don't run when a worker is killed (e.g. by a uWSGI harakiri or a gunicorn timeout, or when
+# the server is stopped without a graceful shutdown), so up to flush_seconds worth of counts can be lost per
+# worker. That's acceptable for the statistics these are used for.
+class BufferedCounter:
+    def __init__(self, model, key_field, count_field, flush_seconds=60, flush_count=None):
+        self.model = model
+        self.key_field = key_field
+        self.count_field = count_field
+        self.flush_seconds = flush_seconds
+        self.flush_count = flush_count
+
+        self._counts = {}
+        self._total = 0
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        atexit.register(self.flush)
+
+    # Counts an event for the given key, flushing the counts if it's time
+    def count(self, key):
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + 1
+            self._total += 1
+            due = (
+                (self.flush_count is not None and self._total >= self.flush_count) or
+                time.monotonic() - self._last_flush >= self.flush_seconds
+            )
+        if due:
+            self.flush()
+
+    # Writes the buffered counts to the database
+    def flush(self):
+        with self._lock:
+            counts = self._counts
+            self._counts, self._total = {}, 0
+            self._last_flush = time.monotonic()
+
+        by_count = {}
+        for key, n in counts.items():
+            by_count.setdefault(n, []).append(key)
+        for n, keys in by_count.items():
+            self.model.objects.filter(**{self.key_field + '__in': keys}).update(
+                **{self.count_field: F(self.count_field) + n}
+            )
+# }}}
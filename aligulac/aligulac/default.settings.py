@@ -56,6 +56,7 @@ PROJECT_PATH = local.PROJECT_PATH
 DUMP_PATH = local.DUMP_PATH
 INTERNAL_IPS = local.INTERNAL_IPS
 EXCHANGE_ID = local.EXCHANGE_ID
+EXCHANGE_FIXTURE = getattr(local, 'EXCHANGE_FIXTURE', None)
 
 CACHES = {
     'default': {
@@ -85,14 +86,61 @@ CACHE_TIMES = {
     'ratings.records_views.hof': 6*60*60,
     'ratings.records_views.race': 6*60*60,
     'ratings.report_views.balance': 6*60*60,
-
-    # Depends on results but not urgent
-    'ratings.misc_views.clocks': 30*60,
+    'ratings.misc_views.clocks': 6*60*60,
 
     # Set until the queries have been improved
     'ratings.results_views.results': 10*60
 }
 
+# Data generations that cached views depend on (see aligulac.cache). The update bumps the global generation,
+# period.py bumps the generation of each period it recomputes, and changes to matches bump the generations of
+# the players involved. Views not listed here depend on the global generation only, views listed with an empty
+# tuple don't depend on the data at all and just expire.
+CACHE_GENERATIONS = {
+    'aligulac.views.h404': (),
+    'aligulac.views.h500': (),
+    'blog.views.blog': (),
+    'faq.views.faq': (),
+    'ratings.inference_views.predict': (),
+
+    'ratings.ranking_views.period': ('period',),
+    'ratings.player_views.player': ('global', 'player'),
+    'ratings.player_views.adjustment': ('period', 'player'),
+    'ratings.player_views.results': ('global', 'player'),
+    'ratings.player_views.historical': ('global', 'player'),
+    'ratings.player_views.earnings': ('player',),
+}
+
+# Pages rendered by warm_cache.py after each update, so that visitors never hit a cold ranking page. Cached pages
+# are keyed on the path and the resolved language only (see aligulac.cache), so a page warmed with
+# Accept-Language 'en' is the one served to every visitor whose language resolves to English, with or without
+# cookies. The host must be in ALLOWED_HOSTS, and the scheme should be the one the site sees (set 'secure' to
+# False if it's served behind a proxy that isn't trusted through SECURE_PROXY_SSL_HEADER), so that the pages
+# render the same as for visitors.
+CACHE_WARMING = {
+    'host':          getattr(local, 'CACHE_WARM_HOST', 'aligulac.com'),
+    'secure':        getattr(local, 'CACHE_WARM_SECURE', True),
+    'languages':     ['en'],
+    'ranking_pages': 3,
+    'races':         ['ptzrs', 'p', 't', 'z'],
+    'nats':          ['all', 'foreigners', 'KR'],
+    'players':       50,
+    'threads':       4,
+}
+
+# API
+
+# Valid API keys are remembered for this long by each process, and request counts are written this often
+API_KEY_CACHE_SECONDS = 5*60
+API_USAGE_FLUSH_SECONDS = 60
+
+# Token bucket rate limits per API key, as (requests per second, burst size), for the database resources and
+# exports ('list') and for the much more expensive predictions ('predict')
+API_RATE_LIMITS = {
+    'list':     (5, 100),
+    'predict':  (0.5, 20),
+}
+
 # RATINGS
 
 INACTIVE_THRESHOLD = 4
@@ -14,6 +14,11 @@ SECRET_KEY = ''
 # API key to openexchangerates.org
 EXCHANGE_ID = ''
 
+# JSON file with exchange rates to use instead of openexchangerates.org (for development without network
+# access), mapping dates (YYYY-MM-DD) to {currency: units per USD}, like currency_fixture.json (used by the
+# tests). Leave as None to use the API.
+EXCHANGE_FIXTURE = None
+
 # Database username and password
 DB_USER = ''
 DB_PASSWORD = ''
@@ -24,6 +29,11 @@ TEMPLATE_DIRS = ('/home/eivind/repos/aligulac/templates/',)
 # Host names this server accepts connections to
 ALLOWED_HOSTS = ['.aligulac.com', 'localhost']
 
+# Host name and scheme the cache warmer renders pages for (must be in ALLOWED_HOSTS). The scheme should be the
+# one Django sees for real visitors: False behind a proxy without SECURE_PROXY_SSL_HEADER.
+CACHE_WARM_HOST = 'aligulac.com'
+CACHE_WARM_SECURE = True
+
 # Necessary for django debug toolbar to work
 INTERNAL_IPS = ('127.0.0.1',)
 
@@ -15,19 +15,25 @@ from django.contrib.auth import (
     authenticate,
     login,
 )
+from django.contrib.postgres.search import TrigramSimilarity
 from django.template.context_processors import csrf
 from django.db.models import Q, F
+from django.db.models.signals import post_save
 from django.http import HttpResponse
 from django.template.loader import render_to_string
 from django.views.decorators.csrf import csrf_protect
 
-from aligulac.cache import cache_page
+from aligulac.cache import (
+    cache_page,
+    update_marker_mtime,
+)
 from aligulac.settings import PROJECT_PATH, DEBUG
 
 from ratings.models import (
     Earnings,
     Event,
     Group,
+    Period,
     Player,
     Rating,
     TYPE_CATEGORY,
@@ -187,23 +193,33 @@ def post_param(request, param, default):
         return default
 # }}}
 
-# {{{ base_ctx: Generates a minimal context, required to render the site layout and menus
-# Parameters:
-# - section: A string, name of the current major section (or None)
-# - subpage: A string, name of the current subsection (or None)
-# - request: The request that was passed to the view function (necessary to enable admin features)
-# - context: Additional information which can be used depending on section and subsection
-# Returns: A dictionary to be extended by the view function, and then passed to template rendering.
-def base_ctx(section=None, subpage=None, request=None, context=None):
-    curp = get_latest_period()
+# {{{ Process-wide context cache
+# Everything in here is the same for every request, so it's computed at most once per process (or once per
+# update, for the latest period).
+_context_cache = {}
+
+# {{{ get_current_period: Returns the latest computed period, refreshed when the update marker is touched.
+def get_current_period():
+    mtime = update_marker_mtime()
+    cached = _context_cache.get('curp')
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, get_latest_period())
+        _context_cache['curp'] = cached
+    return cached[1]
+# }}}
 
-    base = {
-        'curp':      curp,
-        'debug':     DEBUG,
-        'cur_path':  request.get_full_path(),
-        'messages':  [],
-        'lang':      request.LANGUAGE_CODE,
-        'menu':      [{
+# {{{ invalidate_context_cache: Forgets the latest period (called when periods are saved in this process).
+def invalidate_context_cache(*args, **kwargs):
+    _context_cache.pop('curp', None)
+
+post_save.connect(invalidate_context_cache, sender=Period)
+# }}}
+
+# {{{ get_menu: Returns the main menu, translated to the given language. Don't modify it in place.
+def get_menu(lang):
+    menus = _context_cache.setdefault('menus', {})
+    if lang not in menus:
+        menus[lang] = [{
             'id': 'Ranking',
             'name': _('Ranking'),
             'url': '/periods/latest/',
@@ -274,6 +290,42 @@ def base_ctx(section=None, subpage=None, request=None, context=None):
                 ('Player info', _('Player info'), '/add/player_info/'),
                 ('Misc', _('Misc'), '/add/misc/'),
         ]}]
+    return menus[lang]
+# }}}
+
+# {{{ get_git_info: Returns the current commit hash and branch (only shown in debug mode).
+def get_git_info():
+    if 'git' not in _context_cache:
+        p = subprocess.Popen(['git', '-C', PROJECT_PATH, 'rev-parse', 'HEAD'], stdout=subprocess.PIPE)
+        commithash = p.communicate()[0].decode().strip()[:8]
+
+        p = subprocess.Popen(['git', '-C', PROJECT_PATH, 'rev-parse', '--abbrev-ref', 'HEAD'],
+                             stdout=subprocess.PIPE)
+        commitbranch = p.communicate()[0].decode().strip()
+
+        _context_cache['git'] = {'commithash': commithash, 'commitbranch': commitbranch}
+    return _context_cache['git']
+# }}}
+# }}}
+
+# {{{ base_ctx: Generates a minimal context, required to render the site layout and menus
+# Parameters:
+# - section: A string, name of the current major section (or None)
+# - subpage: A string, name of the current subsection (or None)
+# - request: The request that was passed to the view function (necessary to enable admin features)
+# - context: Additional information which can be used depending on section and subsection
+# Returns: A dictionary to be extended by the view function, and then passed to template rendering.
+def base_ctx(section=None, subpage=None, request=None, context=None):
+    curp = get_current_period()
+
+    menu = list(get_menu(request.LANGUAGE_CODE))
+    base = {
+        'curp':      curp,
+        'debug':     DEBUG,
+        'cur_path':  request.get_full_path(),
+        'messages':  [],
+        'lang':      request.LANGUAGE_CODE,
+        'menu':      menu,
     }
     base.update({"subnav": None})
     def add_subnav(title, url):
@@ -296,7 +348,7 @@ def base_ctx(section=None, subpage=None, request=None, context=None):
         base['adm'] = False
 
     if not base['adm']:
-        base['menu'][-1]['submenu'] = base['menu'][-1]['submenu'][:1]
+        menu[-1] = dict(menu[-1], submenu=menu[-1]['submenu'][:1])
 
     if section is not None:
         base['curpage'] = section
@@ -325,12 +377,7 @@ def base_ctx(section=None, subpage=None, request=None, context=None):
 
 
     if DEBUG:
-        p = subprocess.Popen(['git', '-C', PROJECT_PATH, 'rev-parse', 'HEAD'], stdout=subprocess.PIPE)
-        base['commithash'] = p.communicate()[0].decode().strip()[:8]
-
-        p = subprocess.Popen(['git', '-C', PROJECT_PATH, 'rev-parse', '--abbrev-ref', 'HEAD'],
-                             stdout=subprocess.PIPE)
-        base['commitbranch'] = p.communicate()[0].decode().strip()
+        base.update(get_git_info())
 
     return base
 # }}}
@@ -364,46 +411,55 @@ ntz = lambda k: k if k is not None else 0
 # }}}
 
 
-# {{{ search: Helper function for performing searches
-def search(query, search_for=['players', 'teams', 'events'], strict=False):
-    # {{{ Split query
+# {{{ split_query: Splits a search query into terms.
+def split_query(query):
     lex = shlex.shlex(query, posix=True)
     lex.wordchars += "'#-"
     lex.commenters = ''
     lex.quotes = '"'
 
-    terms = [s.strip() for s in list(lex) if s.strip() != '']
+    return [s.strip() for s in list(lex) if s.strip() != '']
+# }}}
+
+# {{{ search: Helper function for performing searches
+def search(query, search_for=['players', 'teams', 'events'], strict=False):
+    terms = split_query(query)
     if len(terms) == 0:
         return None
-    # }}}
 
     # {{{ Search for players, teams and events
+    # Every term is matched with icontains, which is served by the trigram indexes (see the search_indexes
+    # migration). Results are ranked by trigram similarity to the whole query, players then by current rating.
+    query = ' '.join(terms)
+
     if 'players' in search_for:
-        players = find_player(lst=terms, make=False, soft=True, strict=strict)
+        players = (
+            find_player(lst=terms, make=False, soft=True, strict=strict)
+                .annotate(similarity=TrigramSimilarity('tag', query))
+                .order_by('-similarity', F('current_rating__rating').desc(nulls_last=True), 'id')
+        )
     else:
         players = None
 
     if 'teams' in search_for:
         teams = Group.objects.filter(is_team=True)
+        for term in terms:
+            teams = teams.filter(Q(name__icontains=term) | Q(alias__name__icontains=term))
+        teams = (
+            teams.distinct()
+                .annotate(similarity=TrigramSimilarity('name', query))
+                .order_by('-similarity', 'name')
+        )
     else:
         teams = None
 
     if 'events' in search_for:
-        events = Event.objects.filter(type__in=[TYPE_CATEGORY, TYPE_EVENT]).order_by('idx')
-        events = events.filter(
-            fullname__iregex=(
-                r"\s".join(r".*{}.*".format(term) for term in terms)
-            )
-        )
+        events = Event.objects.filter(type__in=[TYPE_CATEGORY, TYPE_EVENT])
+        for term in terms:
+            events = events.filter(fullname__icontains=term)
+        events = events.annotate(similarity=TrigramSimilarity('fullname', query)).order_by('-similarity', 'idx')
     else:
         events = None
-
-    for term in terms:
-        if 'teams' in search_for:
-            teams = teams.filter(Q(name__icontains=term) | Q(alias__name__icontains=term))
-
-    if 'teams' in search_for:
-        teams = teams.distinct()
     # }}}
 
     return players, teams, events
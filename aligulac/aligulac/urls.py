@@ -8,6 +8,7 @@ from django.conf.urls import url
 import django.views.static
 
 import aligulac.views
+import ratings.api.export
 import ratings.team_views
 import ratings.ranking_views
 import ratings.player_views
@@ -141,6 +142,10 @@ urlpatterns = [
 
     path('admin/', admin.site.urls),
 
+    # Bulk exports
+    path('api/v1/export/rating/', ratings.api.export.ratings),
+    path('api/v1/export/match/', ratings.api.export.matches),
+
     # Tastypie
     path('api/', include(beta_api.urls)),
     path('api/', include(v1_api.urls)),
@@ -1,13 +1,13 @@
 # {{{ Imports
 from datetime import datetime
 from itertools import zip_longest
+import json
 import os
 
 from django import forms
 from django.contrib.auth import logout
 from django.contrib.auth.models import User
 from django.db.models import (
-    Count,
     Q,
 )
 from django.http import HttpResponseNotFound
@@ -19,6 +19,7 @@ from django.template.loader import render_to_string
 from django.utils.translation import ugettext_lazy as _
 from django.views.decorators.csrf import csrf_exempt
 
+from aligulac.autocomplete import autocomplete
 from aligulac.cache import cache_page
 from aligulac.settings import (
     DUMP_PATH,
@@ -33,6 +34,7 @@ from aligulac.tools import (
     Message,
     StrippedCharField,
     search as tools_search,
+    split_query,
 )
 
 from blog.models import Post
@@ -43,14 +45,13 @@ from ratings.models import (
     Group,
     HOTS,
     LOTV,
-    Match,
+    MatchCount,
     Player,
     Rating,
     WOL,
 )
 from ratings.templatetags.ratings_extras import urlfilter
 from ratings.tools import (
-    count_winloss_games,
     filter_active,
     populate_teams,
 )
@@ -379,33 +380,46 @@ def language(request):
 def db(request):
     base = base_ctx('About', 'Database', request)
 
+    # Match statistics are read from the trigger-maintained matchcount table
+    counts = list(MatchCount.objects.all())
+    nmatches, ngames = MatchCount.totals(counts)
+    nwol, nwolgames = MatchCount.totals(counts, game=WOL)
+    nhots, nhotsgames = MatchCount.totals(counts, game=HOTS)
+    nlotv, nlotvgames = MatchCount.totals(counts, game=LOTV)
+    nonline, nonlinegames = MatchCount.totals(counts, offline=False)
+
+    submitters = {}
+    for c in counts:
+        if c.submitter_id != 0 and c.matches > 0:
+            submitters[c.submitter_id] = submitters.get(c.submitter_id, 0) + c.matches
+    users = User.objects.in_bulk(list(submitters))
+    for uid, u in users.items():
+        u.nmatches = submitters[uid]
+
     base.update({
-        'nmatches':      Match.objects.all().count(),
-        'nuntreated':    Match.objects.filter(treated=False).count(),
-        'ngames':        sum(count_winloss_games(Match.objects.all())),
+        'nmatches':      nmatches,
+        'nuntreated':    MatchCount.totals(counts, treated=False)[0],
+        'ngames':        ngames,
 
-        'nwol':          Match.objects.filter(game=WOL).count(),
-        'nhots':         Match.objects.filter(game=HOTS).count(),
-        'nlotv':         Match.objects.filter(game=LOTV).count(),
-        'nwolgames':     sum(count_winloss_games(Match.objects.filter(game=WOL))),
-        'nhotsgames':    sum(count_winloss_games(Match.objects.filter(game=HOTS))),
-        'nlotvgames':    sum(count_winloss_games(Match.objects.filter(game=LOTV))),
+        'nwol':          nwol,
+        'nhots':         nhots,
+        'nlotv':         nlotv,
+        'nwolgames':     nwolgames,
+        'nhotsgames':    nhotsgames,
+        'nlotvgames':    nlotvgames,
 
-        'nonline':       Match.objects.filter(offline=False).count(),
-        'nonlinegames':  sum(count_winloss_games(Match.objects.filter(offline=False))),
+        'nonline':       nonline,
+        'nonlinegames':  nonlinegames,
 
-        'npartial':      Match.objects.exclude(eventobj__isnull=True, event='').count(),
-        'nfull':         Match.objects.filter(eventobj__isnull=False).count(),
+        'npartial':      MatchCount.totals(counts, partial=True)[0],
+        'nfull':         MatchCount.totals(counts, catalogued=True)[0],
 
         'nplayers':      Player.objects.all().count(),
         'nkoreans':      Player.objects.filter(country='KR').count(),
         'nteams':        Group.objects.filter(is_team=True).count(),
         'nactive':       Group.objects.filter(active=True, is_team=True).count(),
 
-        'submitters':    [
-            u for u in User.objects.all().annotate(nmatches=Count('match')).order_by('-nmatches')
-            if u.nmatches > 0
-        ],
+        'submitters':    sorted(users.values(), key=lambda u: -u.nmatches),
 
         'dump':          os.path.exists(DUMP_PATH),
         'updated':       datetime.fromtimestamp(os.stat(PROJECT_PATH + 'update').st_mtime),
@@ -420,6 +434,15 @@ def db(request):
         'ninactive':      base['nteams']   - base['nactive'],
     })
 
+    # Table statistics and dump timings written by dump.py
+    try:
+        with open(os.path.join(DUMP_PATH, 'dump_stats.json')) as f:
+            stats = json.load(f)
+        base['dbtables'] = [dict(t, **stats['tables'].get(t['name'], {})) for t in DBTABLES]
+        base['dump_seconds'] = stats.get('seconds')
+    except (OSError, ValueError, KeyError):
+        pass
+
     if base['dump']:
         stat = os.stat(os.path.join(DUMP_PATH, 'aligulac.sql'))
         base.update({
@@ -533,7 +556,7 @@ def search(request):
     return render_to_response('search.djhtml', base)
 # }}}
 
-# {{{ auto-complete search view
+# {{{ auto-complete search view (served from the in-memory index in aligulac.autocomplete)
 EXTRA_NULL_SELECT = {
     'null_curr': 'CASE WHEN player.current_rating_id IS NULL THEN 0 ELSE 1 END'
 }
@@ -541,54 +564,13 @@ EXTRA_NULL_SELECT = {
 def auto_complete_search(request):
     query = get_param(request, 'q', '')
     search_for = get_param(request, 'search_for', 'players,teams,events')
-    search_for = search_for.split(',')
-
-    results = tools_search(query, search_for, strict=True)
+    search_for = [s for s in search_for.split(',') if s in ['players', 'teams', 'events']]
 
-    data = {}
-    if results is None:
-        return JsonResponse(data)
-
-    players, teams, events = results
+    terms = split_query(query)
+    if len(terms) == 0:
+        return JsonResponse({})
 
-    if players is not None:
-        players = players.extra(select=EXTRA_NULL_SELECT)\
-                         .order_by("-null_curr", "-current_rating__rating")
-
-        num = 5 if teams is not None or events is not None else 10
-        data['players'] = [{
-            "id": p.id,
-            "tag": p.tag,
-            "race": p.race,
-            "country": p.country,
-            "aliases": [a.name for a in p.alias_set.all()],
-            "teams": [
-                (t.group.name, t.group.shortname)
-                for t in p.groupmembership_set.filter(
-                        current=True,
-                        group__is_team=True
-                )]
-        } for p in players[:num]]
-
-    if teams is not None:
-        teams = teams.order_by('name')
-
-        num = 5 if players is not None or events is not None else 10
-        data['teams'] = [{
-            "id": t.id,
-            "name": t.name
-            } for t in teams[:num]]
-
-    if events is not None:
-        events = events.order_by("fullname")
-
-        num = 5 if players is not None or teams is not None else 10
-        data['events'] = [{
-            "id": e.id,
-            "fullname": e.fullname
-            } for e in events[:num]]
-
-    return JsonResponse(data)
+    return JsonResponse(autocomplete(terms, search_for))
 # }}}
 
 # {{{ Login, logout and change password
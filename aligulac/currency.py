@@ -1,96 +1,174 @@
 from django.utils.translation import ugettext as _
 import json
-import urllib
+import urllib.error
+import urllib.request
 from aligulac import settings
 from datetime import datetime, timedelta
 from decimal import Decimal
+from numpy import array
 #Class adapted from https://bitbucket.org/alquimista/currency
 
-class ExchangeRates(object):
-
-    def __init__(self, date):
-        self._date = date
-        self._data = self._loadjson(date)
-
-    def _loadjson(self, date):
-        date = self._date.strftime('%Y-%m-%d')
-        url = 'http://openexchangerates.org/api/historical/' + date + '.json?app_id=' + settings.EXCHANGE_ID
-        try:
-            jsonfile = urllib.request.urlopen(url)
-        except urllib.error.HTTPerror as err:
-            #API limit reached for the month or other error
-            return False
-
-        data = json.loads(jsonfile.read().decode())
+# How many days before and after a date are searched for when a currency has no rate on that date
+INTERPOLATION_DAYS = 20
+
+# {{{ Sources
+# A source is a function taking a date and returning a dict of rates (units per USD) for that day, or None if
+# they're not available.
+
+def normalize(rates):
+    rates.setdefault('USD', 1.0)
+
+    # ccy use XBT instead
+    if 'BTC' in rates:
+        rates['XBT'] = rates['BTC']
+    return rates
+
+# {{{ fetch_day(date): Fetches the rates of a day from openexchangerates.org
+def fetch_day(date):
+    date = date.strftime('%Y-%m-%d')
+    url = 'http://openexchangerates.org/api/historical/' + date + '.json?app_id=' + settings.EXCHANGE_ID
+    try:
+        jsonfile = urllib.request.urlopen(url)
+    except urllib.error.URLError as err:
+        #API limit reached for the month or other error
+        return None
+
+    data = json.loads(jsonfile.read().decode())
+    return normalize(data['rates'])
+# }}}
+
+# {{{ FixtureSource(path): Reads rates from a JSON file mapping dates (YYYY-MM-DD) to dicts of rates, for use
+# without network access (see EXCHANGE_FIXTURE in local.py) and for importing rates in bulk.
+class FixtureSource(object):
+
+    def __init__(self, path):
+        with open(path) as f:
+            self.days = {
+                datetime.strptime(d, '%Y-%m-%d').date(): normalize(rates)
+                for d, rates in json.load(f).items()
+            }
+
+    def __call__(self, date):
+        return self.days.get(date)
+# }}}
+
+def default_source():
+    if settings.EXCHANGE_FIXTURE:
+        return FixtureSource(settings.EXCHANGE_FIXTURE)
+    return fetch_day
+# }}}
+
+# {{{ RateStore
+# Keeps the rates of every day it has seen in memory. If a backend (ratings.models.ExchangeRate) is given, days
+# are read from it, and days fetched from the source are written to it, so each day is only fetched once.
+class RateStore(object):
+
+    def __init__(self, backend=None, source=None):
+        self.backend = backend
+        self.source = source
+        self._days = {}
+        self._interpolated = {}
+
+    def _fetch(self, date):
+        if self.source is None:
+            self.source = default_source()
+
+        rates = self.source(date)
+        if rates and self.backend is not None:
+            self.backend.import_days({date: rates})
+        return rates
+
+    # {{{ preload(dates): Loads the given dates, and the days around them that may be needed for interpolation,
+    # from the backend with one query. Dates that are still missing are fetched from the source.
+    def preload(self, dates):
+        dates = {d for d in dates if d is not None}
+        if not dates:
+            return
+
+        if self.backend is not None:
+            window = timedelta(days=INTERPOLATION_DAYS)
+            for date, rates in self.backend.load(min(dates) - window, max(dates) + window).items():
+                self._days.setdefault(date, rates)
+
+        for date in dates - set(self._days):
+            rates = self._fetch(date)
+            if rates:
+                self._days[date] = rates
+    # }}}
+
+    # {{{ day(date): Returns the rates of a day, fetching them if needed. Missing days give an empty dict, and
+    # are tried again on the next call.
+    def day(self, date):
+        if date not in self._days:
+            rates = self._fetch(date)
+            if not rates:
+                return {}
+            self._days[date] = rates
+        return self._days[date]
+    # }}}
+
+    # {{{ rates(date, currencies): Returns a dict of rates for the given currencies on a date, interpolating
+    # those that are missing.
+    def rates(self, date, currencies):
+        day = self.day(date)
+        ret = {c: day[c] for c in currencies if c in day}
+        ret.update({c: self._interpolated[date, c] for c in currencies if (date, c) in self._interpolated})
+
+        missing = [c for c in currencies if c not in ret]
+        if missing:
+            for c, rate in zip(missing, self.interpolate(date, missing)):
+                self._interpolated[date, c] = ret[c] = rate
+        return ret
+    # }}}
+
+    # {{{ interpolate(date, currencies): Linearly interpolates the rates for the given currencies by using the
+    # rates closest before and after the date. Returns a list of rates in the same order.
+    def interpolate(self, date, currencies):
+        one_day = timedelta(days=1)
 
-        #print(sorted(data['rates'].keys()))
+        def nearest(step):
+            found = {}
+            for n in range(1, INTERPOLATION_DAYS + 1):
+                day = self.day(date + n * step)
+                for c in currencies:
+                    if c not in found and c in day:
+                        found[c] = (n, day[c])
+                if len(found) == len(currencies):
+                    break
+            return found
+
+        after = nearest(one_day)
+        before = nearest(-one_day) if after else {}
+        for c in currencies:
+            if c not in after or c not in before:
+                raise RateNotFoundError(c, date)
+
+        nafter, rate_after = array([after[c] for c in currencies], dtype=float).T
+        nbefore, rate_before = array([before[c] for c in currencies], dtype=float).T
+        coeff = (rate_after - rate_before) / (nafter + nbefore)
+        return list(rate_before + coeff * nbefore)
+    # }}}
 
-        # ccy use XBT instead
-        try:
-            data['rates']['XBT'] = data['rates']['BTC']
-        except:
-            # Bitcoin transfer rates not available at this time.
-            pass
+    # {{{ convert(date, amount, currencyfrom, currencyto='USD'): Converts an amount with the rates of a date
+    def convert(self, date, amount, currencyfrom, currencyto='USD'):
+        currencyfrom, currencyto = currencyfrom.upper(), currencyto.upper()
+        rates = self.rates(date, [currencyfrom, currencyto])
+        return amount * Decimal(rates[currencyto]) / Decimal(rates[currencyfrom])
+    # }}}
+# }}}
 
-        return data
+class ExchangeRates(object):
 
-    def _tobase(self, amount, currency):
-        return amount * Decimal(self.rates[currency])
+    def __init__(self, date, store=None):
+        self._date = date
+        self._store = store if store is not None else RateStore()
 
     @property
     def rates(self):
-        return self._data['rates']
+        return self._store.day(self._date)
 
     def convert(self, amount, currencyfrom, currencyto='USD'):
-        if currencyfrom not in self.rates:
-            self.interpolate(currencyfrom)
-        if currencyto not in self.rates:
-            self.interpolate(currencyto)
-
-        usd = self._tobase(amount, currencyto.upper())
-        return usd / Decimal(self.rates[currencyfrom.upper()])
-
-    def interpolate(self, currency):
-        """
-        Linearly interpolates the rate for `currency`
-        by using the rates closest before and after the
-        current date.
-        """
-        one_day = timedelta(days=1)
-
-        after = self._date + one_day
-        nafter = 1
-        before = self._date - one_day
-        nbefore = 1
-
-        rate_after = None
-        rate_before = None
-
-        tries = 0
-        while rate_after is None and tries < 20:
-            e = ExchangeRates(after)
-            if currency in e.rates:
-                rate_after = e.rates[currency]
-                break
-            after += one_day
-            nafter += 1
-            tries += 1
-
-        tries = 0
-        while rate_before is None and tries < 20 and rate_after is not None:
-            e = ExchangeRates(before)
-            if currency in e.rates:
-                rate_before = e.rates[currency]
-                break
-            before -= one_day
-            nbefore += 1
-            tries += 1
-
-        if rate_after is None or rate_after is None:
-            raise RateNotFoundError(currency, self._date)
-
-        coeff = (rate_after - rate_before) / (nafter + nbefore)
-        self.rates[currency] =  rate_before + coeff * nbefore
+        return self._store.convert(self._date, amount, currencyfrom, currencyto)
 
 
 class RateNotFoundError(Exception):
@@ -99,6 +177,6 @@ class RateNotFoundError(Exception):
             _("Exchange rate not found for currency %(code)s on %(date)s") % {
                 'code': currency,
                 'date': date,
-            }, 
+            },
             *args, **kwargs
         )
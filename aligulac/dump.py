@@ -1,15 +1,27 @@
 #!/usr/bin/env python3
 
-from datetime import datetime
+# {{{ Imports
 import os
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'aligulac.settings')
+import django
+django.setup()
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import json
+import shutil
 import subprocess
 from subprocess import Popen
-import shutil
+from time import perf_counter
+
+from django.db import connection
 
 from aligulac.settings import (
     DATABASES,
     DUMP_PATH,
 )
+# }}}
 
 public_tables = [
     'alias',
@@ -26,15 +38,16 @@ public_tables = [
     'story',
 ]
 
-def info(string):
-    print("[{}]: {}".format(datetime.now(), string), flush=True)
-
-dt = datetime.now()
+# The dumps are compressed as they are produced, with pigz (multithreaded) if it's installed. Every file is
+# written to a temporary name and renamed when complete, so the files being served are never partial.
+COMPRESSOR = ['pigz'] if shutil.which('pigz') else ['gzip']
+CHUNK_SIZE = 1 << 20
 
+# Statistics for the /about/db/ page
+STATS_PATH = os.path.join(DUMP_PATH, 'dump_stats.json')
 
-# {{{ Backup and private dump
-
-info("Dumping full database.")
+def info(string):
+    print("[{}]: {}".format(datetime.now(), string), flush=True)
 
 pg_dump = [
     "pg_dump", "-O", "-c", "-U",
@@ -42,47 +55,80 @@ pg_dump = [
     DATABASES['default']['NAME']
 ]
 
-full_path = os.path.join(DUMP_PATH, 'full.sql.gz')
-with open(full_path, "w") as f:
-    p_pg = Popen(pg_dump, stdout=subprocess.PIPE)
-    p_gzip = Popen(["gzip"], stdin=p_pg.stdout, stdout=f)
-    p_gzip.communicate()
+# {{{ dump(command, plain_path, gz_path): Runs pg_dump, writing the output compressed to gz_path, and also
+# uncompressed to plain_path unless it's None. Returns the time taken.
+def dump(command, plain_path, gz_path):
+    start = perf_counter()
+    targets = [p for p in (plain_path, gz_path) if p is not None]
+
+    with open(gz_path + '.tmp', 'wb') as gz:
+        p_pg = Popen(command, stdout=subprocess.PIPE)
+        p_gzip = Popen(COMPRESSOR, stdin=subprocess.PIPE, stdout=gz)
+
+        plain = open(plain_path + '.tmp', 'wb') if plain_path is not None else None
+        try:
+            for chunk in iter(lambda: p_pg.stdout.read(CHUNK_SIZE), b''):
+                p_gzip.stdin.write(chunk)
+                if plain is not None:
+                    plain.write(chunk)
+        finally:
+            p_gzip.stdin.close()
+            if plain is not None:
+                plain.close()
+
+        if p_pg.wait() != 0 or p_gzip.wait() != 0:
+            for p in targets:
+                os.remove(p + '.tmp')
+            raise RuntimeError('Dumping to %s failed' % gz_path)
+
+    for p in targets:
+        os.replace(p + '.tmp', p)
+
+    return perf_counter() - start
 # }}}
 
-# {{{ Public dump
-
-info("Dumping public database.")
-
-public_path = os.path.join(DUMP_PATH, 'aligulac.sql')
-
-pub_pg_dump = pg_dump[:5]
-
-for tbl in public_tables:
-    pub_pg_dump.extend(['-t', tbl])
-
-pub_pg_dump.append(pg_dump[-1])
-
-with open(public_path, 'w') as f:
-    subprocess.call(pub_pg_dump, stdout=f)
-
+# {{{ table_stats: Returns the number of rows and size on disk of each public table. The row count is an estimate,
+# and None for tables that haven't been analyzed yet (reltuples is -1 then).
+def table_stats():
+    cur = connection.cursor()
+    cur.execute(
+        'SELECT c.relname, CASE WHEN c.reltuples < 0 THEN NULL ELSE c.reltuples::bigint END, '
+        'pg_total_relation_size(c.oid) FROM pg_class c '
+        'JOIN pg_namespace n ON n.oid = c.relnamespace '
+        'WHERE n.nspname = current_schema() AND c.relkind = \'r\' AND c.relname = ANY(%s)',
+        [public_tables]
+    )
+    return {name: {'rows': rows, 'bytes': size} for name, rows, size in cur.fetchall()}
 # }}}
 
-# {{{ Compress/decompress files
-
-def compress_file(source):
-    info("Compressing {}".format(source))
-    with open(source, "r") as src:
-        with open(source + ".gz", "w") as dst:
-            subprocess.call(["gzip"], stdin=src, stdout=dst)
-
-def decompress_file(source):
-    info("Decompressing {}".format(source))
-    with open(source, "r") as src:
-        with open(source[:-3], "w") as dst:
-            subprocess.call(["gunzip"], stdin=src, stdout=dst)
-
-
-compress_file(public_path)
-decompress_file(full_path)
-
-# }}}
+if __name__ == '__main__':
+    pub_pg_dump = pg_dump[:5]
+    for tbl in public_tables:
+        pub_pg_dump.extend(['-t', tbl])
+    pub_pg_dump.append(pg_dump[-1])
+
+    info("Dumping full and public database.")
+
+    # The private (full) dump is only kept compressed, the public one is also served uncompressed
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        full = pool.submit(dump, pg_dump, None, os.path.join(DUMP_PATH, 'full.sql.gz'))
+        public = pool.submit(
+            dump, pub_pg_dump,
+            os.path.join(DUMP_PATH, 'aligulac.sql'),
+            os.path.join(DUMP_PATH, 'aligulac.sql.gz'),
+        )
+        timings = {'full': full.result(), 'public': public.result()}
+
+    info("Dumped full database in %.1fs, public database in %.1fs." % (timings['full'], timings['public']))
+
+    stats = {
+        'date': datetime.now().isoformat(),
+        'seconds': timings,
+        'tables': table_stats(),
+    }
+    with open(STATS_PATH + '.tmp', 'w') as f:
+        json.dump(stats, f)
+    os.replace(STATS_PATH + '.tmp', STATS_PATH)
+
+    for name, t in sorted(stats['tables'].items()):
+        info("  %s: %i rows, %.1f MiB" % (name, t['rows'], t['bytes'] / 1048576))
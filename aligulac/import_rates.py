@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+# {{{ Imports
+import os
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'aligulac.settings')
+import django
+django.setup()
+
+from datetime import datetime, timedelta
+import sys
+
+from currency import (
+    fetch_day,
+    FixtureSource,
+)
+from ratings.models import ExchangeRate
+# }}}
+
+# Imports exchange rates into the local store, either from a JSON file mapping dates (YYYY-MM-DD) to dicts of
+# rates, or by fetching a range of days from openexchangerates.org. Days that are already stored are skipped.
+#
+#   ./import_rates.py rates.json
+#   ./import_rates.py 2013-01-01 2013-12-31
+
+def info(string):
+    print("[{}]: {}".format(datetime.now(), string), flush=True)
+
+if __name__ == '__main__':
+    if len(sys.argv) == 2:
+        days = FixtureSource(sys.argv[1]).days
+    elif len(sys.argv) == 3:
+        start, end = (datetime.strptime(d, '%Y-%m-%d').date() for d in sys.argv[1:])
+        stored = set(ExchangeRate.objects.filter(date__gte=start, date__lte=end).values_list('date', flat=True))
+
+        days = {}
+        while start <= end:
+            if start not in stored:
+                rates = fetch_day(start)
+                if rates:
+                    days[start] = rates
+                else:
+                    info("No rates for %s" % start)
+            start += timedelta(days=1)
+    else:
+        print("Usage: %s <file.json> | <from> <to>" % sys.argv[0])
+        sys.exit(1)
+
+    ExchangeRate.import_days(days)
+    info("Imported rates for %i days" % len(days))
@@ -1,9 +1,17 @@
+from django.core.cache import cache
 from django.db import models
 from django.contrib.auth.models import User
 
 import random
 import string
 
+from aligulac.counters import BufferedCounter
+
+# Hits are counted in memory and written to the database in batches, at most every FLUSH_SECONDS seconds or
+# FLUSH_HITS hits (per process), and when the process exits (see aligulac.counters).
+FLUSH_SECONDS = 60
+FLUSH_HITS = 100
+
 class MiniURL(models.Model):
     class Meta:
         verbose_name = "Mini URL"
@@ -27,3 +35,21 @@ class MiniURL(models.Model):
     def generate(self, N=16):
         characters = string.ascii_letters + string.digits
         self.code = ''.join([random.choice(characters) for _ in range(N)])
+
+    # Returns the URL for a code, or None. URLs never change, so they're cached forever.
+    @staticmethod
+    def get_url(code):
+        key = 'miniurl:%s' % code
+        url = cache.get(key)
+        if url is None:
+            url = MiniURL.objects.filter(code=code).values_list('longURL', flat=True).first()
+            if url is not None:
+                cache.set(key, url, None)
+        return url
+
+    # Counts a hit, flushing the counts if it's time
+    @staticmethod
+    def count_hit(code):
+        hits.count(code)
+
+hits = BufferedCounter(MiniURL, 'code', 'nb_access', FLUSH_SECONDS, FLUSH_HITS)
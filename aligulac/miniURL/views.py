@@ -1,11 +1,10 @@
 import html.parser
 
-from django.http import HttpResponse
-from django.shortcuts import render, redirect, get_object_or_404
+from django.http import Http404, HttpResponse
+from django.shortcuts import render, redirect
 from django.views.decorators.csrf import csrf_protect
 from django.utils.translation import ugettext_lazy as _
 
-from aligulac.cache import cache_page
 from aligulac.tools import base_ctx
 
 from miniURL.models import MiniURL
@@ -24,10 +23,10 @@ def new(request):
 
     return HttpResponse(miniURL.code)
 
-@cache_page
 def find_redirect(request, code):
-    mini = get_object_or_404(MiniURL, code=code)
-    mini.nb_access += 1
-    mini.save()
+    url = MiniURL.get_url(code)
+    if url is None:
+        raise Http404
 
-    return redirect(mini.longURL, permanent=True)
+    MiniURL.count_hit(code)
+    return redirect(url, permanent=True)
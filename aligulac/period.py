@@ -15,6 +15,7 @@ import sys
 from django.db import connection
 from django.db.models import Q
 
+from aligulac.cache import bump_generation
 from aligulac.tools import etn
 from aligulac.settings import (
     DECAY_DEV,
@@ -33,6 +34,7 @@ from ratings.models import (
     Match,
     P,
     Period,
+    PeriodSummary,
     Player,
     Rating,
     T,
@@ -293,6 +295,10 @@ cur.execute('''
     ) r
     WHERE rating.id = r.id''' % (period.id, INACTIVE_THRESHOLD)
 )
+
+PeriodSummary.refresh(period)
+
+bump_generation('period', period.id)
 # }}}
 
 print(
@@ -17,7 +17,9 @@ from tastypie.models import ApiKey as TPApiKey
 from ratings.models import (
     Alias,
     APIKey,
+    DirtyEvent,
     Earnings,
+    EarningsSummary,
     Event,
     EventAdjacency,
     Group,
@@ -153,6 +155,8 @@ class MatchForm(forms.ModelForm):
 
 def match_delete_wrapper(f):
     def wrapper(self, request, objlist):
+        # Queryset deletes bypass Match.delete, so the event dates are refreshed by the next update
+        DirtyEvent.mark(objlist.values_list('eventobj_id', flat=True))
         result = f(self, request, objlist)
         for obj in objlist:
             obj.period.needs_recompute = True
@@ -254,6 +258,15 @@ class EventAdmin(admin.ModelAdmin):
     def has_add_permission(self, request):
         return False
 
+    # Deleting events deletes their earnings, so the earnings summaries of the players are refreshed
+    def delete_model(self, request, obj):
+        self.delete_queryset(request, Event.objects.filter(id=obj.id))
+
+    def delete_queryset(self, request, queryset):
+        players = set(Earnings.objects.filter(event__in=queryset).values_list('player_id', flat=True))
+        super().delete_queryset(request, queryset)
+        EarningsSummary.refresh(players)
+
 class PreMatchGroupAdmin(admin.ModelAdmin):
     list_display = ('date', 'event')
 
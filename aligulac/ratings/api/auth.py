@@ -0,0 +1,87 @@
+# {{{ Imports
+import time
+
+from tastypie.authentication import Authentication
+from tastypie.throttle import BaseThrottle
+
+from django.core.cache import cache
+
+from aligulac.counters import BufferedCounter
+from aligulac.settings import (
+    API_KEY_CACHE_SECONDS,
+    API_RATE_LIMITS,
+    API_USAGE_FLUSH_SECONDS,
+    DEBUG,
+)
+
+from ratings.models import APIKey
+# }}}
+
+# {{{ API key authentication
+# Valid keys are remembered in-process for API_KEY_CACHE_SECONDS, so most requests don't touch the database.
+# Requests are counted in memory and added to APIKey.requests every API_USAGE_FLUSH_SECONDS (per process), and
+# when the process exits (see aligulac.counters).
+_valid_keys = {}
+usage = BufferedCounter(APIKey, 'key', 'requests', API_USAGE_FLUSH_SECONDS)
+
+def get_key(request):
+    try:
+        return request.POST['apikey'] if request.method == 'POST' else request.GET['apikey']
+    except KeyError:
+        return None
+
+def is_valid_key(key):
+    now = time.monotonic()
+    if _valid_keys.get(key, 0) > now:
+        return True
+    if APIKey.objects.filter(key=key).exists():
+        _valid_keys[key] = now + API_KEY_CACHE_SECONDS
+        return True
+    return False
+
+class APIKeyAuthentication(Authentication):
+    def is_authenticated(self, request, **kwargs):
+        if DEBUG:
+            return True
+
+        key = get_key(request)
+        if key is None or not is_valid_key(key):
+            return False
+
+        usage.count(key)
+        return True
+
+    # Throttling is per key
+    def get_identifier(self, request):
+        return get_key(request) or 'nokey'
+# }}}
+
+# {{{ Token bucket throttle
+# Each key gets a bucket per group of resources (see API_RATE_LIMITS), holding up to burst tokens and refilled
+# at rate tokens per second. A request takes one token, and is refused with 429 if there are none. The buckets
+# are stored in the cache so they're shared between processes. The read-modify-write isn't atomic, so
+# concurrent requests may occasionally slip through, which is fine for this purpose.
+class TokenBucketThrottle(BaseThrottle):
+    def __init__(self, group):
+        super().__init__()
+        self.group = group
+        self.rate, self.burst = API_RATE_LIMITS[group]
+
+    def should_be_throttled(self, identifier, **kwargs):
+        if DEBUG:
+            return False
+
+        key = 'throttle:%s:%s' % (self.group, identifier)
+        now = time.time()
+        tokens, last = cache.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+
+        throttled = tokens < 1
+        if not throttled:
+            tokens -= 1
+        cache.set(key, (tokens, now), int(self.burst / self.rate) + 60)
+        return throttled
+
+    def accessed(self, identifier, **kwargs):
+        pass
+# }}}
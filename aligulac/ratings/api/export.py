@@ -0,0 +1,126 @@
+# {{{ Imports
+import csv
+from datetime import datetime
+from itertools import chain
+import json
+
+from django.http import (
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseForbidden,
+    StreamingHttpResponse,
+)
+
+from ratings.api.auth import (
+    APIKeyAuthentication,
+    TokenBucketThrottle,
+)
+from ratings.models import (
+    Match,
+    Rating,
+)
+# }}}
+
+# Bulk exports of ratings and matches. Rows are flat (player ids and tags are joined in SQL, not dehydrated
+# through nested resources), read through a server-side cursor and streamed as they are produced, as NDJSON
+# (one JSON object per line, the default) or CSV (format=csv).
+
+RATING_FIELDS = [
+    'id', 'period_id', 'player_id', 'player__tag', 'player__race', 'player__country',
+    'rating', 'rating_vp', 'rating_vt', 'rating_vz',
+    'dev', 'dev_vp', 'dev_vt', 'dev_vz',
+    'position', 'position_vp', 'position_vt', 'position_vz',
+    'decay', 'domination',
+]
+
+MATCH_FIELDS = [
+    'id', 'period_id', 'date',
+    'pla_id', 'pla__tag', 'rca', 'sca',
+    'plb_id', 'plb__tag', 'rcb', 'scb',
+    'rta_id', 'rtb_id', 'eventobj_id', 'eventobj__fullname',
+    'game', 'offline', 'treated',
+]
+
+CHUNK_SIZE = 2000
+
+# {{{ check_access(request): Returns an error response if the request has no valid API key or is throttled
+def check_access(request):
+    auth = APIKeyAuthentication()
+    if not auth.is_authenticated(request):
+        return HttpResponseForbidden()
+    if TokenBucketThrottle('list').should_be_throttled(auth.get_identifier(request)):
+        return HttpResponse(status=429)
+    return None
+# }}}
+
+# {{{ Echo: File-like object that returns what is written to it, for csv.writer
+class Echo:
+    def write(self, value):
+        return value
+# }}}
+
+# {{{ stream(request, queryset, fields, name): Streams the rows of a queryset in the requested format
+def stream(request, queryset, fields, name):
+    rows = queryset.values_list(*fields).iterator(chunk_size=CHUNK_SIZE)
+    names = [f.replace('__', '_') for f in fields]
+
+    if request.GET.get('format') == 'csv':
+        writer = csv.writer(Echo())
+        response = StreamingHttpResponse(
+            (writer.writerow(r) for r in chain([names], rows)),
+            content_type='text/csv',
+        )
+        response['Content-Disposition'] = 'attachment; filename="%s.csv"' % name
+    else:
+        response = StreamingHttpResponse(
+            (json.dumps(dict(zip(names, r)), default=str) + '\n' for r in rows),
+            content_type='application/x-ndjson',
+        )
+
+    return response
+# }}}
+
+# {{{ parse_date(request, key): Returns the date in the given GET parameter, None if not given
+def parse_date(request, key):
+    if not request.GET.get(key):
+        return None
+    return datetime.strptime(request.GET[key], '%Y-%m-%d').date()
+# }}}
+
+# {{{ ratings: Exports all ratings of a period (?period=<id>)
+def ratings(request):
+    error = check_access(request)
+    if error is not None:
+        return error
+
+    try:
+        period = int(request.GET['period'])
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest('A period id is required.')
+
+    queryset = Rating.objects.filter(period_id=period).order_by('id')
+    return stream(request, queryset, RATING_FIELDS, 'ratings-%i' % period)
+# }}}
+
+# {{{ matches: Exports matches, optionally filtered by period (?period=<id>) or date range (?from=, ?to=,
+# inclusive, as YYYY-MM-DD)
+def matches(request):
+    error = check_access(request)
+    if error is not None:
+        return error
+
+    queryset = Match.objects.order_by('id')
+    try:
+        if request.GET.get('period'):
+            queryset = queryset.filter(period_id=int(request.GET['period']))
+        start, end = parse_date(request, 'from'), parse_date(request, 'to')
+    except ValueError:
+        return HttpResponseBadRequest('Invalid period or date.')
+
+    if start is not None:
+        queryset = queryset.filter(date__gte=start)
+    if end is not None:
+        queryset = queryset.filter(date__lte=end)
+
+    return stream(request, queryset, MATCH_FIELDS, 'matches')
+# }}}
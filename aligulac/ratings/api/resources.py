@@ -1,18 +1,28 @@
+from urllib.parse import urlencode
 from urllib.request import unquote
 
 from datetime import date
 from dateutil.relativedelta import relativedelta
 
 from tastypie import fields
-from tastypie.authentication import Authentication
+from tastypie.exceptions import BadRequest
+from tastypie.paginator import Paginator
 from tastypie.resources import Resource, ModelResource, ALL, ALL_WITH_RELATIONS
 
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
-from django.db.models import F, Sum
+from django.db.models import Sum
 
-from aligulac.settings import DEBUG
+from aligulac.cache import (
+    conditional_response,
+    generation_key,
+    get_generations,
+)
 from aligulac.tools import ntz
 
+from ratings.api.auth import (
+    APIKeyAuthentication,
+    TokenBucketThrottle,
+)
 from ratings.inference_views import (
     DualPredictionResult,
     MatchPredictionResult,
@@ -21,7 +31,6 @@ from ratings.inference_views import (
     ProleaguePredictionResult,
 )
 from ratings.models import (
-    APIKey,
     Earnings,
     Event,
     Group,
@@ -39,25 +48,71 @@ from ratings.tools import (
     count_matchup_player,
 )
 
-class APIKeyAuthentication(Authentication):
-    def is_authenticated(self, request, **kwargs):
-        if DEBUG:
-            return True
-
+# Paginates by ID if the request has an after parameter: returns the objects with IDs greater than after, in
+# order of ID, with a link to the next page (after the last ID on this page). Unlike offset pagination, deep pages
+# cost the same as the first one, and the total count is not computed. Since the order is fixed, combining after
+# with order_by is a bad request.
+class KeysetPaginator(Paginator):
+    def get_after(self):
         try:
-            key = request.POST['apikey'] if request.method == 'POST' else request.GET['apikey']
-        except:
-            return False
-
-        modified = APIKey.objects.filter(key=key).update(requests=F('requests')+1)
-        return modified == 1
+            return int(self.request_data['after'])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def page(self):
+        after = self.get_after()
+        if after is None:
+            return super().page()
+        if 'order_by' in self.request_data:
+            raise BadRequest("The after parameter pages by ID and can't be combined with order_by.")
+
+        limit = self.get_limit()
+        objects = self.objects.filter(id__gt=after).order_by('id')
+        objects = list(objects[:limit] if limit else objects)
+
+        meta = {
+            'limit': limit,
+            'after': after,
+            'next': None,
+            'previous': None,
+            'total_count': None,
+        }
 
-class PeriodResource(ModelResource):
+        if limit and len(objects) == limit and self.resource_uri is not None:
+            params = {k: v for k, v in self.request_data.items() if k not in ('after', 'offset', 'limit')}
+            params.update({'limit': limit, 'after': objects[-1].id})
+            meta['next'] = '%s?%s' % (self.resource_uri, urlencode(params))
+
+        return {self.collection_name: objects, 'meta': meta}
+
+# Validates GET requests with an ETag derived from the global data generation, for resources that only change
+# with updates. Ratings embed their players, whose details can be edited between updates, so the 'players'
+# generation (bumped by Player.save) is part of the ETag too, and there's no Last-Modified (the update marker
+# doesn't change with such edits). A client polling between updates gets a 304 without the response being
+# serialized.
+class ConditionalResourceMixin:
+    def dispatch(self, request_type, request, **kwargs):
+        get_response = lambda: super(ConditionalResourceMixin, self).dispatch(request_type, request, **kwargs)
+        if request.method not in ('GET', 'HEAD'):
+            return get_response()
+
+        tokens = get_generations([generation_key(), generation_key('players')])
+        response = conditional_response(request, tokens, None, get_response)
+
+        # Requests answered with a 304 must still be authenticated, throttled and counted
+        if response.status_code == 304:
+            self.is_authenticated(request)
+            self.throttle_check(request)
+            self.log_throttled_access(request)
+        return response
+
+class PeriodResource(ConditionalResourceMixin, ModelResource):
     class Meta:
         queryset = Period.objects.filter(computed=True)
         allowed_methods = ['get', 'post']
         resource_name = 'period'
         authentication = APIKeyAuthentication()
+        throttle = TokenBucketThrottle('list')
         excludes = ['computed']
         filtering = {
             'id':               ALL,
@@ -79,7 +134,9 @@ class SmallRatingResource(ModelResource):
         queryset = total_ratings(Rating.objects.all())
         allowed_methods = ['get', 'post']
         resource_name = 'rating'
+        paginator_class = KeysetPaginator
         authentication = APIKeyAuthentication()
+        throttle = TokenBucketThrottle('list')
         fields = [
             'id',
             'rating', 'rating_vp', 'rating_vt', 'rating_vz',
@@ -107,12 +164,14 @@ class SmallRatingResource(ModelResource):
         bundle.data['tot_vz'] = bundle.data['rating'] + bundle.data['rating_vz']
         return bundle
 
-class RatingResource(ModelResource):
+class RatingResource(ConditionalResourceMixin, ModelResource):
     class Meta:
         queryset = total_ratings(Rating.objects.all())
         allowed_methods = ['get', 'post']
         resource_name = 'rating'
+        paginator_class = KeysetPaginator
         authentication = APIKeyAuthentication()
+        throttle = TokenBucketThrottle('list')
         filtering = {
             'id':         ALL,
             'period':     ALL_WITH_RELATIONS,
@@ -152,12 +211,14 @@ class RatingResource(ModelResource):
     player = fields.ForeignKey('ratings.api.resources.SmallPlayerResource', 'player', null=False, full=True)
     prev = fields.ForeignKey('self', 'prev', null=True)
 
-class ActiveRatingResource(ModelResource):
+class ActiveRatingResource(ConditionalResourceMixin, ModelResource):
     class Meta:
         queryset = filter_active(total_ratings(Rating.objects.all()))
         allowed_methods = ['get', 'post']
         resource_name = 'activerating'
+        paginator_class = KeysetPaginator
         authentication = APIKeyAuthentication()
+        throttle = TokenBucketThrottle('list')
         filtering = {
             'id':         ALL,
             'period':     ALL_WITH_RELATIONS,
@@ -203,6 +264,7 @@ class SmallPlayerResource(ModelResource):
         allowed_methods = ['get', 'post']
         resource_name = 'player'
         authentication = APIKeyAuthentication()
+        throttle = TokenBucketThrottle('list')
         fields = ['id', 'tag', 'country', 'race']
         filtering = {
             'id':       ALL,
@@ -217,6 +279,7 @@ class PlayerResource(ModelResource):
         allowed_methods = ['get', 'post']
         resource_name = 'player'
         authentication = APIKeyAuthentication()
+        throttle = TokenBucketThrottle('list')
         filtering = {
             'id':              ALL,
             'tag':             ALL,
@@ -280,6 +343,7 @@ class SmallEventResource(ModelResource):
         allowed_methods = ['get', 'post']
         resource_name = 'event'
         authentication = APIKeyAuthentication()
+        throttle = TokenBucketThrottle('list')
         fields = ['id', 'fullname']
         filtering = {
             'id':         ALL,
@@ -304,6 +368,7 @@ class EventResource(ModelResource):
         allowed_methods = ['get', 'post']
         resource_name = 'event'
         authentication = APIKeyAuthentication()
+        throttle = TokenBucketThrottle('list')
         excludes = ['lft', 'rgt', 'closed', 'big', 'noprint']
         filtering = {
             'id':         ALL,
@@ -352,7 +417,9 @@ class MatchResource(ModelResource):
         queryset = Match.objects.all()
         allowed_methods = ['get', 'post']
         resource_name = 'match'
+        paginator_class = KeysetPaginator
         authentication = APIKeyAuthentication()
+        throttle = TokenBucketThrottle('list')
         filtering = {
             'id':        ALL,
             'period':    ALL_WITH_RELATIONS,
@@ -406,6 +473,7 @@ class EarningResource(ModelResource):
         allowed_methods = ['get', 'post']
         resource_name = 'earning'
         authentication = APIKeyAuthentication()
+        throttle = TokenBucketThrottle('list')
         filtering = {
             'id':            ALL,
             'event':         ALL_WITH_RELATIONS,
@@ -426,6 +494,7 @@ class SmallGroupMembershipResourceFromPlayer(ModelResource):
         allowed_methods = ['get', 'post']
         resource_name = 'groupmembership'
         authentication = APIKeyAuthentication()
+        throttle = TokenBucketThrottle('list')
         excludes = ['current']
 
     team = fields.ForeignKey('ratings.api.resources.SmallTeamResource', 'group', full=True)
@@ -436,6 +505,7 @@ class SmallGroupMembershipResourceFromGroup(ModelResource):
         allowed_methods = ['get', 'post']
         resource_name = 'groupmembership'
         authentication = APIKeyAuthentication()
+        throttle = TokenBucketThrottle('list')
         excludes = ['current', 'playing']
 
     player = fields.ForeignKey(SmallPlayerResource, 'player', full=True)
@@ -446,6 +516,7 @@ class SmallTeamResource(ModelResource):
         allowed_methods = ['get', 'post']
         resource_name = 'team'
         authentication = APIKeyAuthentication()
+        throttle = TokenBucketThrottle('list')
         fields = ['name', 'shortname', 'id']
         filtering = {
             'id': ALL,
@@ -467,6 +538,7 @@ class TeamResource(ModelResource):
         allowed_methods = ['get', 'post']
         resource_name = 'team'
         authentication = APIKeyAuthentication()
+        throttle = TokenBucketThrottle('list')
         excludes = ['is_team', 'is_manual']
         filtering = {
             'id': ALL,
@@ -580,6 +652,7 @@ class PredictMatchResource(PredictResource):
         allowed_methods = ['get', 'post']
         resource_name = 'predictmatch'
         authentication = APIKeyAuthentication()
+        throttle = TokenBucketThrottle('predict')
         object_class = MatchPredictionResult
 
     pla = fields.ForeignKey(SmallPlayerResource, 'pla', null=False, help_text='Player A', full=True)
@@ -607,6 +680,7 @@ class PredictDualResource(PredictCombinationResource):
         allowed_methods = ['get', 'post']
         resource_name = 'predictdual'
         authentication = APIKeyAuthentication()
+        throttle = TokenBucketThrottle('predict')
         object_class = DualPredictionResult
 
     table = fields.ListField('table', null=False, help_text='Predicted table')
@@ -616,6 +690,7 @@ class PredictSEBracketResource(PredictCombinationResource):
         allowed_methods = ['get', 'post']
         resource_name = 'predictsebracket'
         authentication = APIKeyAuthentication()
+        throttle = TokenBucketThrottle('predict')
         object_class = SingleEliminationPredictionResult
 
     table = fields.ListField('table', null=False, help_text='Predicted table')
@@ -625,6 +700,7 @@ class PredictRRGroupResource(PredictCombinationResource):
         allowed_methods = ['get', 'post']
         resource_name = 'predictrrgroup'
         authentication = APIKeyAuthentication()
+        throttle = TokenBucketThrottle('predict')
         object_class = RoundRobinPredictionResult
 
     table = fields.ListField('table', null=False, help_text='Predicted table')
@@ -635,6 +711,7 @@ class PredictPLResource(PredictCombinationResource):
         allowed_methods = ['get', 'post']
         resource_name = 'predictproleague'
         authentication = APIKeyAuthentication()
+        throttle = TokenBucketThrottle('predict')
         object_class = ProleaguePredictionResult
 
     outcomes = fields.ListField('outcomes', null=False, help_text='Possible outcomes')
@@ -0,0 +1,288 @@
+# {{{ Imports
+import json
+
+from countries.data import cca2_to_ccn
+
+from django.db import transaction
+from django.db.models import F, Max, Q
+from django.utils.translation import ugettext_lazy as _
+
+from ratings.models import (
+    ClockEntry,
+    Earnings,
+    Event,
+    Group,
+    Match,
+)
+# }}}
+
+# The "days since" clocks. Their state is computed once per update by update_clocks and stored in ClockEntry,
+# so the clocks view only has to read it.
+
+# Needed because of django doing a bad mapping to SQL
+NON_KR_COUNTRIES = (x for x in cca2_to_ccn.keys() if x != "KR")
+
+# Format (key, description, hover_description, queryset, type)
+CLOCKS = [
+    (
+        "mma_drg_bo5",
+        _("MMA and DongRaeGu played a Bo5+"),
+        None,
+        (
+            Match.objects
+            .symmetric_filter(pla_id=28, plb_id=4)
+            .filter(Q(sca__gte=3) | Q(scb__gte=3))
+            .order_by("-date")
+        ),
+        "match"
+    ),
+    (
+        "mvp_premier",
+        _("Mvp won a premier event"),
+        None,
+        Event.objects.filter(type="event",
+                             earnings__player_id=13,
+                             earnings__placement=1,
+                             earnings__earnings__gte=10000)
+        .order_by("-latest"),
+        "event_winner"
+    ),
+    (
+        "kr_tvp_bo5_offline",
+        _("A Korean terran won against a Korean protoss in a Bo5+ (offline)"),
+        None,
+        Match.objects.symmetric_filter(
+            Q(pla__country="KR", rca="P", scb__gt=F("sca"), rcb="T", plb__country="KR")
+        ).filter(Q(sca__gte=3) | Q(scb__gte=3), offline=True).order_by("-date"),
+        "match"
+    ),
+    (
+        "flash_3_0",
+        _("Flash was 3-0'ed"),
+        None,
+        Match.objects.symmetric_filter(pla_id=55, sca=0, scb=3)
+        .order_by("-date"),
+        "match"
+    ),
+    (
+        "foreign_tvp_offline",
+        _("A foreign terran won against a Korean protoss (offline)"),
+        None,
+        Match.objects.symmetric_filter(
+            Q(pla__country="KR", rca="P", scb__gt=F("sca"), rcb="T") & ~Q(plb__country="KR")
+        ).filter(offline=True).order_by("-date"),
+        "match"
+    ),
+    (
+        "foreigner_proleague",
+        _("A foreigner won in Proleague"),
+        None,
+        Match.objects.symmetric_filter(~Q(pla__country="KR") & Q(sca__gt=F("scb")))
+        .filter(eventobj__fullname__istartswith="proleague")
+        .order_by("-date"),
+        "match"
+    ),
+    (
+        "foreigner_code_s",
+        _("A foreigner won in the GSL Code S"),
+        None,
+        Match.objects.symmetric_filter(~Q(pla__country="KR") & Q(sca__gt=F("scb")))
+        .filter(eventobj__fullname__istartswith="GSL", eventobj__fullname__icontains="Code S")
+        .order_by("-date"),
+        "match"
+    ),
+    (
+        "cis_major",
+        _("A CIS player won a major event"),
+        _("Player from BY, RU, UA or KZ with 1st place prize money >= $2000"),
+        Event.objects.filter(earnings__placement=1,
+                             earnings__player__country__in=["BY","RU","UA","KZ"],
+                             earnings__earnings__gte=2000)
+        .order_by("-latest"),
+        "event_winner"
+    ),
+    (
+        "nordic_major",
+        _("A Nordic player won a major event"),
+        _("Player from SE, NO, DK, IS or FI with 1st place prize money >= $2000"),
+        Event.objects.filter(earnings__placement=1,
+                             earnings__player__country__in=["SE", "NO", "FI", "DK", "IS"],
+                             earnings__earnings__gte=2000)
+        .order_by("-latest"),
+        "event_winner"
+    ),
+    (
+        "na_major",
+        _("A North American player won a major event"),
+        _("Player from US or CA with 1st place prize money >= $2000"),
+        Event.objects.filter(earnings__placement=1,
+                             earnings__player__country__in=["US", "CA"],
+                             earnings__earnings__gte=2000)
+        .order_by("-latest"),
+        "event_winner"
+    ),
+    (
+        "foreigner_premier",
+        _("A foreigner won a premier event"),
+        _("At least one game played offline with 1st place prize money >= $10,000"),
+        (
+            Event.objects
+            .filter(type="event")
+            .filter(downlink__child__match__offline=True)
+            .filter(earnings__player__country__in=NON_KR_COUNTRIES,
+                    earnings__placement=1,
+                    earnings__earnings__gte=10000)
+            .distinct()
+            .order_by("-latest")
+        ),
+        "event_winner"
+    ),
+    (
+        "jaedong_second",
+        _("Jaedong got second place in an event"),
+        None,
+        (
+            Event.objects
+            .filter(type="event")
+            .filter(earnings__player_id=73,
+                    earnings__placement=2)
+            .order_by("-latest")
+        ),
+        "event_winner"
+    ),
+    (
+        "soo_second",
+        _("soO got second place in an event"),
+        None,
+        (
+            Event.objects
+            .filter(type="event")
+            .filter(earnings__player_id=125,
+                    earnings__placement=2)
+            .order_by("-latest")
+        ),
+        "event_winner"
+    ),
+    (
+        "gsl_final_without_soo",
+        _("A GSL final was held without soO"),
+        None,
+        (
+            Match.objects
+            .filter(~Q(pla_id=125) & ~Q(plb_id=125))
+            .filter(eventobj__fullname__icontains="Code S",
+                    eventobj__fullname__iendswith="Final")
+            .order_by("-date")
+        ),
+        "match"
+    ),
+    (
+        "taeja_premier",
+        _("Taeja won a premier event"),
+        None,
+        (
+            Event.objects
+            .filter(type="event")
+            .filter(earnings__player_id=6,
+                    earnings__earnings__gte=10000,
+                    earnings__placement=1)
+            .order_by("-latest")
+        ),
+        "event_winner"
+    ),
+    (
+        "sos_100k",
+        _("sOs won $100,000 in a tournament"),
+        None,
+        (
+            Event.objects
+            .filter(type="event")
+            .filter(earnings__player_id=110,
+                    earnings__earnings__gte=100000)
+            .order_by("-latest")
+        ),
+        "event_winner"
+    ),
+    (
+        "slayers_disbanded",
+        _("SlayerS disbanded"),
+        None,
+        lambda: Group.objects.get(id=47).disbanded,
+        "one_time"
+    )
+]
+
+# {{{ update_clock(entry, q, tp, last_match, last_earnings, full): Updates the state of a single clock. Unless
+# full is set, only the items already shown and matches or earnings newer than the last update are considered,
+# since new data can only move a clock forward. If some of the items shown no longer qualify (because they were
+# edited or deleted), the clock falls back to a full evaluation.
+def update_clock(entry, q, tp, last_match, last_earnings, full):
+    if tp == "one_time":
+        entry.date = q()
+        entry.items = '[]'
+        return
+
+    items = json.loads(entry.items)
+
+    def evaluate(incremental, fields):
+        result = list(incremental.values_list(*fields)[:10])
+        if full or (result and len(result) >= len(items)):
+            return result
+        return list(q.values_list(*fields)[:10])
+
+    if tp == "match":
+        matches = evaluate(q if full else q.filter(Q(id__in=items) | Q(id__gt=entry.last_match)), ("id", "date"))
+        entry.items = json.dumps([m[0] for m in matches])
+        entry.date = matches[0][1] if matches else None
+
+    elif tp == "event_winner":
+        events = evaluate(q if full else q.filter(
+            Q(id__in=[i[0] for i in items]) |
+            Q(id__in=Earnings.objects.filter(id__gt=entry.last_earnings).values("event_id"))
+        ), ("id", "latest"))
+
+        earnings = {}
+        for eid, earnid in (
+            Earnings.objects.filter(event_id__in=[e[0] for e in events])
+            .exclude(placement=0)
+            .order_by("event_id", "placement")
+            .values_list("event_id", "id")
+        ):
+            earnings.setdefault(eid, [])
+            if len(earnings[eid]) < 2:
+                earnings[eid].append(earnid)
+
+        entry.items = json.dumps([[e[0], earnings.get(e[0], [])] for e in events])
+        entry.date = events[0][1] if events else None
+
+    entry.last_match = last_match
+    entry.last_earnings = last_earnings
+# }}}
+
+# {{{ update_clocks(full=False): Updates the state of all clocks, returns the number of clocks that changed
+@transaction.atomic
+def update_clocks(full=False):
+    last_match = Match.objects.aggregate(Max("id"))["id__max"] or 0
+    last_earnings = Earnings.objects.aggregate(Max("id"))["id__max"] or 0
+
+    existing = {e.key: e for e in ClockEntry.objects.all()}
+    new, changed = [], []
+    for key, desc, alt_desc, q, tp in CLOCKS:
+        entry = existing.get(key)
+        if entry is None:
+            entry = ClockEntry(key=key)
+            update_clock(entry, q, tp, last_match, last_earnings, True)
+            new.append(entry)
+        else:
+            state = (entry.date, entry.items)
+            update_clock(entry, q, tp, last_match, last_earnings, full)
+            if (entry.date, entry.items) != state:
+                changed.append(entry)
+
+    ClockEntry.objects.filter(key__in=set(existing) - {c[0] for c in CLOCKS}).delete()
+    ClockEntry.objects.bulk_create(new)
+    ClockEntry.objects.filter(key__in=existing).update(last_match=last_match, last_earnings=last_earnings)
+    ClockEntry.objects.bulk_update(changed, ["date", "items"])
+
+    return len(new) + len(changed)
+# }}}
@@ -0,0 +1,139 @@
+# {{{ Imports
+from django.db import (
+    connection,
+    transaction,
+)
+
+from ratings.models import Event
+from ratings.tools import copy_rows
+# }}}
+
+# Maintenance of the derived event tree data: the closure table (eventadjacency), the canonical sort index (idx)
+# and the full names. The whole tree is loaded in one query and everything is computed in memory, then written
+# back with COPY in a single transaction. Only rows that actually changed are updated.
+
+# {{{ EventTree
+class EventTree:
+    def __init__(self):
+        self.events = {}
+        self.children = {}
+        self.roots = []
+
+        for e in Event.objects.values('id', 'parent_id', 'name', 'noprint', 'idx', 'latest', 'fullname'):
+            self.events[e['id']] = e
+            self.children.setdefault(e['parent_id'], []).append(e['id'])
+
+        self.compute()
+
+    # {{{ compute: Computes depths, full names and the DFS order
+    def compute(self):
+        self.depth = {}
+        self.ancestors = {}
+        self.fullname = {}
+        self.order = []
+
+        # Children are ordered as in Event.Meta (idx, then latest with nulls last, then fullname), roots by their
+        # full name
+        def key(eid):
+            e = self.events[eid]
+            return (e['idx'], e['latest'] is None, e['latest'] or 0, e['fullname'])
+
+        for cids in self.children.values():
+            cids.sort(key=key)
+
+        stack = [(rid, None) for rid in self.children.get(None, [])]
+        while stack:
+            eid, pid = stack.pop()
+            e = self.events[eid]
+            if pid is None:
+                self.depth[eid], self.ancestors[eid], names = 0, [], []
+            else:
+                self.depth[eid] = self.depth[pid] + 1
+                self.ancestors[eid] = self.ancestors[pid] + [pid]
+                names = [self.fullname[pid]] if self.fullname[pid] else []
+            if not e['noprint']:
+                names.append(e['name'])
+            self.fullname[eid] = ' '.join(names)
+            stack.extend((cid, eid) for cid in self.children.get(eid, []))
+
+        roots = sorted(self.children.get(None, []), key=lambda eid: self.fullname[eid])
+        stack = list(reversed(roots))
+        while stack:
+            eid = stack.pop()
+            self.order.append(eid)
+            stack.extend(reversed(self.children.get(eid, [])))
+    # }}}
+
+    # {{{ subtree(eid): Returns the ids of the event and all its descendants
+    def subtree(self, eid):
+        ret, stack = [], [eid]
+        while stack:
+            eid = stack.pop()
+            ret.append(eid)
+            stack.extend(self.children.get(eid, []))
+        return ret
+    # }}}
+
+    # {{{ closure(eids): Generates the closure rows (parent, child, distance) for the given children
+    def closure(self, eids):
+        for eid in eids:
+            yield eid, eid, 0
+            depth = self.depth[eid]
+            for pid in self.ancestors[eid]:
+                yield pid, eid, depth - self.depth[pid]
+    # }}}
+
+    # {{{ changes(eids): Returns the (id, idx, fullname) rows that differ from the database among the given events
+    def changes(self, eids=None):
+        index = {eid: i for i, eid in enumerate(self.order)}
+        return [
+            (eid, index[eid], self.fullname[eid])
+            for eid in (self.order if eids is None else eids)
+            if self.events[eid]['idx'] != index[eid] or self.events[eid]['fullname'] != self.fullname[eid]
+        ]
+    # }}}
+
+    # {{{ write(eids=None): Writes the closure rows, sort indices and full names back to the database, for the
+    # given events only or for the whole tree
+    @transaction.atomic
+    def write(self, eids=None):
+        cur = connection.cursor()
+
+        if eids is None:
+            cur.execute('DELETE FROM eventadjacency')
+            adjacencies = self.closure(self.order)
+        else:
+            cur.execute('DELETE FROM eventadjacency WHERE child_id = ANY(%s)', [list(eids)])
+            adjacencies = self.closure(eids)
+        copy_rows(cur, 'eventadjacency (parent_id, child_id, distance)', adjacencies)
+
+        # All sort indices can shift when a subtree moves, so they are always compared over the whole tree
+        rows = self.changes()
+        if rows:
+            cur.execute(
+                'CREATE TEMPORARY TABLE temp_event_tree (id integer PRIMARY KEY, idx integer, fullname text) '
+                'ON COMMIT DROP'
+            )
+            copy_rows(cur, 'temp_event_tree (id, idx, fullname)', rows, not_null=['fullname'])
+            cur.execute(
+                'UPDATE event AS e SET idx = t.idx, fullname = t.fullname '
+                'FROM temp_event_tree AS t WHERE e.id = t.id'
+            )
+            cur.execute('DROP TABLE temp_event_tree')
+
+        return len(rows)
+    # }}}
+# }}}
+
+# {{{ rebuild: Rebuilds the closure table, sort indices and full names of the whole tree
+def rebuild():
+    tree = EventTree()
+    return tree.write()
+# }}}
+
+# {{{ refresh_subtree(event): Refreshes the tree data after the given event has been moved or renamed. Only the
+# closure rows and full names of the event and its descendants are rewritten.
+def refresh_subtree(event):
+    tree = EventTree()
+    return tree.write(tree.subtree(event.id))
+# }}}
@@ -0,0 +1,81 @@
+# {{{ Imports
+from collections import deque
+
+from django.db import (
+    connection,
+    transaction,
+)
+
+from ratings.models import Match
+from ratings.tools import copy_rows
+# }}}
+
+# The graph of players connected by offline matches, loaded into memory with one query. MC numbers are the
+# distances in this graph from MC (player 36).
+MC_ID = 36
+
+# {{{ PlayerGraph
+class PlayerGraph:
+    def __init__(self, queryset=None):
+        if queryset is None:
+            queryset = Match.objects.filter(offline=True)
+
+        self.neighbours = {}
+        for pla, plb in queryset.values_list('pla_id', 'plb_id').distinct().order_by():
+            self.neighbours.setdefault(pla, set()).add(plb)
+            self.neighbours.setdefault(plb, set()).add(pla)
+
+    # {{{ distances(source): Returns a dict mapping every player reachable from source to its distance
+    def distances(self, source):
+        dist = {source: 0}
+        queue = deque([source])
+        while queue:
+            pid = queue.popleft()
+            for nid in self.neighbours.get(pid, ()):
+                if nid not in dist:
+                    dist[nid] = dist[pid] + 1
+                    queue.append(nid)
+        return dist
+    # }}}
+
+    # {{{ path(source, target): Returns a shortest list of players from source to target, or None
+    def path(self, source, target):
+        prev = {source: None}
+        queue = deque([source])
+        while queue and target not in prev:
+            pid = queue.popleft()
+            for nid in self.neighbours.get(pid, ()):
+                if nid not in prev:
+                    prev[nid] = pid
+                    queue.append(nid)
+
+        if target not in prev:
+            return None
+
+        ret = [target]
+        while prev[ret[-1]] is not None:
+            ret.append(prev[ret[-1]])
+        return ret[::-1]
+    # }}}
+# }}}
+
+# {{{ update_mcnums: Recomputes the MC numbers of all players, writing only those that changed. Returns the
+# number of players updated.
+@transaction.atomic
+def update_mcnums(graph=None):
+    if graph is None:
+        graph = PlayerGraph()
+
+    cur = connection.cursor()
+    cur.execute('CREATE TEMPORARY TABLE temp_mcnum (id integer PRIMARY KEY, mcnum integer) ON COMMIT DROP')
+    copy_rows(cur, 'temp_mcnum (id, mcnum)', graph.distances(MC_ID).items())
+    cur.execute(
+        'UPDATE player SET mcnum = t.mcnum '
+        'FROM (SELECT p.id, tm.mcnum FROM player p LEFT JOIN temp_mcnum tm ON tm.id = p.id) AS t '
+        'WHERE player.id = t.id AND player.mcnum IS DISTINCT FROM t.mcnum'
+    )
+    nchanged = cur.rowcount
+    cur.execute('DROP TABLE temp_mcnum')
+
+    return nchanged
+# }}}
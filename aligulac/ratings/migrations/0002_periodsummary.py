@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratings', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PeriodSummary',
+            fields=[
+                ('period', models.OneToOneField(to='ratings.Period', primary_key=True, related_name='summary', serialize=False, help_text='Period summarized', on_delete=models.CASCADE)),
+                ('leaders', models.TextField(default='{}', verbose_name='Leaders', help_text='Leaders and movers (JSON)')),
+            ],
+            options={
+                'db_table': 'periodsummary',
+            },
+        ),
+    ]
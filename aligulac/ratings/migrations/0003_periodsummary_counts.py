@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratings', '0002_periodsummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='periodsummary',
+            name='counts',
+            field=models.TextField(default='{}', verbose_name='Counts', help_text='Active players by race and country (JSON)'),
+        ),
+    ]
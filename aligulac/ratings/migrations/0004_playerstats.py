@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratings', '0003_periodsummary_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayerStats',
+            fields=[
+                ('player', models.OneToOneField(to='ratings.Player', primary_key=True, related_name='stats', serialize=False, help_text='Player', on_delete=models.CASCADE)),
+                ('matches', models.IntegerField(default=0, verbose_name='Matches')),
+                ('offline', models.IntegerField(default=0, verbose_name='Offline matches')),
+                ('first', models.DateField(null=True, blank=True, verbose_name='First match')),
+                ('last', models.DateField(null=True, blank=True, verbose_name='Last match')),
+                ('wins', models.IntegerField(default=0, verbose_name='Game wins')),
+                ('losses', models.IntegerField(default=0, verbose_name='Game losses')),
+                ('vp_wins', models.IntegerField(default=0, verbose_name='Game wins vP')),
+                ('vp_losses', models.IntegerField(default=0, verbose_name='Game losses vP')),
+                ('vt_wins', models.IntegerField(default=0, verbose_name='Game wins vT')),
+                ('vt_losses', models.IntegerField(default=0, verbose_name='Game losses vT')),
+                ('vz_wins', models.IntegerField(default=0, verbose_name='Game wins vZ')),
+                ('vz_losses', models.IntegerField(default=0, verbose_name='Game losses vZ')),
+            ],
+            options={
+                'db_table': 'playerstats',
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratings', '0004_playerstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HeadToHead',
+            fields=[
+                ('id', models.AutoField(serialize=False, verbose_name='ID', auto_created=True, primary_key=True)),
+                ('player', models.ForeignKey(to='ratings.Player', verbose_name='Player', on_delete=models.CASCADE)),
+                ('opponent', models.ForeignKey(to='ratings.Player', verbose_name='Opponent', related_name='+', on_delete=models.CASCADE)),
+                ('matches', models.IntegerField(default=0, verbose_name='Matches')),
+                ('match_wins', models.IntegerField(default=0, verbose_name='Match wins')),
+                ('match_losses', models.IntegerField(default=0, verbose_name='Match losses')),
+                ('game_wins', models.IntegerField(default=0, verbose_name='Game wins')),
+                ('game_losses', models.IntegerField(default=0, verbose_name='Game losses')),
+                ('last_played', models.DateField(null=True, blank=True, verbose_name='Last played')),
+            ],
+            options={
+                'db_table': 'headtohead',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='headtohead',
+            unique_together={('player', 'opponent')},
+        ),
+        migrations.AddIndex(
+            model_name='headtohead',
+            index=models.Index(fields=['player', '-matches'], name='headtohead_matches'),
+        ),
+    ]
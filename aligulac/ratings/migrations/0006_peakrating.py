@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratings', '0005_headtohead'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PeakRating',
+            fields=[
+                ('id', models.AutoField(serialize=False, verbose_name='ID', auto_created=True, primary_key=True)),
+                ('player', models.ForeignKey(to='ratings.Player', verbose_name='Player', on_delete=models.CASCADE)),
+                ('kind', models.CharField(max_length=10, verbose_name='Kind', choices=[('rating', 'rating'), ('tot_vp', 'tot_vp'), ('tot_vt', 'tot_vt'), ('tot_vz', 'tot_vz')])),
+                ('record', models.BooleanField(default=False, verbose_name='Counts for records')),
+                ('rating', models.ForeignKey(to='ratings.Rating', verbose_name='Rating', on_delete=models.CASCADE)),
+                ('value', models.FloatField(verbose_name='Value')),
+            ],
+            options={
+                'db_table': 'peakrating',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='peakrating',
+            unique_together={('player', 'kind', 'record')},
+        ),
+        migrations.AddIndex(
+            model_name='peakrating',
+            index=models.Index(fields=['kind', 'record', '-value'], name='peakrating_value'),
+        ),
+    ]
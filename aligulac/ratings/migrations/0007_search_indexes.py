@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# Trigram indexes for the icontains lookups used by search (see aligulac.tools.search and
+# ratings.tools.find_player). Django compiles icontains to UPPER(column::text) LIKE UPPER(...), so the indexes
+# are on that expression. The exact (iexact) lookups of find_player get B-tree indexes on the same expression.
+SEARCH_INDEXES = [
+    ('player', 'tag'),
+    ('player', 'name'),
+    ('player', 'romanized_name'),
+    ('alias', 'name'),
+    ('group', 'name'),
+    ('event', 'fullname'),
+]
+
+EXACT_INDEXES = [
+    ('player', 'tag'),
+    ('alias', 'name'),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratings', '0006_peakrating'),
+    ]
+
+    operations = [TrigramExtension()] + [
+        migrations.RunSQL(
+            'CREATE INDEX "%s_%s_trgm" ON "%s" USING gin ((UPPER("%s"::text)) gin_trgm_ops)' % (
+                table, column, table, column
+            ),
+            'DROP INDEX "%s_%s_trgm"' % (table, column),
+        )
+        for table, column in SEARCH_INDEXES
+    ] + [
+        migrations.RunSQL(
+            'CREATE INDEX "%s_%s_upper" ON "%s" (UPPER("%s"::text))' % (table, column, table, column),
+            'DROP INDEX "%s_%s_upper"' % (table, column),
+        )
+        for table, column in EXACT_INDEXES
+    ]
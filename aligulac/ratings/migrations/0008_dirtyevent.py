@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratings', '0007_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirtyEvent',
+            fields=[
+                ('event', models.OneToOneField(to='ratings.Event', primary_key=True, related_name='+', serialize=False, on_delete=models.CASCADE)),
+            ],
+            options={
+                'db_table': 'dirtyevent',
+            },
+        ),
+    ]
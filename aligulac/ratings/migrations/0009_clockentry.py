@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratings', '0008_dirtyevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClockEntry',
+            fields=[
+                ('key', models.CharField(max_length=50, primary_key=True, serialize=False, verbose_name='Key')),
+                ('date', models.DateField(null=True, blank=True, verbose_name='Date')),
+                ('items', models.TextField(default='[]', verbose_name='Items', help_text='Matches or events shown (JSON)')),
+                ('last_match', models.IntegerField(default=0, verbose_name='Last match seen')),
+                ('last_earnings', models.IntegerField(default=0, verbose_name='Last earnings seen')),
+            ],
+            options={
+                'db_table': 'clockentry',
+            },
+        ),
+    ]
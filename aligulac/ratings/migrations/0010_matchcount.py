@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+# The key of the matchcount row a match is counted in
+KEY = (
+    "{r}.game, {r}.offline, {r}.treated, {r}.eventobj_id IS NOT NULL, "
+    "{r}.eventobj_id IS NOT NULL OR COALESCE({r}.event, '') <> '', COALESCE({r}.submitter_id, 0)"
+)
+
+COUNT_MATCH = """
+        INSERT INTO matchcount (game, offline, treated, catalogued, partial, submitter_id, matches, games)
+        VALUES ({key}, {sign}, {sign} * ({r}.sca + {r}.scb))
+        ON CONFLICT (game, offline, treated, catalogued, partial, submitter_id) DO UPDATE
+        SET matches = matchcount.matches + EXCLUDED.matches, games = matchcount.games + EXCLUDED.games;"""
+
+CREATE_TRIGGER = """
+CREATE FUNCTION matchcount_update() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND ({old_key}, OLD.sca, OLD.scb) IS NOT DISTINCT FROM ({new_key}, NEW.sca, NEW.scb) THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN{count_old}
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN{count_new}
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER matchcount_trigger AFTER INSERT OR UPDATE OR DELETE ON match
+FOR EACH ROW EXECUTE PROCEDURE matchcount_update();
+
+INSERT INTO matchcount (game, offline, treated, catalogued, partial, submitter_id, matches, games)
+SELECT {all_key}, COUNT(*), COALESCE(SUM(m.sca + m.scb), 0)
+FROM match m
+GROUP BY 1, 2, 3, 4, 5, 6;
+""".format(
+    old_key=KEY.format(r='OLD'),
+    new_key=KEY.format(r='NEW'),
+    all_key=KEY.format(r='m'),
+    count_old=COUNT_MATCH.format(key=KEY.format(r='OLD'), sign=-1, r='OLD'),
+    count_new=COUNT_MATCH.format(key=KEY.format(r='NEW'), sign=1, r='NEW'),
+)
+
+DROP_TRIGGER = """
+DROP TRIGGER matchcount_trigger ON match;
+DROP FUNCTION matchcount_update();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratings', '0009_clockentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MatchCount',
+            fields=[
+                ('id', models.AutoField(serialize=False, verbose_name='ID', auto_created=True, primary_key=True)),
+                ('game', models.CharField(max_length=10, verbose_name='Game')),
+                ('offline', models.BooleanField(verbose_name='Offline')),
+                ('treated', models.BooleanField(verbose_name='Treated')),
+                ('catalogued', models.BooleanField(verbose_name='Has event object')),
+                ('partial', models.BooleanField(verbose_name='Has event object or text')),
+                ('submitter_id', models.IntegerField(verbose_name='Submitter')),
+                ('matches', models.IntegerField(default=0, verbose_name='Matches')),
+                ('games', models.IntegerField(default=0, verbose_name='Games')),
+            ],
+            options={
+                'db_table': 'matchcount',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='matchcount',
+            unique_together=set([('game', 'offline', 'treated', 'catalogued', 'partial', 'submitter_id')]),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+    ]
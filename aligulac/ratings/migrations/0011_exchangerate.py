@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratings', '0010_matchcount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('date', models.DateField(verbose_name='Date')),
+                ('currency', models.CharField(max_length=10, verbose_name='Currency')),
+                ('rate', models.FloatField(verbose_name='Rate', help_text='Units per USD')),
+            ],
+            options={
+                'db_table': 'exchangerate',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='exchangerate',
+            unique_together=set([('date', 'currency')]),
+        ),
+    ]
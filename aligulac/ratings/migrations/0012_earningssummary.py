@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+FILL = """
+INSERT INTO earningssummary (player_id, year, currency, earnings, origearnings)
+SELECT e.player_id, EXTRACT(YEAR FROM ev.latest)::integer, e.currency, SUM(e.earnings), SUM(e.origearnings)
+FROM earnings e JOIN event ev ON ev.id = e.event_id
+WHERE e.earnings IS NOT NULL
+GROUP BY 1, 2, 3
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratings', '0011_exchangerate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EarningsSummary',
+            fields=[
+                ('id', models.AutoField(serialize=False, verbose_name='ID', auto_created=True, primary_key=True)),
+                ('player', models.ForeignKey(to='ratings.Player', verbose_name='Player', on_delete=models.CASCADE)),
+                ('year', models.IntegerField(null=True, verbose_name='Year')),
+                ('currency', models.CharField(max_length=30, verbose_name='Original currency')),
+                ('earnings', models.BigIntegerField(verbose_name='Earnings (USD)')),
+                ('origearnings', models.DecimalField(decimal_places=8, max_digits=24, verbose_name='Earnings (original currency)')),
+            ],
+            options={
+                'db_table': 'earningssummary',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='earningssummary',
+            unique_together={('player', 'year', 'currency')},
+        ),
+        migrations.AddIndex(
+            model_name='earningssummary',
+            index=models.Index(fields=['year', 'currency'], name='earningssummary_year'),
+        ),
+        migrations.RunSQL(FILL, 'DELETE FROM earningssummary'),
+    ]
@@ -1,13 +1,13 @@
 # {{{ Imports
+import json
 import re
 
-from countries.data import cca2_to_ccn
 from collections import Counter, namedtuple
 from datetime import datetime
 
 from django import forms
 from django.core.exceptions import PermissionDenied, ValidationError
-from django.db.models import F, Q, Sum
+from django.db.models import Sum
 from django.http import HttpResponse
 from django.shortcuts import get_object_or_404, render_to_response, redirect
 from django.utils.translation import ugettext_lazy as _
@@ -16,6 +16,10 @@ from itertools import zip_longest
 
 from urllib.parse import quote
 
+from ratings.clocks import (
+    CLOCKS,
+    update_clocks,
+)
 from ratings.comparisons import (
     Comparison,
     EarningsComparison,
@@ -28,8 +32,9 @@ from ratings.comparisons import (
     SimpleComparison
 )
 from ratings.models import (
+    ClockEntry,
+    Earnings,
     Event,
-    Group,
     GroupMembership,
     Match,
     Player,
@@ -71,224 +76,55 @@ def home(request):
     return render_to_response("misc.djhtml", ctx)
 
 # {{{ Clocks
-# Format (description, hover_description, queryset, type)
 Clock = namedtuple('Clock', ['desc', 'alt_desc', 'object', 'type', 'date', 'years', 'days', 'extra'])
 
-# Needed because of django doing a bad mapping to SQL
-NON_KR_COUNTRIES = (x for x in cca2_to_ccn.keys() if x != "KR")
-CLOCKS = [
-    (
-        _("MMA and DongRaeGu played a Bo5+"),
-        None,
-        (
-            Match.objects
-            .symmetric_filter(pla_id=28, plb_id=4)
-            .filter(Q(sca__gte=3) | Q(scb__gte=3))
-            .order_by("-date")
-        ),
-        "match"
-    ),
-    (
-        _("Mvp won a premier event"),
-        None,
-        Event.objects.filter(type="event",
-                             earnings__player_id=13,
-                             earnings__placement=1,
-                             earnings__earnings__gte=10000)
-        .order_by("-latest"),
-        "event_winner"
-    ),
-    (
-        _("A Korean terran won against a Korean protoss in a Bo5+ (offline)"),
-        None,
-        Match.objects.symmetric_filter(
-            Q(pla__country="KR", rca="P", scb__gt=F("sca"), rcb="T", plb__country="KR")
-        ).filter(Q(sca__gte=3) | Q(scb__gte=3), offline=True).order_by("-date"),
-        "match"
-    ),
-    (
-        _("Flash was 3-0'ed"),
-        None,
-        Match.objects.symmetric_filter(pla_id=55, sca=0, scb=3)
-        .order_by("-date"),
-        "match"
-    ),
-    (
-        _("A foreign terran won against a Korean protoss (offline)"),
-        None,
-        Match.objects.symmetric_filter(
-            Q(pla__country="KR", rca="P", scb__gt=F("sca"), rcb="T") & ~Q(plb__country="KR")
-        ).filter(offline=True).order_by("-date"),
-        "match"
-    ),
-    (
-        _("A foreigner won in Proleague"),
-        None,
-        Match.objects.symmetric_filter(~Q(pla__country="KR") & Q(sca__gt=F("scb")))
-        .filter(eventobj__fullname__istartswith="proleague")
-        .order_by("-date"),
-        "match"
-    ),
-    (
-        _("A foreigner won in the GSL Code S"),
-        None,
-        Match.objects.symmetric_filter(~Q(pla__country="KR") & Q(sca__gt=F("scb")))
-        .filter(eventobj__fullname__istartswith="GSL", eventobj__fullname__icontains="Code S")
-        .order_by("-date"),
-        "match"
-    ),
-    (
-        _("A CIS player won a major event"),
-        _("Player from BY, RU, UA or KZ with 1st place prize money >= $2000"),
-        Event.objects.filter(earnings__placement=1,
-                             earnings__player__country__in=["BY","RU","UA","KZ"],
-                             earnings__earnings__gte=2000)
-        .order_by("-latest"),
-        "event_winner"
-    ),
-    (
-        _("A Nordic player won a major event"),
-        _("Player from SE, NO, DK, IS or FI with 1st place prize money >= $2000"),
-        Event.objects.filter(earnings__placement=1,
-                             earnings__player__country__in=["SE", "NO", "FI", "DK", "IS"],
-                             earnings__earnings__gte=2000)
-        .order_by("-latest"),
-        "event_winner"
-    ),
-    (
-        _("A North American player won a major event"),
-        _("Player from US or CA with 1st place prize money >= $2000"),
-        Event.objects.filter(earnings__placement=1,
-                             earnings__player__country__in=["US", "CA"],
-                             earnings__earnings__gte=2000)
-        .order_by("-latest"),
-        "event_winner"
-    ),
-    (
-        _("A foreigner won a premier event"),
-        _("At least one game played offline with 1st place prize money >= $10,000"),
-        (
-            Event.objects
-            .filter(type="event")
-            .filter(downlink__child__match__offline=True)
-            .filter(earnings__player__country__in=NON_KR_COUNTRIES,
-                    earnings__placement=1,
-                    earnings__earnings__gte=10000)
-            .distinct()
-            .order_by("-latest")
-        ),
-        "event_winner"
-    ),
-    (
-        _("Jaedong got second place in an event"),
-        None,
-        (
-            Event.objects
-            .filter(type="event")
-            .filter(earnings__player_id=73,
-                    earnings__placement=2)
-            .order_by("-latest")
-        ),
-        "event_winner"
-    ),
-    (
-        _("soO got second place in an event"),
-        None,
-        (
-            Event.objects
-            .filter(type="event")
-            .filter(earnings__player_id=125,
-                    earnings__placement=2)
-            .order_by("-latest")
-        ),
-        "event_winner"
-    ),
-    (
-        _("A GSL final was held without soO"),
-        None,
-        (
-            Match.objects
-            .filter(~Q(pla_id=125) & ~Q(plb_id=125))
-            .filter(eventobj__fullname__icontains="Code S",
-                    eventobj__fullname__iendswith="Final")
-            .order_by("-date")
-        ),
-        "match"
-    ),
-    (
-        _("Taeja won a premier event"),
-        None,
-        (
-            Event.objects
-            .filter(type="event")
-            .filter(earnings__player_id=6,
-                    earnings__earnings__gte=10000,
-                    earnings__placement=1)
-            .order_by("-latest")
-        ),
-        "event_winner"
-    ),
-    (
-        _("sOs won $100,000 in a tournament"),
-        None,
-        (
-            Event.objects
-            .filter(type="event")
-            .filter(earnings__player_id=110,
-                    earnings__earnings__gte=100000)
-            .order_by("-latest")
-        ),
-        "event_winner"
-    ),
-    (
-        _("SlayerS disbanded"),
-        None,
-        lambda: Group.objects.get(id=47).disbanded,
-        "one_time"
-    )
-]
-
 @cache_page
 def clocks(request):
     ctx = base_ctx('Misc', 'Days Since…', request)
 
+    # The clocks are computed by the update (see ratings.clocks), here they're only read and the objects shown
+    # are fetched in one query per type.
+    entries = {e.key: e for e in ClockEntry.objects.all()}
+    if not entries:
+        update_clocks()
+        entries = {e.key: e for e in ClockEntry.objects.all()}
+    items = {key: json.loads(e.items) for key, e in entries.items()}
+    types = {c[0]: c[4] for c in CLOCKS}
+
+    match_ids = [i for key, its in items.items() if types.get(key) == "match" for i in its]
+    event_ids = [i[0] for key, its in items.items() if types.get(key) == "event_winner" for i in its]
+    earnings_ids = [j for key, its in items.items() if types.get(key) == "event_winner" for i in its for j in i[1]]
+
+    matches = (
+        Match.objects.prefetch_related("pla", "plb", "eventobj", "message_set").in_bulk(match_ids)
+        if match_ids else {}
+    )
+    events = Event.objects.in_bulk(event_ids) if event_ids else {}
+    earnings = Earnings.objects.select_related("player").in_bulk(earnings_ids) if earnings_ids else {}
+
     ctx["clocks"] = list()
-    for desc, alt_desc, q, t in CLOCKS:
+    for key, desc, alt_desc, q, t in CLOCKS:
+        entry = entries.get(key)
+        if entry is None or entry.date is None:
+            continue
+
         obj = None
         extra = None
-        date = None
 
         if t == "match":
-            q = q.prefetch_related("pla", "plb", "eventobj", "message_set")
-            matches = q[:10]
-
-            extra = display_matches(matches)
-
-            date = extra[0]["date"]
+            extra = display_matches([matches[i] for i in items[key] if i in matches])
 
         elif t == "event_winner":
-            q = q.prefetch_related("earnings_set")
-            events = list(q[:10])
-            obj = events[0]
-            extra = list()
-            for e in events:
-                pearnings = list(
-                    e.earnings_set
-                    .exclude(placement=0)
-                    .order_by("placement")
-                    .prefetch_related("player")[:2]
-                )
-                extra.append((e, pearnings))
-
-            date = obj.latest
-
-        elif t == "one_time":
-            date = q()
-
-        diff = datetime.today().date() - date
+            extra = [
+                (events[eid], [earnings[i] for i in earnids if i in earnings])
+                for eid, earnids in items[key] if eid in events
+            ]
+            obj = extra[0][0] if extra else None
+
+        diff = datetime.today().date() - entry.date
         years = diff.days // 365
         days = diff.days % 365
-        c = Clock(desc, alt_desc, obj, t, date, years, days, extra)
+        c = Clock(desc, alt_desc, obj, t, entry.date, years, days, extra)
 
         ctx["clocks"].append(c)
 
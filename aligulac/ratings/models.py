@@ -1,34 +1,46 @@
 # {{{ Imports
 import datetime
-from itertools import islice
+from decimal import Decimal
+import json
 from math import sqrt, ceil
 import random
 import re
 import string
 
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
 from django.db import (
+    connection,
     models,
     transaction,
 )
 from django.db.models import (
+    Case,
+    Count,
     F,
     Max,
     Min,
     Q,
+    Sum,
+    Value,
+    When,
 )
 from django.utils.translation import (
     ugettext_lazy as _,
     pgettext_lazy
 )
 
+from aligulac.cache import (
+    bump_generation,
+    bump_generations,
+)
 from aligulac.settings import (
     start_rating,
     INACTIVE_THRESHOLD,
     SHOW_PER_LIST_PAGE
 )
 
-from currency import ExchangeRates
+from currency import RateStore
 
 from countries import (
     transformations,
@@ -342,6 +354,21 @@ class Period(models.Model):
 # }}}
 
 # {{{ Events
+# Refreshes the earliest and latest fields from the matches of all descendants, with one grouped query. The
+# {where} placeholder restricts the events refreshed, only rows that actually change are written.
+EVENT_DATES_QUERY = """
+UPDATE event SET earliest = agg.earliest, latest = agg.latest
+FROM (
+    SELECT adj.parent_id AS id, MIN(match.date) AS earliest, MAX(match.date) AS latest
+    FROM eventadjacency adj
+    LEFT JOIN match ON match.eventobj_id = adj.child_id
+    {where}
+    GROUP BY adj.parent_id
+) agg
+WHERE event.id = agg.id
+  AND (event.earliest IS DISTINCT FROM agg.earliest OR event.latest IS DISTINCT FROM agg.latest)
+"""
+
 class Event(models.Model):
     class Meta:
         ordering = ['idx', 'latest', 'fullname']
@@ -577,6 +604,38 @@ class Event(models.Model):
         self.save()
     # }}}
 
+    # {{{ refresh_dates(event_ids): Updates the fields earliest and latest of the given events and all their
+    # ancestors, in one statement.
+    @staticmethod
+    def refresh_dates(event_ids):
+        event_ids = list(set(event_ids) - {None})
+        if event_ids:
+            cur = connection.cursor()
+            cur.execute(EVENT_DATES_QUERY.format(where=(
+                'WHERE adj.parent_id IN (SELECT parent_id FROM eventadjacency WHERE child_id = ANY(%(ids)s))'
+            )), {'ids': event_ids})
+    # }}}
+
+    # {{{ refresh_dirty_dates: Refreshes the dates of the events flagged in DirtyEvent and their ancestors, and
+    # clears the flags. Returns the number of flagged events.
+    @staticmethod
+    @transaction.atomic
+    def refresh_dirty_dates():
+        event_ids = list(DirtyEvent.objects.select_for_update().values_list('event_id', flat=True))
+        Event.refresh_dates(event_ids)
+        DirtyEvent.objects.filter(event_id__in=event_ids).delete()
+        return len(event_ids)
+    # }}}
+
+    # {{{ rebuild_dates: Recomputes the dates of every event. Returns the number of events whose dates were
+    # wrong, which should be zero if the incremental updates are working.
+    @staticmethod
+    def rebuild_dates():
+        cur = connection.cursor()
+        cur.execute(EVENT_DATES_QUERY.format(where=''))
+        return cur.rowcount
+    # }}}
+
     # {{{ change_type(type): Modifies the type of this event, and possibly all ancestors and events
     @transaction.atomic
     def change_type(self, tp):
@@ -685,15 +744,20 @@ class Event(models.Model):
     # criteria.
     def delete_earnings(self, ranked=True):
         if ranked:
-            Earnings.objects.filter(event=self).exclude(placement__exact=0).delete()
+            earnings = Earnings.objects.filter(event=self).exclude(placement__exact=0)
         else:
-            Earnings.objects.filter(event=self, placement__exact=0).delete()
+            earnings = Earnings.objects.filter(event=self, placement__exact=0)
+        players = set(earnings.values_list('player_id', flat=True))
+        earnings.delete()
+        EarningsSummary.refresh(players)
     # }}}
 
     # {{{ move_earnings(new_event): Moves earnings from this event to the new event
     # Will update the type of the new event to EVENT.
     def move_earnings(self, new_event):
+        players = set(Earnings.objects.filter(event=self).values_list('player_id', flat=True))
         Earnings.objects.filter(event=self).update(event=new_event)
+        EarningsSummary.refresh(players)
         self.set_prizepool(None)
         new_event.set_prizepool(True)
         new_event.change_type(Event.EVENT)
@@ -720,6 +784,27 @@ class EventAdjacency(models.Model):
     # }}}
 # }}}
 
+# {{{ DirtyEvents
+# Events whose matches have been changed in ways that bypass Match.save and Match.delete (queryset updates and
+# deletes, e.g. from the admin). Their dates, and those of their ancestors, are refreshed by the next update.
+class DirtyEvent(models.Model):
+    class Meta:
+        db_table = 'dirtyevent'
+
+    event = models.OneToOneField(
+        Event, primary_key=True, related_name='+', on_delete=models.CASCADE,
+    )
+
+    # {{{ mark(event_ids): Flags the given events
+    @staticmethod
+    def mark(event_ids):
+        DirtyEvent.objects.bulk_create(
+            [DirtyEvent(event_id=eid) for eid in set(event_ids) - {None}],
+            ignore_conflicts=True,
+        )
+    # }}}
+# }}}
+
 # {{{ Players
 class Player(models.Model):
     class Meta:
@@ -808,6 +893,43 @@ class Player(models.Model):
             return self.tag + ' (' + self.race + ')'
     # }}}
 
+    # {{{ __init__: Has been overloaded to remember the race and country, to check later if they changed.
+    # Deferred fields aren't loaded for this.
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.orig_race = self.__dict__.get('race')
+        self.orig_country = self.__dict__.get('country')
+    # }}}
+
+    # {{{ changed_filters: Returns true if the race or country, which the rating lists filter on, has been
+    # changed.
+    def changed_filters(self):
+        return self.pk is not None and (
+               ('race' in self.__dict__ and self.orig_race != self.race)
+            or ('country' in self.__dict__ and self.orig_country != self.country)
+        )
+    # }}}
+
+    # {{{ save: Has been overloaded to invalidate cached pages depending on this player, and responses that
+    # embed any player (the 'players' generation). If the race or country changed, the active player counts of
+    # the period summaries are refreshed: the current one right away, the others when they're next shown.
+    def save(self, *args, **kwargs):
+        changed_filters = self.changed_filters()
+        super().save(*args, **kwargs)
+
+        if changed_filters:
+            PeriodSummary.objects.filter(
+                period__rating__player=self, period__rating__decay__lt=INACTIVE_THRESHOLD,
+            ).update(counts='{}')
+            current = Period.objects.filter(computed=True).order_by('-start').first()
+            if current is not None and PeriodSummary.objects.filter(period=current).exists():
+                PeriodSummary.refresh(current)
+            self.orig_race, self.orig_country = self.race, self.country
+
+        bump_generations('player', [self.id])
+        bump_generation('players')
+    # }}}
+
     # {{{ Standard setters
     def set_tag(self, tag):
         self.tag = tag
@@ -1010,17 +1132,14 @@ class Player(models.Model):
     # }}}
 
 
-    # {{{ rivalries
+    # {{{ rivalries (see HeadToHead)
     @property
     def rivals(self):
         if '_rivals' in dir(self):
             return self._rivals
 
-        q = Player.objects.raw(PLAYER_RIVAL_QUERY, {"id": self.id})
-
-        rivals = list(islice(q, 5))
-
-        self._rivals = rivals
+        q = self.headtohead_set.select_related('opponent').order_by('-matches', 'opponent_id')[:5]
+        self._rivals = [h.as_opponent() for h in q]
 
         return self._rivals
 
@@ -1029,11 +1148,8 @@ class Player(models.Model):
         if '_nemesis' in dir(self):
             return self._nemesis
 
-        pm = self._nemesis_victim_helper()
-
-        nemesis = list(islice(reversed([x for x in pm if x.pm < 0]), 5))
-
-        self._nemesis = nemesis
+        q = self.headtohead_set.annotate(pm=F('game_wins') - F('game_losses')).filter(pm__lt=0)
+        self._nemesis = [h.as_opponent() for h in q.select_related('opponent').order_by('pm', 'opponent_id')[:5]]
 
         return self._nemesis
 
@@ -1042,74 +1158,17 @@ class Player(models.Model):
         if '_victim' in dir(self):
             return self._victim
 
-        pm = self._nemesis_victim_helper()
-
-        victim = list(islice((x for x in pm if x.pm > 0), 5))
-
-        self._victim = victim
+        q = self.headtohead_set.annotate(pm=F('game_wins') - F('game_losses')).filter(pm__gt=0)
+        self._victim = [h.as_opponent() for h in q.select_related('opponent').order_by('-pm', 'opponent_id')[:5]]
 
         return self._victim
 
-    def _nemesis_victim_helper(self):
-        if '_nv_pm' not in dir(self):
-            q = Player.objects.raw(PLAYER_PM_QUERY, {"id": self.id})
-            self._nv_pm = list(q)
-        return self._nv_pm
-
     @property
     def rivals_pretty(self):
         return ', '.join(str(x) for x in self.rivals)
 
     # }}}
 
-PLAYER_RIVAL_QUERY = """
-SELECT "player"."id", "player"."country", "player"."tag", "player"."race", Count(T2."plid") AS "matches" 
-FROM player 
-JOIN (
-     SELECT "player"."id" AS "plid", "match"."id" AS "mid" 
-     FROM player JOIN match ON 
-         ("player"."id" = "match"."pla_id" OR "player"."id" = "match"."plb_id") 
-     WHERE ("match"."pla_id" = %(id)s OR "match"."plb_id" = %(id)s) AND "player"."id" != %(id)s 
-     ) T2 
-ON "player"."id" = T2."plid" 
-GROUP BY "player"."id", "player"."country", "player"."tag", "player"."race"
-ORDER BY "matches" DESC
-LIMIT 5;"""
-
-PLAYER_PM_QUERY = """
-SELECT "player"."id", "player"."country", "player"."tag", "player"."race", 
-       Sum(T2."for") - Sum(T2."against") AS "pm"
-FROM player JOIN (
-     SELECT 
-     	    "player"."id" AS "plid", 
-	    "match"."id" AS "mid", 
-	    (CASE 
-	    	  WHEN "player"."id" = "match"."pla_id" THEN 
-		       "match"."scb"
-		  ELSE
-		       "match"."sca"
-		  END
-            ) AS "for", 
-	    (CASE 
-	    	  WHEN "player"."id" = "match"."pla_id" THEN 
-		       "match"."sca"
-		  ELSE
-		       "match"."scb"
-		  END
-            ) AS "against", 
-	    "match"."sca" AS "sca",
-	    "match"."scb" AS "scb",
-	    "match"."pla_id",
-	    "match"."plb_id"
-     FROM player JOIN match ON 
-     ("player"."id" = "match"."pla_id" OR "player"."id" = "match"."plb_id") 
-     WHERE ("match"."pla_id" = %(id)s OR "match"."plb_id" = %(id)s) AND "player"."id" != %(id)s
-     ) T2 
-     ON "player"."id" = T2."plid" 
-GROUP BY "player"."id", "player"."country", "player"."tag", "player"."race"
-ORDER BY "pm" DESC;
-"""
-
 # }}}
 
 # {{{ Stories
@@ -1478,6 +1537,9 @@ class Match(models.Model):
                 self.orig_scb    = self.scb
                 self.orig_date   = self.date
                 self.orig_period = self.period_id
+                self.orig_event  = self.eventobj_id
+                self.orig_offline= self.offline
+                self.orig_game   = self.game
             except:
                 self.orig_pla    = None
                 self.orig_plb    = None
@@ -1487,6 +1549,9 @@ class Match(models.Model):
                 self.orig_scb    = None
                 self.orig_date   = None
                 self.orig_period = None
+                self.orig_event  = None
+                self.orig_offline= None
+                self.orig_game   = None
         else:
             self.orig_pla    = None
             self.orig_plb    = None
@@ -1496,6 +1561,9 @@ class Match(models.Model):
             self.orig_scb    = None
             self.orig_date   = None
             self.orig_period = None
+            self.orig_event  = None
+            self.orig_offline= None
+            self.orig_game   = None
     # }}}
 
     # {{{ changed_effect: Returns true if an effective change (requiring recomputation) has been made.
@@ -1517,6 +1585,17 @@ class Match(models.Model):
         return self.orig_period != self.period_id
     # }}}
 
+    # {{{ changed_event: Returns true if the event has been changed.
+    def changed_event(self):
+        return self.orig_event != self.eventobj_id
+    # }}}
+
+    # {{{ changed_stats: Returns true if anything counted in the player statistics and head-to-head records
+    # (players, races, scores, date or offline) has been changed.
+    def changed_stats(self):
+        return self.changed_effect() or self.changed_date() or self.orig_offline != self.offline
+    # }}}
+
     # {{{ __init__: Has been overloaded to call populate_orig.
     def __init__(self, *args, **kwargs):
         super(Match, self).__init__(*args, **kwargs)
@@ -1528,12 +1607,11 @@ class Match(models.Model):
     def save(self, force_insert=False, force_update=False, *args, **kwargs):
         # Check if the date have been changed. If it has, move to a different period if necessary.
         # Also prepare to update the earliest and latest fields of event objects.
-        update_dates = False
+        events = []
         if self.changed_date():
             self.set_period()
-
-            if self.eventobj:
-                update_dates = True
+        if self.changed_date() or self.changed_event():
+            events = [self.eventobj_id, self.orig_event]
 
         # If the period has been changed, or another effective change has been made, flag period(s).
         if self.changed_period() or self.changed_effect():
@@ -1552,16 +1630,20 @@ class Match(models.Model):
 
             self.treated = False
 
-        # Save to DB and repopulate original fields.
+        # Save to DB and repopulate original fields. Statistics and cached pages are only refreshed if something
+        # they show has changed (not e.g. only the ratings or the treated flag, as set by the update).
+        players = {self.pla_id, self.plb_id, self.orig_pla, self.orig_plb} - {None}
+        pairs = [(self.pla_id, self.plb_id), (self.orig_pla, self.orig_plb)]
+        changed_stats = self.changed_stats()
+        changed_pages = changed_stats or self.changed_event() or self.orig_game != self.game
         super(Match, self).save(force_insert, force_update, *args, **kwargs)
         self.populate_orig()
-
-        if update_dates:
-            for event in self.eventobj.get_ancestors(id=True):
-                if event.earliest is None or self.date < event.earliest:
-                    event.set_earliest(self.date)
-                if event.latest is None or self.date > event.latest:
-                    event.set_latest(self.date)
+        if changed_stats:
+            PlayerStats.refresh(players)
+            HeadToHead.refresh(pairs)
+        if changed_pages:
+            bump_generations('player', players)
+        Event.refresh_dates(events)
     # }}}
 
     # {{{ delete: Has been overloaded to check for effective changes, flagging a period as needing
@@ -1570,13 +1652,136 @@ class Match(models.Model):
         self.period.needs_recompute = True
         self.period.save()
 
-        eventobj = self.eventobj
         super(Match, self).delete(*args, **kwargs)
+        PlayerStats.refresh([self.pla_id, self.plb_id])
+        HeadToHead.refresh([(self.pla_id, self.plb_id)])
+        bump_generations('player', [self.pla_id, self.plb_id])
+        Event.refresh_dates([self.eventobj_id])
+    # }}}
+
+    # {{{ Bulk operations
+    # These do the same bookkeeping as save, but once for all the matches: every affected period is flagged once,
+    # the date ranges of the affected events are refreshed with one statement, and the player statistics and
+    # head-to-head records with one pass each.
 
-        # This is very slow if used for many matches, but that should rarely happen. 
-        if eventobj:
-            for event in self.eventobj.get_ancestors(id=True):
-                event.update_dates()
+    # {{{ bulk_set_periods(matches): Sets the period and the ratings of the given matches (in memory) from their
+    # dates, with one query for the periods and one for the ratings.
+    @staticmethod
+    def bulk_set_periods(matches):
+        if not matches:
+            return
+
+        dates = [m.date for m in matches]
+        periods = list(Period.objects.filter(start__lte=max(dates), end__gte=min(dates)))
+        for m in matches:
+            try:
+                m.period = next(p for p in periods if p.start <= m.date <= p.end)
+            except StopIteration:
+                raise ValidationError(_('No period for the date %s.') % m.date)
+
+        ratings = {
+            (r['player_id'], r['period_id']): r['id']
+            for r in Rating.objects.filter(
+                period_id__in={m.period_id - 1 for m in matches},
+                player_id__in={m.pla_id for m in matches} | {m.plb_id for m in matches},
+            ).values('id', 'player_id', 'period_id')
+        }
+        for m in matches:
+            m.rta_id = ratings.get((m.pla_id, m.period_id - 1))
+            m.rtb_id = ratings.get((m.plb_id, m.period_id - 1))
+    # }}}
+
+    # {{{ bulk_validate(matches): Checks the given matches in memory, raises ValidationError if anything's wrong.
+    @staticmethod
+    def bulk_validate(matches):
+        for m in matches:
+            if m.pla_id is None or m.plb_id is None or m.pla_id == m.plb_id:
+                raise ValidationError(_('Invalid players in %s.') % str(m))
+            if m.sca is None or m.scb is None or m.sca < 0 or m.scb < 0:
+                raise ValidationError(_('Invalid score in %s.') % str(m))
+            if m.date is None:
+                raise ValidationError(_('Missing date in %s.') % str(m))
+    # }}}
+
+    # {{{ bulk_bookkeeping(players, pairs, periods, events): Flags periods, refreshes event dates, player
+    # statistics and head-to-head records, and bumps the cache generations of the players.
+    @staticmethod
+    def bulk_bookkeeping(players, pairs, periods, events):
+        players = set(players) - {None}
+        Period.objects.filter(id__in=set(periods) - {None}).update(needs_recompute=True)
+        Event.refresh_dates(events)
+        PlayerStats.rebuild(players)
+        HeadToHead.refresh(pairs)
+        bump_generations('player', players)
+    # }}}
+
+    # {{{ bulk_add(matches): Inserts new matches, which should not have been saved. Returns them.
+    @staticmethod
+    @transaction.atomic
+    def bulk_add(matches):
+        matches = list(matches)
+        Match.bulk_validate(matches)
+        Match.bulk_set_periods(matches)
+        for m in matches:
+            m.treated = False
+
+        Match.objects.bulk_create(matches)
+        for m in matches:
+            m.populate_orig()
+
+        Match.bulk_bookkeeping(
+            players={m.pla_id for m in matches} | {m.plb_id for m in matches},
+            pairs={(m.pla_id, m.plb_id) for m in matches},
+            periods={m.period_id for m in matches},
+            events={m.eventobj_id for m in matches},
+        )
+        return matches
+    # }}}
+
+    # {{{ bulk_modify(queryset, **changes): Changes the given fields (date, eventobj, offline or game) of the
+    # matches in the queryset. Returns the number of changed matches.
+    BULK_FIELDS = ['date', 'eventobj', 'offline', 'game']
+
+    @staticmethod
+    @transaction.atomic
+    def bulk_modify(queryset, **changes):
+        if set(changes) - set(Match.BULK_FIELDS):
+            raise ValueError('Can only change %s in bulk' % ', '.join(Match.BULK_FIELDS))
+
+        if not changes:
+            return queryset.count()
+
+        matches = list(queryset)
+        events = {m.eventobj_id for m in matches}
+
+        for m in matches:
+            for field, value in changes.items():
+                setattr(m, field, value)
+        Match.bulk_validate(matches)
+
+        fields = list(changes)
+        if 'date' in changes:
+            Match.bulk_set_periods(matches)
+            moved = [m for m in matches if m.changed_period()]
+            for m in moved:
+                m.treated = False
+            periods = {m.orig_period for m in moved} | {m.period_id for m in moved}
+            fields += ['period', 'rta', 'rtb', 'treated']
+        else:
+            periods = set()
+
+        Match.objects.bulk_update(matches, fields, batch_size=1000)
+        for m in matches:
+            m.populate_orig()
+
+        Match.bulk_bookkeeping(
+            players={m.pla_id for m in matches} | {m.plb_id for m in matches},
+            pairs={(m.pla_id, m.plb_id) for m in matches},
+            periods=periods,
+            events=events | {m.eventobj_id for m in matches},
+        )
+        return len(matches)
+    # }}}
     # }}}
 
     # {{{ set_period: Sets the correct period for this match depending on the date.
@@ -1604,22 +1809,11 @@ class Match(models.Model):
         self.save()
     # }}}
 
-    # {{{ set_event(event): Updates the earliest and latest fields for both new and old event.
+    # {{{ set_event(event): Exactly what it says on the tin. The earliest and latest fields for both new and old
+    # event are updated by save.
     def set_event(self, event):
-        old = self.eventobj
         self.eventobj = event
         self.save()
-
-        for e in event.get_ancestors(id=True):
-            if self.date < e.earliest:
-                e.set_earliest(self.date)
-            if self.date > e.latest:
-                e.set_latest(self.date)
-
-        # This is very slow if used for many matches, but that should rarely happen.
-        if oldevent:
-            for event in oldevent.get_ancestors(id=True):
-                event.update_dates()
     # }}}
 
     # {{{ String representation 
@@ -1668,6 +1862,32 @@ class Match(models.Model):
     # }}}
 # }}}
 
+# {{{ Match counts
+# Number of matches and games for each combination of the properties shown on the database statistics page.
+# The table is maintained by a trigger on the match table (see migration 0010), so it's always up to date and
+# small regardless of the number of matches. Matches without submitter are counted with submitter 0.
+class MatchCount(models.Model):
+    class Meta:
+        db_table = 'matchcount'
+        unique_together = ('game', 'offline', 'treated', 'catalogued', 'partial', 'submitter_id')
+
+    game = models.CharField('Game', max_length=10)
+    offline = models.BooleanField('Offline')
+    treated = models.BooleanField('Treated')
+    catalogued = models.BooleanField('Has event object')
+    partial = models.BooleanField('Has event object or text')
+    submitter_id = models.IntegerField('Submitter')
+    matches = models.IntegerField('Matches', default=0)
+    games = models.IntegerField('Games', default=0)
+
+    # {{{ totals(rows, **filters): Returns the number of matches and games among the rows with the given properties
+    @staticmethod
+    def totals(rows, **filters):
+        rows = [r for r in rows if all(getattr(r, k) == v for k, v in filters.items())]
+        return sum(r.matches for r in rows), sum(r.games for r in rows)
+    # }}}
+# }}}
+
 # {{{ Messages
 class Message(models.Model):
     class Meta:
@@ -1760,6 +1980,43 @@ class WCSPoints(models.Model):
     # }}}
 # }}}
 
+# {{{ Exchange rates
+# Historical exchange rates (units of the currency per USD), stored as they're fetched from
+# openexchangerates.org so that each day is only fetched once. Days can also be imported in bulk with
+# import_rates.py.
+class ExchangeRate(models.Model):
+    class Meta:
+        db_table = 'exchangerate'
+        unique_together = ('date', 'currency')
+
+    date = models.DateField('Date', null=False)
+    currency = models.CharField('Currency', max_length=10, null=False)
+    rate = models.FloatField('Rate', null=False, help_text='Units per USD')
+
+    # {{{ load(start, end): Returns a dict mapping dates between start and end (inclusive) to dicts of rates
+    @staticmethod
+    def load(start, end):
+        days = {}
+        rates = ExchangeRate.objects.filter(date__gte=start, date__lte=end).values_list('date', 'currency', 'rate')
+        for date, currency, rate in rates:
+            days.setdefault(date, {})[currency] = rate
+        return days
+    # }}}
+
+    # {{{ import_days(days): Stores the rates in a dict mapping dates to dicts of rates. Rates that are already
+    # stored are left alone.
+    @staticmethod
+    def import_days(days):
+        ExchangeRate.objects.bulk_create([
+            ExchangeRate(date=date, currency=currency, rate=rate)
+            for date, rates in days.items() for currency, rate in rates.items()
+        ], ignore_conflicts=True, batch_size=5000)
+    # }}}
+# }}}
+
+# Rates used by this process, kept in memory (past rates don't change)
+exchange_rates = RateStore(ExchangeRate)
+
 # {{{ Earnings
 class Earnings(models.Model):
     class Meta:
@@ -1804,35 +2061,45 @@ class Earnings(models.Model):
         if Earnings.objects.filter(event=event).exists():
             event.delete_earnings(ranked=ranked)
 
-        for payout in payouts:
-            new = Earnings(
+        Earnings.objects.bulk_create([
+            Earnings(
                 event=event,
                 player=payout['player'],
                 placement=payout['placement']+1,
                 origearnings=payout['prize'],
                 currency=currency,
-            )
-            new.save()
+            ) for payout in payouts
+        ])
 
         Earnings.convert_earnings(event)
 
         event.set_prizepool(True)
+
+        new_players = {payout['player'].id for payout in payouts}
+        EarningsSummary.refresh(new_players)
+        bump_generations('player', new_players)
     # }}}
 
     # {{{ convert_earnings(event): Performs currency conversion for all earnings associated to an event.
+    # The rates are looked up once for all currencies of the event, and the earnings are written in one query.
     @staticmethod
     def convert_earnings(event):
-        earningobjs = Earnings.objects.filter(event=event)
+        earningobjs = list(Earnings.objects.filter(event=event))
         event.update_dates()
         date = event.latest
 
+        currencies = {e.currency.upper() for e in earningobjs} - {'USD'}
+        if currencies:
+            exchange_rates.preload([date])
+            rates = exchange_rates.rates(date, sorted(currencies))
+
         for earning in earningobjs:
-            if earning.currency == 'USD':
+            if earning.currency.upper() == 'USD':
                 earning.earnings = earning.origearnings
             else:
-                exchangerates = ExchangeRates(date)
-                earning.earnings = round(exchangerates.convert(earning.origearnings, earning.currency))
-            earning.save()
+                earning.earnings = round(earning.origearnings / Decimal(rates[earning.currency.upper()]))
+
+        Earnings.objects.bulk_update(earningobjs, ['earnings'])
     # }}}
 
     # {{{ String representation
@@ -1841,6 +2108,58 @@ class Earnings(models.Model):
     # }}}
 # }}}
 
+# {{{ EarningsSummary
+# Total earnings of each player per year (of the event's latest match) and currency, for the earnings ranking.
+# Refreshed for the affected players wherever earnings are changed (Earnings.set_earnings, Event.delete_earnings,
+# Event.move_earnings, player merges and event deletes in the admin), and rebuilt by the update, which also picks
+# up events whose year has changed.
+EARNINGS_SUMMARY_QUERY = """
+INSERT INTO earningssummary (player_id, year, currency, earnings, origearnings)
+SELECT e.player_id, EXTRACT(YEAR FROM ev.latest)::integer, e.currency, SUM(e.earnings), SUM(e.origearnings)
+FROM earnings e JOIN event ev ON ev.id = e.event_id
+WHERE e.earnings IS NOT NULL AND {where}
+GROUP BY 1, 2, 3
+"""
+
+class EarningsSummary(models.Model):
+    class Meta:
+        db_table = 'earningssummary'
+        unique_together = ('player', 'year', 'currency')
+        indexes = [
+            models.Index(fields=['year', 'currency'], name='earningssummary_year'),
+        ]
+
+    player = models.ForeignKey(Player, null=False, on_delete=models.CASCADE, verbose_name='Player')
+    year = models.IntegerField('Year', null=True)
+    currency = models.CharField('Original currency', max_length=30, null=False)
+    earnings = models.BigIntegerField('Earnings (USD)', null=False)
+    origearnings = models.DecimalField(
+        'Earnings (original currency)', decimal_places=8, max_digits=16+8, null=False
+    )
+
+    # {{{ refresh(player_ids): Recomputes the rows of the given players.
+    @staticmethod
+    def refresh(player_ids):
+        player_ids = list(set(player_ids))
+        if not player_ids:
+            return
+
+        with transaction.atomic():
+            EarningsSummary.objects.filter(player_id__in=player_ids).delete()
+            cur = connection.cursor()
+            cur.execute(EARNINGS_SUMMARY_QUERY.format(where='e.player_id = ANY(%(ids)s)'), {'ids': player_ids})
+    # }}}
+
+    # {{{ rebuild: Recomputes the whole table.
+    @staticmethod
+    def rebuild():
+        with transaction.atomic():
+            cur = connection.cursor()
+            cur.execute('DELETE FROM earningssummary')
+            cur.execute(EARNINGS_SUMMARY_QUERY.format(where='TRUE'))
+    # }}}
+# }}}
+
 # {{{ PreMatchGroups
 class PreMatchGroup(models.Model):
     class Meta:
@@ -2192,6 +2511,385 @@ class Rating(models.Model):
     # }}}
 # }}}
 
+# {{{ PeriodSummaries
+# Leaders and movers shown on the ranking page, computed once when the period is recomputed. The leaders are
+# stored as a JSON object mapping keys such as 'best', 'bestpvt' and 'specvz' to rating IDs, and 'gainers' and
+# 'losers' to lists of rating IDs.
+class PeriodSummary(models.Model):
+    class Meta:
+        db_table = 'periodsummary'
+
+    period = models.OneToOneField(
+        Period, primary_key=True, related_name='summary', on_delete=models.CASCADE,
+        help_text='Period summarized'
+    )
+    leaders = models.TextField('Leaders', default='{}', help_text='Leaders and movers (JSON)')
+    # '{}' until computed, see refresh
+    counts = models.TextField('Counts', default='{}', help_text='Active players by race and country (JSON)')
+
+    # {{{ String representation
+    def __str__(self):
+        return 'Summary of period #%i' % self.period_id
+    # }}}
+
+    # {{{ get_leaders: Returns the leaders as a dict
+    def get_leaders(self):
+        return json.loads(self.leaders)
+    # }}}
+
+    # {{{ count(race, nats): Returns the number of active players matching the race and nationality filters of
+    # the rating list, e.g. count('pz', 'foreigners').
+    def count(self, race='ptzrs', nats='all'):
+        total = 0
+        for r, countries in json.loads(self.counts).items():
+            if r.lower() not in race.lower():
+                continue
+            for cc, n in countries.items():
+                if nats == 'all' or (nats == 'foreigners' and cc != 'KR') or cc == nats:
+                    total += n
+        return total
+    # }}}
+
+    # {{{ get_countries: Returns the country codes of all active players
+    def get_countries(self):
+        return {cc for countries in json.loads(self.counts).values() for cc in countries if cc}
+    # }}}
+
+    # {{{ refresh(period): Computes and saves the summary of a period.
+    @staticmethod
+    def refresh(period):
+        ratings = list(
+            Rating.objects.filter(period=period, decay__lt=INACTIVE_THRESHOLD).values(
+                'id', 'player__race', 'player__country', 'rating', 'rating_vp', 'rating_vt', 'rating_vz',
+                'dev_vp', 'dev_vt', 'dev_vz', 'prev__rating',
+            )
+        )
+
+        def top(rows, key):
+            return max(rows, key=key)['id'] if rows else None
+
+        def spec(r, vs):
+            return r['rating_v' + vs] / r['dev_v' + vs] * (r['rating'] + 1.5)
+
+        leaders = {}
+        for race in ['', 'p', 't', 'z']:
+            rows = [r for r in ratings if r['player__race'] == race.upper()] if race else ratings
+            leaders['best' + race] = top(rows, lambda r: r['rating'])
+            for vs in 'ptz':
+                leaders['best%sv%s' % (race, vs)] = top(rows, lambda r: r['rating'] + r['rating_v' + vs])
+                leaders['spec%sv%s' % (race, vs)] = top(rows, lambda r: spec(r, vs))
+
+        movers = sorted(
+            (r for r in ratings if r['prev__rating'] is not None),
+            key=lambda r: r['rating'] - r['prev__rating'],
+        )
+        leaders['gainers'] = [r['id'] for r in movers[::-1][:5]]
+        leaders['losers'] = [r['id'] for r in movers[:5]]
+
+        counts = {}
+        for r in ratings:
+            cells = counts.setdefault(r['player__race'], {})
+            cc = r['player__country'] or ''
+            cells[cc] = cells.get(cc, 0) + 1
+
+        # An empty object means the counts haven't been computed, so periods without active players get a
+        # sentinel that counts as zero
+        if not counts:
+            counts = {'': {}}
+
+        summary = PeriodSummary(period=period, leaders=json.dumps(leaders), counts=json.dumps(counts))
+        summary.save()
+        return summary
+    # }}}
+# }}}
+
+# {{{ PlayerStats
+# Match statistics of a player, kept up to date by Match.save and Match.delete and rebuilt in bulk by the
+# update (see PlayerStats.rebuild), so that the player summary page needs a single row.
+class PlayerStats(models.Model):
+    class Meta:
+        db_table = 'playerstats'
+
+    player = models.OneToOneField(
+        Player, primary_key=True, related_name='stats', on_delete=models.CASCADE,
+        help_text='Player'
+    )
+    matches = models.IntegerField('Matches', default=0)
+    offline = models.IntegerField('Offline matches', default=0)
+    first = models.DateField('First match', null=True, blank=True)
+    last = models.DateField('Last match', null=True, blank=True)
+    wins = models.IntegerField('Game wins', default=0)
+    losses = models.IntegerField('Game losses', default=0)
+    vp_wins = models.IntegerField('Game wins vP', default=0)
+    vp_losses = models.IntegerField('Game losses vP', default=0)
+    vt_wins = models.IntegerField('Game wins vT', default=0)
+    vt_losses = models.IntegerField('Game losses vT', default=0)
+    vz_wins = models.IntegerField('Game wins vZ', default=0)
+    vz_losses = models.IntegerField('Game losses vZ', default=0)
+
+    COUNTS = [
+        'matches', 'offline', 'wins', 'losses',
+        'vp_wins', 'vp_losses', 'vt_wins', 'vt_losses', 'vz_wins', 'vz_losses',
+    ]
+
+    # {{{ String representation
+    def __str__(self):
+        return 'Statistics of %s' % str(self.player)
+    # }}}
+
+    # {{{ Win-loss tuples, as returned by count_winloss_player and count_matchup_player
+    def total(self):
+        return self.wins, self.losses
+
+    def vp(self):
+        return self.vp_wins, self.vp_losses
+
+    def vt(self):
+        return self.vt_wins, self.vt_losses
+
+    def vz(self):
+        return self.vz_wins, self.vz_losses
+    # }}}
+
+    # {{{ aggregate(queryset, player_id): Computes the statistics of a player over a queryset of matches (which
+    # should only contain matches of that player) in one query.
+    @staticmethod
+    def aggregate(queryset, player_id):
+        def score(own, races=None):
+            # Games won (own=True) or lost (own=False) by the player, optionally against a given race
+            when_a, when_b = Q(pla_id=player_id), Q(plb_id=player_id)
+            if races is not None:
+                when_a, when_b = when_a & Q(rcb=races), when_b & Q(rca=races)
+            return Sum(Case(
+                When(when_a, then=F('sca' if own else 'scb')),
+                When(when_b, then=F('scb' if own else 'sca')),
+                default=Value(0),
+                output_field=models.IntegerField(),
+            ))
+
+        agg = queryset.aggregate(
+            matches=Count('id'),
+            offline=Count('id', filter=Q(offline=True)),
+            first=Min('date'),
+            last=Max('date'),
+            wins=score(True),
+            losses=score(False),
+            vp_wins=score(True, P), vp_losses=score(False, P),
+            vt_wins=score(True, T), vt_losses=score(False, T),
+            vz_wins=score(True, Z), vz_losses=score(False, Z),
+        )
+        for key in PlayerStats.COUNTS:
+            agg[key] = agg[key] or 0
+        return PlayerStats(player_id=player_id, **agg)
+    # }}}
+
+    # {{{ refresh(player_ids): Recomputes and saves the statistics of the given players.
+    @staticmethod
+    def refresh(player_ids):
+        for player_id in set(player_ids) - {None}:
+            PlayerStats.aggregate(Match.objects.filter(Q(pla_id=player_id) | Q(plb_id=player_id)), player_id).save()
+    # }}}
+
+    # {{{ rebuild(player_ids=None): Recomputes the statistics of the given players (or all players), with one
+    # grouped query for each side of the matches.
+    @staticmethod
+    def rebuild(player_ids=None):
+        matches, existing = Match.objects.all(), PlayerStats.objects.all()
+        if player_ids is not None:
+            player_ids = set(player_ids) - {None}
+            existing = existing.filter(player_id__in=player_ids)
+
+        stats = {}
+        for me, op, own, other in [('pla', 'rcb', 'sca', 'scb'), ('plb', 'rca', 'scb', 'sca')]:
+            def by_race(col, race):
+                return Sum(Case(When(**{op: race, 'then': F(col)}), default=Value(0),
+                                output_field=models.IntegerField()))
+
+            side = matches if player_ids is None else matches.filter(**{me + '_id__in': player_ids})
+            rows = side.values(me).order_by().annotate(
+                matches=Count('id'),
+                offline=Count('id', filter=Q(offline=True)),
+                first=Min('date'),
+                last=Max('date'),
+                wins=Sum(own),
+                losses=Sum(other),
+                vp_wins=by_race(own, P), vp_losses=by_race(other, P),
+                vt_wins=by_race(own, T), vt_losses=by_race(other, T),
+                vz_wins=by_race(own, Z), vz_losses=by_race(other, Z),
+            )
+
+            for row in rows:
+                player_id = row.pop(me)
+                if player_id not in stats:
+                    stats[player_id] = PlayerStats(player_id=player_id, **row)
+                    continue
+                s = stats[player_id]
+                for key in PlayerStats.COUNTS:
+                    setattr(s, key, getattr(s, key) + row[key])
+                s.first = min(d for d in [s.first, row['first']] if d is not None)
+                s.last = max(d for d in [s.last, row['last']] if d is not None)
+
+        with transaction.atomic():
+            existing.delete()
+            PlayerStats.objects.bulk_create(stats.values(), batch_size=1000)
+    # }}}
+# }}}
+
+# {{{ HeadToHead
+# Aggregated results between each pair of players, with one row for each player's side (so every pair appears
+# twice). Kept up to date by Match.save and Match.delete and rebuilt in bulk by the update.
+HEAD_TO_HEAD_QUERY = """
+INSERT INTO headtohead
+    (player_id, opponent_id, matches, match_wins, match_losses, game_wins, game_losses, last_played)
+SELECT me, op, COUNT(*),
+       SUM(CASE WHEN sc_me > sc_op THEN 1 ELSE 0 END),
+       SUM(CASE WHEN sc_op > sc_me THEN 1 ELSE 0 END),
+       SUM(sc_me), SUM(sc_op), MAX(date)
+FROM (
+    SELECT pla_id AS me, plb_id AS op, sca AS sc_me, scb AS sc_op, date FROM match WHERE {where}
+    UNION ALL
+    SELECT plb_id AS me, pla_id AS op, scb AS sc_me, sca AS sc_op, date FROM match WHERE {where}
+) T
+GROUP BY me, op
+"""
+
+class HeadToHead(models.Model):
+    class Meta:
+        db_table = 'headtohead'
+        unique_together = ('player', 'opponent')
+        indexes = [
+            models.Index(fields=['player', '-matches'], name='headtohead_matches'),
+        ]
+
+    player = models.ForeignKey(Player, null=False, on_delete=models.CASCADE, verbose_name='Player')
+    opponent = models.ForeignKey(
+        Player, null=False, on_delete=models.CASCADE, related_name='+', verbose_name='Opponent'
+    )
+    matches = models.IntegerField('Matches', default=0)
+    match_wins = models.IntegerField('Match wins', default=0)
+    match_losses = models.IntegerField('Match losses', default=0)
+    game_wins = models.IntegerField('Game wins', default=0)
+    game_losses = models.IntegerField('Game losses', default=0)
+    last_played = models.DateField('Last played', null=True, blank=True)
+
+    # {{{ String representation
+    def __str__(self):
+        return '%s vs. %s' % (str(self.player), str(self.opponent))
+    # }}}
+
+    # {{{ as_opponent: Returns the opponent, with matches and pm (game wins minus losses) attributes, as used
+    # by the rivals, nemesis and victim lists.
+    def as_opponent(self):
+        opponent = self.opponent
+        opponent.matches = self.matches
+        opponent.pm = self.game_wins - self.game_losses
+        return opponent
+    # }}}
+
+    # {{{ refresh(pairs): Recomputes the rows of the given pairs of player IDs.
+    @staticmethod
+    def refresh(pairs):
+        pairs = {tuple(sorted(pair)) for pair in pairs if None not in pair}
+        if not pairs:
+            return
+
+        where = ' OR '.join(['(pla_id=%s AND plb_id=%s) OR (pla_id=%s AND plb_id=%s)'] * len(pairs))
+        params = []
+        for a, b in pairs:
+            params += [a, b, b, a]
+
+        with transaction.atomic():
+            q = Q()
+            for a, b in pairs:
+                q |= Q(player_id=a, opponent_id=b) | Q(player_id=b, opponent_id=a)
+            HeadToHead.objects.filter(q).delete()
+            cur = connection.cursor()
+            cur.execute(HEAD_TO_HEAD_QUERY.format(where='(%s)' % where), params * 2)
+    # }}}
+
+    # {{{ rebuild: Recomputes the whole table in one pass over the matches.
+    @staticmethod
+    def rebuild():
+        with transaction.atomic():
+            cur = connection.cursor()
+            cur.execute('DELETE FROM headtohead')
+            cur.execute(HEAD_TO_HEAD_QUERY.format(where='TRUE'))
+    # }}}
+# }}}
+
+# {{{ PeakRating
+# The highest rating of each player, overall and against each race, with the rating object (and thus period)
+# where it was reached. Rows with record=False consider every computed period (player highs, rating history),
+# rows with record=True only active ratings after period 16 (the records pages). Rebuilt by the update.
+PEAK_KINDS = {
+    'rating': 'rating.rating',
+    'tot_vp': 'rating.rating + rating.rating_vp',
+    'tot_vt': 'rating.rating + rating.rating_vt',
+    'tot_vz': 'rating.rating + rating.rating_vz',
+}
+
+PEAK_RATING_QUERY = """
+INSERT INTO peakrating (player_id, kind, record, rating_id, value)
+SELECT DISTINCT ON (rating.player_id) rating.player_id, %(kind)s, %(record)s, rating.id, {expr}
+FROM rating JOIN period ON rating.period_id = period.id
+WHERE {where}
+ORDER BY rating.player_id, {expr} DESC, rating.period_id
+"""
+
+class PeakRating(models.Model):
+    class Meta:
+        db_table = 'peakrating'
+        unique_together = ('player', 'kind', 'record')
+        indexes = [
+            models.Index(fields=['kind', 'record', '-value'], name='peakrating_value'),
+        ]
+
+    player = models.ForeignKey(Player, null=False, on_delete=models.CASCADE, verbose_name='Player')
+    kind = models.CharField(
+        'Kind', max_length=10, null=False, choices=[(k, k) for k in sorted(PEAK_KINDS)]
+    )
+    record = models.BooleanField('Counts for records', default=False)
+    rating = models.ForeignKey(Rating, null=False, on_delete=models.CASCADE, verbose_name='Rating')
+    value = models.FloatField('Value', null=False)
+
+    # {{{ String representation
+    def __str__(self):
+        return 'Peak %s of %s' % (self.kind, str(self.player))
+    # }}}
+
+    # {{{ rebuild: Recomputes the peaks of all players.
+    @staticmethod
+    def rebuild():
+        with transaction.atomic():
+            cur = connection.cursor()
+            cur.execute('DELETE FROM peakrating')
+            for kind, expr in PEAK_KINDS.items():
+                cur.execute(
+                    PEAK_RATING_QUERY.format(expr=expr, where='period.computed'),
+                    {'kind': kind, 'record': False},
+                )
+                cur.execute(
+                    PEAK_RATING_QUERY.format(
+                        expr=expr, where='rating.decay < %i AND rating.period_id > 16' % INACTIVE_THRESHOLD
+                    ),
+                    {'kind': kind, 'record': True},
+                )
+    # }}}
+
+    # {{{ top(kind, record, queryset=None): Returns the ratings of the highest peaks of the given kind, one per
+    # player. The queryset (of PeakRating) can be used to filter by player.
+    @staticmethod
+    def top(kind, record, queryset=None):
+        if queryset is None:
+            queryset = PeakRating.objects.all()
+        return (
+            queryset.filter(kind=kind, record=record)
+                .select_related('rating', 'rating__player', 'rating__period')
+                .order_by('-value', 'player_id')
+        )
+    # }}}
+# }}}
+
 # {{{ BalanceEntries
 class BalanceEntry(models.Model):
     class Meta:
@@ -2209,6 +2907,21 @@ class BalanceEntry(models.Model):
     z_gains = models.FloatField('Z gains', null=False)
 # }}}
 
+# {{{ Clock entries
+# Precomputed state of the "days since" clocks (see ratings.clocks). The items are the ids of the matches shown,
+# or pairs of event id and the ids of the top two earnings, in order. The last match and earnings ids seen are
+# kept so that the next update only needs to look at newer rows.
+class ClockEntry(models.Model):
+    class Meta:
+        db_table = 'clockentry'
+
+    key = models.CharField('Key', max_length=50, primary_key=True)
+    date = models.DateField('Date', null=True, blank=True)
+    items = models.TextField('Items', default='[]', help_text='Matches or events shown (JSON)')
+    last_match = models.IntegerField('Last match seen', default=0)
+    last_earnings = models.IntegerField('Last earnings seen', default=0)
+# }}}
+
 # {{{ API access keys
 class APIKey(models.Model):
     class Meta:
@@ -32,24 +32,20 @@ from aligulac.settings import INACTIVE_THRESHOLD
 from ratings.models import (
     GAMES,
     Match,
-    P,
     Period,
     Player,
+    PlayerStats,
     RACES,
     Rating,
     STORIES,
     Story,
-    T,
     TLPD_DBS,
     WCS_TIERS,
     WCS_YEARS,
-    Z
 )
 from ratings.tools import (
     add_counts,
     cdf,
-    count_winloss_player,
-    count_matchup_player,
     display_matches,
     filter_flags,
     get_placements,
@@ -267,27 +263,32 @@ def player(request, player_id):
     # }}}
 
     # {{{ Various easy data
-    matches = player.get_matchset()
-    recent = matches.filter(date__gte=(date.today() - relativedelta(months=2)))
+    try:
+        stats = player.stats
+    except PlayerStats.DoesNotExist:
+        stats = PlayerStats.aggregate(player.get_matchset(), player.id)
+    recent = PlayerStats.aggregate(
+        player.get_matchset().filter(date__gte=(date.today() - relativedelta(months=2))), player.id
+    )
 
     base.update({
         'player':           player,
         'modform':          modform,
-        'first':            etn(lambda: matches.earliest('date')),
-        'last':             etn(lambda: matches.latest('date')),
-        'totalmatches':     matches.count(),
-        'offlinematches':   matches.filter(offline=True).count(),
+        'first':            stats.first,
+        'last':             stats.last,
+        'totalmatches':     stats.matches,
+        'offlinematches':   stats.offline,
         'aliases':          player.alias_set.all(),
         'earnings':         ntz(player.earnings_set.aggregate(Sum('earnings'))['earnings__sum']),
         'team':             player.get_current_team(),
-        'total':            count_winloss_player(matches, player),
-        'vp':               count_matchup_player(matches, player, P),
-        'vt':               count_matchup_player(matches, player, T),
-        'vz':               count_matchup_player(matches, player, Z),
-        'totalf':           count_winloss_player(recent, player),
-        'vpf':              count_matchup_player(recent, player, P),
-        'vtf':              count_matchup_player(recent, player, T),
-        'vzf':              count_matchup_player(recent, player, Z),
+        'total':            stats.total(),
+        'vp':               stats.vp(),
+        'vt':               stats.vt(),
+        'vz':               stats.vz(),
+        'totalf':           recent.total(),
+        'vpf':              recent.vp(),
+        'vtf':              recent.vt(),
+        'vzf':              recent.vz(),
     })
 
     base['riv_nem_vic'] = zip_longest(
@@ -317,13 +318,15 @@ def player(request, player_id):
     # {{{ If the player has at least one rating
     if player.current_rating:
         ratings = total_ratings(player.rating_set.filter(period__computed=True)).select_related('period')
+        peaks = {
+            p.kind: p.rating
+            for p in player.peakrating_set.filter(record=False).select_related('rating', 'rating__period')
+        }
+        if len(peaks) < 4:
+            peaks = {key: ratings.latest(key) for key in ['rating', 'tot_vp', 'tot_vt', 'tot_vz']}
+
         base.update({
-            'highs': (
-                ratings.latest('rating'),
-                ratings.latest('tot_vp'),
-                ratings.latest('tot_vt'),
-                ratings.latest('tot_vz'),
-            ),
+            'highs': (peaks['rating'], peaks['tot_vp'], peaks['tot_vt'], peaks['tot_vz']),
             'recentchange':  player.get_latest_rating_update(),
             'firstrating':   ratings.earliest('period'),
             'rating':        player.current_rating,
@@ -569,16 +572,17 @@ def results(request, player_id):
         'msc_op': sum(1 for m in base['matches'] if m['plb']['score'] > m['pla']['score']),
     })
 
-    recent = matches.filter(date__gte=(date.today() - relativedelta(months=2)))
+    stats = PlayerStats.aggregate(matches, player.id)
+    recent = PlayerStats.aggregate(matches.filter(date__gte=(date.today() - relativedelta(months=2))), player.id)
     base.update({
-        'total': count_winloss_player(matches, player),
-        'vp': count_matchup_player(matches, player, P),
-        'vt': count_matchup_player(matches, player, T),
-        'vz': count_matchup_player(matches, player, Z),
-        'totalf': count_winloss_player(recent, player),
-        'vpf': count_matchup_player(recent, player, P),
-        'vtf': count_matchup_player(recent, player, T),
-        'vzf': count_matchup_player(recent, player, Z)
+        'total': stats.total(),
+        'vp': stats.vp(),
+        'vt': stats.vt(),
+        'vz': stats.vz(),
+        'totalf': recent.total(),
+        'vpf': recent.vp(),
+        'vtf': recent.vt(),
+        'vzf': recent.vz(),
     })
     # }}}
 
@@ -4,6 +4,7 @@ from django.shortcuts import (
     render_to_response,
 )
 from django.db.models import (
+    Count,
     F,
     Q,
     Sum,
@@ -14,22 +15,20 @@ from django.template.defaultfilters import (
 from django.utils.translation import ugettext_lazy as _
 
 from ratings.models import (
-    Earnings,
-    P,
+    EarningsSummary,
     Period,
+    PeriodSummary,
     Player,
     Rating,
-    T,
-    Z,
 )
 from ratings.tools import (
     count_matchup_games,
     count_mirror_games,
+    country_code_list,
     country_list,
     currency_list,
     filter_active,
     populate_teams,
-    total_ratings,
 )
 
 from aligulac.cache import cache_page
@@ -38,7 +37,60 @@ from aligulac.tools import (
     base_ctx,
     get_param,
 )
-from aligulac.settings import INACTIVE_THRESHOLD, SHOW_PER_LIST_PAGE
+from aligulac.settings import SHOW_PER_LIST_PAGE
+# }}}
+
+# {{{ filter_ratings: Returns the active ratings of a period matching the filters of the rating list, annotated
+# with the key they're sorted by (rating, or total rating against a race).
+def filter_ratings(period, race='ptzrs', nats='all', sort=''):
+    entries = filter_active(period.rating_set).select_related('player')
+
+    # Race filter
+    q = Q()
+    for r in race:
+        q |= Q(player__race=r.upper())
+    entries = entries.filter(q)
+
+    # Country filter
+    if nats == 'foreigners':
+        entries = entries.exclude(player__country='KR')
+    elif nats != 'all':
+        entries = entries.filter(player__country=nats)
+
+    # Sorting (ties are broken by tag and ID, so that the order is total and pages can be seeked)
+    if sort not in ['vp', 'vt', 'vz']:
+        return entries.annotate(sortkey=F('rating'))
+    return entries.annotate(sortkey=F('rating') + F('rating_' + sort))
+# }}}
+
+# {{{ get_page: Returns the given page of a rating list annotated with sortkey. The links to the adjacent pages
+# carry the first or last rating ID of the current page (before and after), so those pages are fetched by
+# seeking past that rating on (sortkey, tag, ID). Other pages are fetched with OFFSET from whichever end of the
+# list is closest, which requires the number of items.
+ORDER = ('-sortkey', 'player__tag', 'id')
+REVERSE = ('sortkey', '-player__tag', '-id')
+
+def get_page(entries, page, pagesize, nitems, after=None, before=None):
+    for cursor, reverse in [(after, False), (before, True)]:
+        try:
+            key = entries.values('sortkey', 'player__tag', 'id').get(id=int(cursor))
+        except (TypeError, ValueError, Rating.DoesNotExist):
+            continue
+
+        sortkey, tag, i = key['sortkey'], key['player__tag'], key['id']
+        if not reverse:
+            q = Q(sortkey__lt=sortkey) | Q(sortkey=sortkey, player__tag__gt=tag)
+            q |= Q(sortkey=sortkey, player__tag=tag, id__gt=i)
+            return list(entries.filter(q).order_by(*ORDER)[:pagesize])
+        else:
+            q = Q(sortkey__gt=sortkey) | Q(sortkey=sortkey, player__tag__lt=tag)
+            q |= Q(sortkey=sortkey, player__tag=tag, id__lt=i)
+            return list(entries.filter(q).order_by(*REVERSE)[:pagesize])[::-1]
+
+    start, stop = (page-1)*pagesize, min(page*pagesize, nitems)
+    if start <= nitems - stop:
+        return list(entries.order_by(*ORDER)[start:stop])
+    return list(entries.order_by(*REVERSE)[nitems-stop:nitems-start])[::-1]
 # }}}
 
 msg_preview = _('This is a <em>preview</em> of the next rating list. It will not be finalized until %s.')
@@ -71,59 +123,29 @@ def period(request, period_id=None):
         base['curpage'] = ''
     # }}}
 
-    # {{{ Best and most specialised players
-    qset = total_ratings(filter_active(Rating.objects.filter(period=period))).select_related('player')
-    qsetp = qset.filter(player__race=P)
-    qsett = qset.filter(player__race=T)
-    qsetz = qset.filter(player__race=Z)
-    base.update({
-        'best':     qset.latest('rating'),
-        'bestvp':   qset.latest('tot_vp'),
-        'bestvt':   qset.latest('tot_vt'),
-        'bestvz':   qset.latest('tot_vz'),
-        'bestp':    qsetp.latest('rating'),
-        'bestpvp':  qsetp.latest('tot_vp'),
-        'bestpvt':  qsetp.latest('tot_vt'),
-        'bestpvz':  qsetp.latest('tot_vz'),
-        'bestt':    qsett.latest('rating'),
-        'besttvp':  qsett.latest('tot_vp'),
-        'besttvt':  qsett.latest('tot_vt'),
-        'besttvz':  qsett.latest('tot_vz'),
-        'bestz':    qsetz.latest('rating'),
-        'bestzvp':  qsetz.latest('tot_vp'),
-        'bestzvt':  qsetz.latest('tot_vt'),
-        'bestzvz':  qsetz.latest('tot_vz'),
-        'specvp':   qset.extra(select={'d':   'rating_vp/dev_vp*(rating+1.5)'}).latest('d'),
-        'specvt':   qset.extra(select={'d':   'rating_vt/dev_vt*(rating+1.5)'}).latest('d'),
-        'specvz':   qset.extra(select={'d':   'rating_vz/dev_vz*(rating+1.5)'}).latest('d'),
-        'specpvp':  qsetp.extra(select={'d':  'rating_vp/dev_vp*(rating+1.5)'}).latest('d'),
-        'specpvt':  qsetp.extra(select={'d':  'rating_vt/dev_vt*(rating+1.5)'}).latest('d'),
-        'specpvz':  qsetp.extra(select={'d':  'rating_vz/dev_vz*(rating+1.5)'}).latest('d'),
-        'spectvp':  qsett.extra(select={'d':  'rating_vp/dev_vp*(rating+1.5)'}).latest('d'),
-        'spectvt':  qsett.extra(select={'d':  'rating_vt/dev_vt*(rating+1.5)'}).latest('d'),
-        'spectvz':  qsett.extra(select={'d':  'rating_vz/dev_vz*(rating+1.5)'}).latest('d'),
-        'speczvp':  qsetz.extra(select={'d':  'rating_vp/dev_vp*(rating+1.5)'}).latest('d'),
-        'speczvt':  qsetz.extra(select={'d':  'rating_vt/dev_vt*(rating+1.5)'}).latest('d'),
-        'speczvz':  qsetz.extra(select={'d':  'rating_vz/dev_vz*(rating+1.5)'}).latest('d'),
-    })
-    # }}}
+    # {{{ Best and most specialised players, highest gainers and biggest losers (computed by period.py)
+    try:
+        summary = period.summary
+    except PeriodSummary.DoesNotExist:
+        summary = PeriodSummary.refresh(period)
+
+    leaders = summary.get_leaders()
+    gainers, losers = leaders.pop('gainers'), leaders.pop('losers')
+    ratings = Rating.objects.select_related('player', 'prev', 'period').in_bulk(
+        [i for i in leaders.values() if i is not None] + gainers + losers
+    )
 
-    # {{{ Highest gainer and biggest losers
+    base.update({key: ratings.get(i) for key, i in leaders.items()})
 
-    # TODO: Fix these queries, highly dependent on the way django does things.
-    gainers = filter_active(Rating.objects.filter(period=period))\
-        .filter(prev__isnull=False)\
-        .select_related('prev', 'player')\
-        .extra(select={'diff': 'rating.rating - T3.rating'})\
-        .order_by('-diff')
-    losers = filter_active(Rating.objects.filter(period=period))\
-        .filter(prev__isnull=False)\
-        .select_related('prev', 'player')\
-        .extra(select={'diff': 'rating.rating - T3.rating'})\
-        .order_by('diff')
+    for r in ratings.values():
+        if r.prev is not None:
+            r.diff = r.rating - r.prev.rating
 
     base.update({
-        'updown': zip(gainers[:5], losers[:5])
+        'updown': zip(
+            [ratings[i] for i in gainers if i in ratings],
+            [ratings[i] for i in losers if i in ratings],
+        )
     })
     # }}}
 
@@ -142,35 +164,16 @@ def period(request, period_id=None):
     # }}}
 
     # {{{ Build country list
-    all_players = Player.objects.filter(rating__period_id=period.id, rating__decay__lt=INACTIVE_THRESHOLD)
-    base['countries'] = country_list(all_players)
+    if summary.counts == '{}':
+        summary = PeriodSummary.refresh(period)
+    base['countries'] = country_code_list(summary.get_countries())
     # }}}
 
     # {{{ Initial filtering of ratings
-    entries = filter_active(period.rating_set).select_related('player')
-
-    # Race filter
     race = get_param(request, 'race', 'ptzrs')
-    q = Q()
-    for r in race:
-        q |= Q(player__race=r.upper())
-    entries = entries.filter(q)
-
-    # Country filter
     nats = get_param(request, 'nats', 'all')
-    if nats == 'foreigners':
-        entries = entries.exclude(player__country='KR')
-    elif nats != 'all':
-        entries = entries.filter(player__country=nats)
-
-    # Sorting
     sort = get_param(request, 'sort', '')
-    if sort not in ['vp', 'vt', 'vz']: 
-        entries = entries.order_by('-rating', 'player__tag')
-    else:
-        entries = entries.extra(select={'d':'rating+rating_'+sort}).order_by('-d', 'player__tag')
-
-    entries = entries.prefetch_related('prev')
+    entries = filter_ratings(period, race, nats, sort).prefetch_related('prev')
 
     base.update({
         'race': race,
@@ -182,10 +185,18 @@ def period(request, period_id=None):
     # {{{ Pages etc.
     pagesize = SHOW_PER_LIST_PAGE
     page = int(get_param(request, 'page', 1))
-    nitems = entries.count()
+    nitems = summary.count(race, nats)
     npages = nitems//pagesize + (1 if nitems % pagesize > 0 else 0)
     page = min(max(page, 1), npages)
-    entries = entries[(page-1)*pagesize : page*pagesize] if page > 0 else []
+
+    if page > 0:
+        entries = get_page(
+            entries, page, pagesize, nitems,
+            after=get_param(request, 'after', None),
+            before=get_param(request, 'before', None),
+        )
+    else:
+        entries = []
 
     pn_start, pn_end = page - 2, page + 2
     if pn_start < 1:
@@ -205,6 +216,12 @@ def period(request, period_id=None):
         'nperiods':   Period.objects.filter(computed=True).count(),
         'pn_range':   range(pn_start, pn_end+1),
     })
+
+    if entries:
+        base.update({
+            'first_id': entries[0].id,
+            'last_id':  entries[-1].id,
+        })
     # }}}
 
     base.update({
@@ -223,18 +240,19 @@ def earnings(request):
     base = base_ctx('Ranking', 'Earnings', request)
 
     # {{{ Build country and currency list
-    all_players = Player.objects.filter(earnings__player__isnull=False).distinct()
+    all_players = Player.objects.filter(id__in=EarningsSummary.objects.values('player_id'))
     base['countries'] = country_list(all_players)
-    base['currencies'] = currency_list(Earnings.objects)
+    base['currencies'] = currency_list(EarningsSummary.objects)
     # }}}
 
     # {{{ Initial filtering of earnings
-    preranking = Earnings.objects.filter(earnings__isnull=False)
+    # Totals per player, year and currency are kept in EarningsSummary, so this sums a few rows per player
+    preranking = EarningsSummary.objects.all()
 
     # Filtering by year
     year = get_param(request, 'year', 'all')
     if year != 'all':
-        preranking = preranking.filter(event__latest__year=int(year))
+        preranking = preranking.filter(year=int(year))
 
     # Country filter
     nats = get_param(request, 'country', 'all')
@@ -258,17 +276,19 @@ def earnings(request):
     )
     # }}}
 
-    # {{{ Calculate total earnings
-    base.update({
-        'totalorigprizepool': preranking.aggregate(Sum('origearnings'))['origearnings__sum'],
-        'totalprizepool':     preranking.aggregate(Sum('earnings'))['earnings__sum'],
-    })
+    # {{{ Calculate total earnings and number of players
+    totals = preranking.aggregate(
+        totalorigprizepool=Sum('origearnings'),
+        totalprizepool=Sum('earnings'),
+        nitems=Count('player_id', distinct=True),
+    )
+    nitems = totals.pop('nitems')
+    base.update(totals)
     # }}}
 
     # {{{ Pages, etc.
     pagesize = SHOW_PER_LIST_PAGE
     page = int(get_param(request, 'page', 1))
-    nitems = ranking.count()
     npages = nitems//pagesize + (1 if nitems % pagesize > 0 else 0)
     page = min(max(page, 1), npages)
 
@@ -295,12 +315,12 @@ def earnings(request):
         base['empty'] = True
     # }}}
 
-    # {{{ Populate with player and team objects
-    ids = [p['player'] for p in ranking]
-    players = Player.objects.in_bulk(ids)
+    # {{{ Populate with player objects and their teams
+    ranking = list(ranking)
+    players = Player.objects.in_bulk([p['player'] for p in ranking])
+    populate_teams(players.values(), player_set=True)
     for p in ranking:
         p['playerobj'] = players[p['player']]
-        p['teamobj'] = p['playerobj'].get_current_team()
 
     base['ranking'] = ranking
     # }}}
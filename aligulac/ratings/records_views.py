@@ -17,15 +17,13 @@ from aligulac.tools import (
 from aligulac.cache import cache_page
 
 from ratings.models import (
+    PeakRating,
     Player,
-    Rating,
     RACES,
 )
 from ratings.tools import (
     PATCHES,
-    filter_active,
     country_list,
-    total_ratings,
 )
 
 from countries import data
@@ -36,26 +34,23 @@ from countries import data
 def history(request):
     base = base_ctx('Records', 'History', request)
 
-    # {{{ Filtering (appears faster with custom SQL)
+    # {{{ Filtering (on the peaks computed by the update)
     nplayers = int(get_param(request, 'nplayers', '5'))
     race = get_param_choice(request, 'race', ['ptzrs','p','t','z','ptrs','tzrs','pzrs'], 'ptzrs')
     nats = get_param_choice(request, 'nats', ['all','foreigners'] + list(data.ccn_to_cca2.values()), 'all')
 
-    query = '''SELECT player.id, player.tag, player.race, player.country, MAX(rating.rating) AS high
-               FROM player JOIN rating ON player.id=rating.player_id'''
-    if race != 'ptzrs' or nats != 'all':
-        query += ' WHERE '
-        ands = []
-        if race != 'ptzrs':
-            ands.append('(' + ' OR '.join(["player.race='%s'" % r.upper() for r in race]) + ')')
-        if nats == 'foreigners':
-            ands.append("(player.country!='KR')")
-        elif nats != 'all':
-            ands.append("(player.country='%s')" % nats)
-        query += ' AND '.join(ands)
-    query += ' GROUP BY player.id, player.tag, player.race, player.country ORDER BY high DESC LIMIT %i' % nplayers
-
-    players = Player.objects.raw(query)
+    peaks = PeakRating.objects.all()
+    if race != 'ptzrs':
+        q = Q()
+        for r in race:
+            q |= Q(player__race=r.upper())
+        peaks = peaks.filter(q)
+    if nats == 'foreigners':
+        peaks = peaks.exclude(player__country='KR')
+    elif nats != 'all':
+        peaks = peaks.filter(player__country=nats)
+
+    players = [p.rating.player for p in PeakRating.top('rating', False, peaks)[:nplayers]]
     # }}}
 
     base.update({
@@ -99,29 +94,18 @@ def race(request):
 
     base = base_ctx('Records', sub, request)
 
-    def sift(lst, num=5):
-        ret, pls = [], set()
-        for r in lst:
-            if not r.player_id in pls:
-                pls.add(r.player_id)
-                ret.append(r)
-            if len(ret) == num:
-                return ret
-        return ret
-
-    high = (
-        filter_active(total_ratings(Rating.objects.all()))
-            .filter(period__id__gt=16).select_related('player', 'period')
-    )
-    
+    peaks = PeakRating.objects.all()
     if race != 'all':
-        high = high.filter(player__race=race)
+        peaks = peaks.filter(player__race=race)
+
+    def high(kind):
+        return [p.rating for p in PeakRating.top(kind, True, peaks)[:5]]
 
     base.update({
-        'hightot': sift(high.order_by('-rating')[:200]),
-        'highp':   sift(high.order_by('-tot_vp')[:200]),
-        'hight':   sift(high.order_by('-tot_vt')[:200]),
-        'highz':   sift(high.order_by('-tot_vz')[:200]),
+        'hightot': high('rating'),
+        'highp':   high('tot_vp'),
+        'hight':   high('tot_vt'),
+        'highz':   high('tot_vz'),
         'race':    race if race != 'all' else '',
     })
 
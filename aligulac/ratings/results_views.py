@@ -11,6 +11,7 @@ import shlex
 import ccy
 
 from django import forms
+from django.core.exceptions import ValidationError
 from django.db.models import (
     Count,
     Min,
@@ -45,6 +46,7 @@ from aligulac.tools import (
 
 from currency import RateNotFoundError
 
+from ratings.event_tree import refresh_subtree
 from ratings.models import (
     CAT_FREQUENT,
     CAT_INDIVIDUAL,
@@ -158,13 +160,15 @@ class EventModForm(forms.Form):
             return ret
 
         if self.cleaned_data['name'] != event.name:
-            event.update_name(self.cleaned_data['name'])
-            for e in event.get_children(id=False):
-                e.update_name()
+            event.name = self.cleaned_data['name']
+            event.save()
+            refresh_subtree(event)
+            event.refresh_from_db()
             ret.append(Message(_('Changed event name.'), type=Message.SUCCESS))
 
         if self.cleaned_data['date'] is not None:
             nchanged = event.get_matchset().update(date=self.cleaned_data['date'])
+            Event.refresh_dates(event.get_children(id=True).values_list('id', flat=True))
             ret.append(Message(
                 ungettext_lazy('Changed date for %i match.', 'Changed date for %i matches.', nchanged)
                 % nchanged, type=Message.SUCCESS
@@ -886,26 +890,29 @@ class ResultsModForm(forms.Form):
                     ret.append(Message(error=error, field=self.fields[field].label))
             return ret
 
-        matches = Match.objects.filter(id__in=ids)
-
-        if self.cleaned_data['event'] != 0:
+        changes = {}
+        if int(self.cleaned_data['event']) != 0:
             try:
-                event = Event.objects.get(id=self.cleaned_data['event'])
-                matches.update(eventobj=event)
-            except:
+                changes['eventobj'] = Event.objects.get(id=int(self.cleaned_data['event']))
+            except Event.DoesNotExist:
                 pass
 
         if self.cleaned_data['date'] != None:
-            matches.update(date=self.cleaned_data['date'])
+            changes['date'] = self.cleaned_data['date']
 
         if self.cleaned_data['offline'] != 'nochange':
-            matches.update(offline=(self.cleaned_data['offline']=='offline'))
+            changes['offline'] = (self.cleaned_data['offline']=='offline')
 
         if self.cleaned_data['game'] != 'nochange':
-            matches.update(game=self.cleaned_data['game'])
+            changes['game'] = self.cleaned_data['game']
+
+        try:
+            nmatches = Match.bulk_modify(Match.objects.filter(id__in=ids), **changes)
+        except ValidationError as e:
+            return [Message(e.messages[0], type=Message.ERROR)]
 
         return [Message(
-            ungettext_lazy('Updated %i match.', 'Updated %i matches.', matches.count()) % matches.count(), 
+            ungettext_lazy('Updated %i match.', 'Updated %i matches.', nmatches) % nmatches,
             type=Message.SUCCESS
         )]
     # }}}
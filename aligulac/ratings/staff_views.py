@@ -38,17 +38,21 @@ from aligulac.tools import (
     StrippedCharField,
 )
 
+from ratings.event_tree import refresh_subtree
 from ratings.models import (
     CAT_TEAM,
     Earnings,
+    EarningsSummary,
     Event,
     EventAdjacency,
     EVENT_TYPES,
     GAMES,
     GroupMembership,
+    HeadToHead,
     HOTS,
     LOTV,
     Match,
+    Period,
     Player,
     PreMatch,
     PreMatchGroup,
@@ -62,6 +66,7 @@ from ratings.tools import (
     country_list,
     display_matches,
     find_player,
+    find_players,
     parse_match
 )
 
@@ -372,38 +377,48 @@ class AddMatchesForm(forms.Form):
             )
             self.prematchgroup.save()
 
-        error_lines, matches = [], []
+        # {{{ Parse all lines first, so that players, duplicates, periods and ratings can be looked up in bulk
+        parsed = []
         for line in self.cleaned_data['matches'].splitlines():
             if line.strip() == '':
                 continue
 
             try:
                 parse_results = parse_match(line.strip(), allow_archon=False)
-                pla_query = parse_results['pla']
-                plb_query = parse_results['plb']
-                sca = parse_results['sca']
-                scb = parse_results['scb']
-
-                make_flag = 'MAKE' in parse_results['flags']
-                dup_flag = 'DUP' in parse_results['flags']
             except pyparsing.ParseException as e:
+                parsed.append((line, None, e))
+                continue
+
+            parse_results['pla_race_override'] = find_race_override(parse_results['pla'])
+            parse_results['plb_race_override'] = find_race_override(parse_results['plb'])
+            parsed.append((line, parse_results, None))
+
+        queries = [q for _, r, _ in parsed if r is not None for q in [r['pla'], r['plb']]]
+        resolved = find_players(queries)
+        self.prepare_lookups(queries, resolved)
+        resolved = iter(resolved)
+        # }}}
+
+        error_lines, matches = [], []
+        for line, parse_results, error in parsed:
+            if error is not None:
                 self.messages.append(Message(
-                    _("Could not parse '%(line)s' (%(error)s).") % {'line': line, 'error': str(e)},
+                    _("Could not parse '%(line)s' (%(error)s).") % {'line': line, 'error': str(error)},
                     type=Message.ERROR
                 ))
                 self.close_after = False
                 error_lines.append(line)
                 continue
 
-            pla_race_override = find_race_override(pla_query)
-            plb_race_override = find_race_override(plb_query)
+            pla_players, plb_players = next(resolved), next(resolved)
 
             try:
                 match = self.make_match(
-                    pla_query, plb_query,
-                    pla_race_override, plb_race_override,
-                    sca, scb,
-                    make_flag, dup_flag,
+                    parse_results['pla'], parse_results['plb'],
+                    parse_results['pla_race_override'], parse_results['plb_race_override'],
+                    parse_results['sca'], parse_results['scb'],
+                    'MAKE' in parse_results['flags'], 'DUP' in parse_results['flags'],
+                    pla_players, plb_players,
                 )
                 if match is None:
                     error_lines.append(line)
@@ -421,8 +436,11 @@ class AddMatchesForm(forms.Form):
                 match.submitter = submitter
             matches.append(match)
 
-        for m in matches:
-            m.save()
+        if self.is_adm:
+            Match.bulk_add(matches)
+        else:
+            for m in matches:
+                m.save()
         if len(matches) > 0:
             self.messages.append(Message(
                 ungettext_lazy(
@@ -445,28 +463,55 @@ class AddMatchesForm(forms.Form):
 
         return matches
 
-    # Auxiliary function for searching for players
-    def get_player(self, query, make_flag):
-        players = find_player(lst=query, make=make_flag, soft=False)
+    # Auxiliary function for looking up the possible duplicates, the period and the previous ratings of all
+    # the matches at once (called from parse_matches, with all player queries and the players found for them).
+    def prepare_lookups(self, queries, resolved):
+        self.duplicates, self.period, self.ratings, self.lookup_ids = set(), None, {}, set()
+        if not self.is_adm:
+            return
+
+        ids = {i for lst in queries for i in lst if type(i) is int}
+        ids |= {p.id for players in resolved if players for p in players}
+        self.lookup_ids = ids
+
+        match_date, day = self.cleaned_data['date'], timedelta(days=1)
+        for pla, plb, sca, scb in Match.objects.filter(
+            date__gte=(match_date - day), date__lte=(match_date + day), pla_id__in=ids, plb_id__in=ids
+        ).values_list('pla_id', 'plb_id', 'sca', 'scb'):
+            self.duplicates |= {(pla, plb, sca, scb), (plb, pla, scb, sca)}
+
+        self.period = Period.objects.filter(start__lte=match_date, end__gte=match_date).first()
+        if self.period is not None:
+            self.ratings = {
+                r.player_id: r for r in Rating.objects.filter(period_id=self.period.id-1, player_id__in=ids)
+            }
+
+    # Auxiliary function for searching for players. If the players have already been found (by find_players),
+    # they're only looked up again if none were found: new players may be made, or may have been made by an
+    # earlier line.
+    def get_player(self, query, make_flag, players=None):
+        if not players:
+            players = list(find_player(lst=query, make=make_flag, soft=False))
         printable = ' '.join(str(x) for x in query)
-        if players.count() != 1:
+        if len(players) != 1:
             if self.is_adm:
-                if players.count() == 0:
+                if len(players) == 0:
                     self.messages.append(
                         Message(_("Could not find player: '%s'.") % printable, type=Message.ERROR))
                     self.close_after = False
-                elif players.count() > 1:
+                elif len(players) > 1:
                     self.messages.append(
                         Message(_("Ambiguous player: '%s'.") % printable, type=Message.ERROR))
                     self.close_after = False
             return None
 
-        return players.first()
+        return players[0]
 
     # Make matches (called from parse_matches). DOES NOT SAVE THEM.
-    def make_match(self, pla_query, plb_query, pla_race_or, plb_race_or, sca, scb, make_flag, dup_flag):
-        pla = self.get_player(pla_query, make_flag)
-        plb = self.get_player(plb_query, make_flag)
+    def make_match(self, pla_query, plb_query, pla_race_or, plb_race_or, sca, scb, make_flag, dup_flag,
+                   pla_players=None, plb_players=None):
+        pla = self.get_player(pla_query, make_flag, pla_players)
+        plb = self.get_player(plb_query, make_flag, plb_players)
 
         if (pla is None or plb is None) and self.is_adm:
             return None
@@ -499,7 +544,13 @@ class AddMatchesForm(forms.Form):
                 game     = self.cleaned_data['game'],
                 offline  = self.cleaned_data['offline'],
             )
-            if check_duplicates(match, dup_flag):
+            # Players that weren't known before (made, or found by find_player) are checked the slow way
+            looked_up = pla.id in self.lookup_ids and plb.id in self.lookup_ids
+            if looked_up:
+                duplicate = not dup_flag and (pla.id, plb.id, sca, scb) in self.duplicates
+            else:
+                duplicate = check_duplicates(match, dup_flag)
+            if duplicate:
                 self.messages.append(Message(
                     _("Could not make match %(pla)s vs %(plb)s: possible duplicate found.") 
                         % {'pla': pla.tag, 'plb': plb.tag},
@@ -513,8 +564,23 @@ class AddMatchesForm(forms.Form):
                         % {'pla': pla.tag, 'plb': plb.tag},
                     type=Message.WARNING,
                 ))
-            match.set_period()
-            match.set_ratings()
+            if self.period is None:
+                match.set_period()
+            else:
+                match.period = self.period
+            if looked_up:
+                match.rta = self.ratings.get(pla.id)
+                match.rtb = self.ratings.get(plb.id)
+            else:
+                match.set_ratings()
+
+            # The checks Match.bulk_add makes, so that a bad line is reported here and not in the whole batch
+            try:
+                Match.bulk_validate([match])
+            except ValidationError as e:
+                self.messages.append(Message(e.messages[0], type=Message.ERROR))
+                self.close_after = False
+                return None
             return match
 
 # Form for adding events.
@@ -679,10 +745,17 @@ class MergePlayersForm(forms.Form):
 
         source, target = self.cleaned_data['source'], self.cleaned_data['target']
 
+        opponents = set(HeadToHead.objects.filter(player=source).values_list('opponent_id', flat=True))
         Match.objects.filter(pla=source).update(pla=target, treated=False)
         Match.objects.filter(plb=source).update(plb=target, treated=False)
         Match.objects.filter(rta__player=source).update(rta=None)
         Match.objects.filter(rtb__player=source).update(rtb=None)
+        Match.bulk_bookkeeping(
+            players=[source.id, target.id],
+            pairs={(target.id, o) for o in opponents},
+            periods=[],
+            events=[],
+        )
 
         try:
             recompute = Rating.objects.filter(player=source).earliest('period').period
@@ -694,6 +767,7 @@ class MergePlayersForm(forms.Form):
         Rating.objects.filter(player=source).delete()
         GroupMembership.objects.filter(player=source).delete()
         Earnings.objects.filter(player=source).update(player=target)
+        EarningsSummary.refresh({source.id, target.id})
 
         ret.append(Message(
             _('%(source)s was successfully merged into %(target)s.') % {
@@ -762,30 +836,14 @@ class MoveEventForm(forms.Form):
 
         subject, target = self.cleaned_data['subject'], self.cleaned_data['target']
 
-        downlinks = EventAdjacency.objects.filter(parent=subject).select_related('child')
-        child_ids = [dl.child_id for dl in downlinks]
-        EventAdjacency.objects.filter(child_id__in=child_ids).exclude(parent_id__in=child_ids).delete()
-
-        links = []
-        for ul in EventAdjacency.objects.filter(child=target):
-            for dl in downlinks:
-                links.append(EventAdjacency(
-                    parent_id = ul.parent_id,
-                    child_id  = dl.child_id,
-                    distance  = ul.distance + dl.distance + 1,
-                ))
-        EventAdjacency.objects.bulk_create(links)
+        prevname = subject.fullname
+        prevparent = subject.parent_id
 
         subject.parent = target
         subject.save()
-
-        prevname = subject.fullname
-
-        for dl in downlinks:
-            if dl.child_id == subject.id:
-                subject.update_name()  # select_related causes the parent to be overwritten otherwise
-            else:
-                dl.child.update_name()
+        refresh_subtree(subject)
+        Event.refresh_dates([subject.id, prevparent])
+        subject.refresh_from_db()
 
         ret.append(Message(
             "Moved '%(source)s' to '%(target)s'. It's now called '%(name)s'." % {
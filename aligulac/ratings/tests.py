@@ -0,0 +1,74 @@
+# {{{ Imports
+from datetime import date
+from decimal import Decimal
+import os
+
+from django.test import SimpleTestCase
+
+from currency import (
+    ExchangeRates,
+    FixtureSource,
+    RateNotFoundError,
+    RateStore,
+)
+# }}}
+
+# Three days of rates, with SEK missing on the middle day
+FIXTURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'currency_fixture.json')
+
+# {{{ The conversion and interpolation formulas of the original ExchangeRates, per openexchangerates.org day
+def old_convert(amount, rates, currencyfrom, currencyto='USD'):
+    usd = amount * Decimal(rates[currencyto])
+    return usd / Decimal(rates[currencyfrom])
+
+def old_interpolate(rate_before, nbefore, rate_after, nafter):
+    coeff = (rate_after - rate_before) / (nafter + nbefore)
+    return rate_before + coeff * nbefore
+# }}}
+
+# {{{ RateStore against the fixture source
+class RateStoreTestCase(SimpleTestCase):
+    def setUp(self):
+        self.source = FixtureSource(FIXTURE)
+        self.store = RateStore(source=self.source)
+
+    def test_convert(self):
+        day = date(2014, 1, 2)
+        for currency in ['EUR', 'KRW']:
+            self.assertEqual(
+                self.store.convert(day, Decimal('1000'), currency),
+                old_convert(Decimal('1000'), self.source(day), currency),
+            )
+        self.assertEqual(self.store.convert(day, Decimal('1000'), 'USD'), Decimal('1000'))
+
+    def test_convert_between_currencies(self):
+        day = date(2014, 1, 1)
+        self.assertEqual(
+            self.store.convert(day, Decimal('50000'), 'krw', 'eur'),
+            old_convert(Decimal('50000'), self.source(day), 'KRW', 'EUR'),
+        )
+
+    def test_interpolate(self):
+        day = date(2014, 1, 2)
+        expected = old_interpolate(
+            self.source(date(2014, 1, 1))['SEK'], 1, self.source(date(2014, 1, 3))['SEK'], 1
+        )
+        self.assertEqual(self.store.rates(day, ['SEK', 'EUR']), {'SEK': expected, 'EUR': 0.7318})
+
+        rates = dict(self.source(day), SEK=expected)
+        self.assertEqual(
+            self.store.convert(day, Decimal('1000'), 'SEK'),
+            old_convert(Decimal('1000'), rates, 'SEK'),
+        )
+
+    def test_missing_rate(self):
+        with self.assertRaises(RateNotFoundError):
+            self.store.rates(date(2014, 1, 2), ['XYZ'])
+
+    def test_exchangerates(self):
+        day = date(2014, 1, 2)
+        self.assertEqual(
+            ExchangeRates(day, self.store).convert(Decimal('1000'), 'SEK'),
+            self.store.convert(day, Decimal('1000'), 'SEK'),
+        )
+# }}}
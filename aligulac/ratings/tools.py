@@ -5,13 +5,17 @@ from numpy import (
     pi,
 )
 from math import sqrt
+import csv
 from datetime import date
 from decimal import Decimal
+from io import StringIO
 import shlex
 
+from django.db import connection
 from django.db.models import (
     Sum,
-    Q
+    Q,
+    prefetch_related_objects,
 )
 from django.db.models.query import QuerySet
 from django.utils.translation import ugettext_lazy as _
@@ -131,6 +135,19 @@ CURRENCIES = {
 }
 # }}}
 
+# {{{ token_countries: Returns the country codes a search term can refer to (as a code or a name).
+def token_countries(s):
+    countries = []
+    if len(s) == 2 and s.upper() in data.cca2_to_ccn:
+        countries.append(s.upper())
+    if len(s) == 3 and s.upper() in data.cca3_to_ccn:
+        countries.append(ccn_to_cca2(cca3_to_ccn(s.upper())))
+    renorm = s[0].upper() + s[1:].lower()
+    if renorm in data.cn_to_ccn:
+        countries.append(ccn_to_cca2(cn_to_ccn(renorm)))
+    return countries
+# }}}
+
 # {{{ find_player: Magic!
 def find_player(query=None, lst=None, make=False, soft=False, strict=False):
     queryset = Player.objects.all()
@@ -196,24 +213,13 @@ def find_player(query=None, lst=None, make=False, soft=False, strict=False):
             q |= Q(**group_name_filter) | Q(**group_alias_filter)
 
             # ...and perhaps country codes
-            found_country = False
-            if len(s) == 2 and s.upper() in data.cca2_to_ccn:
-                country = s.upper()
-                found_country = True
-                q |= Q(country=s.upper())
-
-            if len(s) == 3 and s.upper() in data.cca3_to_ccn:
-                country = ccn_to_cca2(cca3_to_ccn(s.upper()))
-                found_country = True
-                q |= Q(country=ccn_to_cca2(cca3_to_ccn(s.upper())))
-
-            renorm = s[0].upper() + s[1:].lower()
-            if renorm in data.cn_to_ccn:
-                country = ccn_to_cca2(cn_to_ccn(renorm))
-                found_country = True
-                q |= Q(country=ccn_to_cca2(cn_to_ccn(renorm)))
-
-            if not found_country:
+            countries = token_countries(s)
+            for c in countries:
+                q |= Q(country=c)
+
+            if countries:
+                country = countries[-1]
+            else:
                 tag = s
 
         queryset = queryset.filter(q)
@@ -240,6 +246,76 @@ def find_player(query=None, lst=None, make=False, soft=False, strict=False):
     return queryset.distinct()
 # }}}
 
+# {{{ find_players: Resolves many queries at once, like find_player(lst=lst, soft=False) for each lst in lsts,
+# but with two queries in total. Returns a list with a list of players for each query, or None for queries that
+# can't be resolved this way (those consisting only of races and countries) and should go to find_player.
+NAME_MAP_QUERY = """
+SELECT UPPER(tag), id FROM player WHERE UPPER(tag) = ANY(%(names)s)
+UNION
+SELECT UPPER(name), id FROM player WHERE UPPER(name) = ANY(%(names)s)
+UNION
+SELECT UPPER(romanized_name), id FROM player WHERE UPPER(romanized_name) = ANY(%(names)s)
+UNION
+SELECT UPPER(name), player_id FROM alias WHERE player_id IS NOT NULL AND UPPER(name) = ANY(%(names)s)
+UNION
+SELECT UPPER(g.name), m.player_id FROM groupmembership m JOIN "group" g ON g.id = m.group_id
+WHERE m.current AND g.is_team AND UPPER(g.name) = ANY(%(names)s)
+UNION
+SELECT UPPER(a.name), m.player_id FROM groupmembership m JOIN "group" g ON g.id = m.group_id
+JOIN alias a ON a.group_id = g.id
+WHERE m.current AND g.is_team AND UPPER(a.name) = ANY(%(names)s)
+"""
+
+def find_players(lsts):
+    def is_id(s):
+        return type(s) is int or s.isdigit()
+
+    def is_race(s):
+        return len(s) == 1 and s.upper() in 'PTZSR'
+
+    # {{{ Map every name in the queries to the players it can refer to
+    names = {s.upper() for lst in lsts for s in lst if not is_id(s) and not is_race(s)}
+    name_map = {}
+    if names:
+        cur = connection.cursor()
+        cur.execute(NAME_MAP_QUERY, {'names': list(names)})
+        for name, player_id in cur.fetchall():
+            name_map.setdefault(name, set()).add(player_id)
+    # }}}
+
+    # {{{ Candidates for each query: players matched by a term that isn't a race or a country
+    candidates = []
+    for lst in lsts:
+        sets = [
+            {int(s)} if is_id(s) else name_map.get(s.upper(), set())
+            for s in lst if is_id(s) or (not is_race(s) and not token_countries(s))
+        ]
+        candidates.append(set.intersection(*sets) if sets else None)
+
+    players = Player.objects.in_bulk(set().union(*[c for c in candidates if c is not None]))
+    # }}}
+
+    # {{{ Check every term against the candidates
+    def matches(p, s):
+        if is_id(s):
+            return p.id == int(s)
+        if is_race(s):
+            return p.race == s.upper()
+        return p.id in name_map.get(s.upper(), ()) or p.country in token_countries(s)
+
+    ret = []
+    for lst, cands in zip(lsts, candidates):
+        if cands is None:
+            ret.append(None)
+            continue
+        ret.append([
+            players[i] for i in sorted(cands)
+            if i in players and all(matches(players[i], s) for s in lst)
+        ])
+    return ret
+    # }}}
+# }}}
+
 # Submit match parser
 # Format is:
 #   player-player score-score flags
@@ -329,6 +405,18 @@ def parse_match(line, allow_archon=False):
 
     return result_dict
 
+# {{{ copy_rows(cur, table, rows, not_null=()): Loads rows into a table (e.g. 'temp (id, value)') with COPY
+# None is loaded as NULL, and so is the empty string, except in the columns listed in not_null.
+def copy_rows(cur, table, rows, not_null=()):
+    buf = StringIO()
+    csv.writer(buf).writerows(rows)
+    buf.seek(0)
+    options = 'FORMAT csv'
+    if not_null:
+        options += ', FORCE_NOT_NULL (%s)' % ', '.join(not_null)
+    cur.cursor.copy_expert('COPY %s FROM STDIN WITH (%s)' % (table, options), buf)
+# }}}
+
 # {{{ cdf: Cumulative distribution function
 def cdf(x, loc=0.0, scale=1.0):
     return 0.5 + 0.5 * tanh(pi/2/sqrt(3) * (x-loc)/scale)
@@ -377,19 +465,20 @@ def total_ratings(queryset):
     })
 # }}}
 
-# {{{ populate_teams: Adds team information to rows in a queryset (ratings or players) by populating the
-# members team (short name), teamfull (full name) and teamid (team ID).
+# {{{ populate_teams: Adds team information to rows in a queryset or list (ratings or players) by populating
+# the members team (short name), teamfull (full name) and teamid (team ID).
 def populate_teams(queryset, player_set=False):
     if player_set:
-        q = queryset.prefetch_related(
-            'groupmembership_set',
-            'groupmembership_set__group'
-        )
+        lookups = ['groupmembership_set', 'groupmembership_set__group']
     else:
-        q = queryset.prefetch_related(
-            'player__groupmembership_set',
-            'player__groupmembership_set__group'
-        )
+        lookups = ['player__groupmembership_set', 'player__groupmembership_set__group']
+
+    if isinstance(queryset, QuerySet):
+        q = queryset.prefetch_related(*lookups)
+    else:
+        q = list(queryset)
+        prefetch_related_objects(q, *lookups)
+
     for e in q:
         if isinstance(e, Player):
             player = e
@@ -408,7 +497,10 @@ def populate_teams(queryset, player_set=False):
 # {{{ country_list: Creates a list of countries in the given queryset (of Players).
 def country_list(queryset):
     countries = queryset.values('country').distinct()
-    country_codes = {c['country'] for c in countries if c['country'] is not None}
+    return country_code_list({c['country'] for c in countries if c['country'] is not None})
+
+# Same as country_list, given a set of country codes.
+def country_code_list(country_codes):
     country_dict = [{'cc': c, 'name': _(data.ccn_to_cn[data.cca2_to_ccn[c]])} for c in country_codes]
     country_dict.sort(key=lambda a: a['name'])
     return country_dict
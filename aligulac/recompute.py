@@ -11,14 +11,16 @@ import itertools
 import sys
 import subprocess
 
-from django.core.cache import cache
 from django.db import connection
 from django.db.models import F, Q
 from django.db.transaction import atomic
 
+from aligulac.cache import bump_generation
 from aligulac.settings import PROJECT_PATH
 
-from ratings.models import Match, Period, Player
+from ratings.clocks import update_clocks
+from ratings.graph import update_mcnums
+from ratings.models import EarningsSummary, Event, HeadToHead, Match, PeakRating, Period, PlayerStats
 
 print('[%s] Checking for Match <-> Period artifacts... ' % (str(datetime.now())), end="")
 
@@ -119,40 +121,46 @@ if 'debug' not in sys.argv:
     subprocess.call([os.path.join(PROJECT_PATH, 'teamranks.py'), 'ak'])
     subprocess.call([os.path.join(PROJECT_PATH, 'teamranks.py'), 'pl'])
     subprocess.call([os.path.join(PROJECT_PATH, 'teamratings.py')])
-    subprocess.call([os.path.join(PROJECT_PATH, 'reports.py')])
+    subprocess.call([os.path.join(PROJECT_PATH, 'reports.py'), str(earliest.id)])
 
     print('[%s] Updating MC numbers' % str(datetime.now()), flush=True)
-    Player.objects.exclude(id=36).update(mcnum=None)
-    Player.objects.filter(id=36).update(mcnum=0)
-    g = 0
-    while True:
-        upd = Player.objects.filter(
-            match_pla__offline=True,
-            match_pla__plb__mcnum=g,
-            mcnum__isnull=True
-        ).distinct().update(mcnum=g+1)
-        upd += Player.objects.filter(
-            match_plb__offline=True,
-            match_plb__pla__mcnum=g,
-            mcnum__isnull=True
-        ).distinct().update(mcnum=g+1)
-        if upd == 0:
-            break
-        g += 1
+    nchanged = update_mcnums()
+    print('[%s] Updated %i MC numbers' % (str(datetime.now()), nchanged), flush=True)
 
     print('[%s] Refreshing miscellaneous data' % str(datetime.now()), flush=True)
+    # Event dates are kept up to date by Match.save and Match.delete, the flagged events are those changed in
+    # other ways. With 'all', every event is recomputed as a check.
+    ndirty = Event.refresh_dirty_dates()
+    print('[%s] Refreshed dates of %i flagged events' % (str(datetime.now()), ndirty), flush=True)
+    if 'all' in sys.argv:
+        nwrong = Event.rebuild_dates()
+        print('[%s] Rebuilt event dates, %i were wrong' % (str(datetime.now()), nwrong), flush=True)
+
     cur = connection.cursor()
-    cur.execute('UPDATE event SET earliest = (SELECT MIN(date) FROM match JOIN eventadjacency '
-                'ON match.eventobj_id=eventadjacency.child_id WHERE eventadjacency.parent_id=event.id)')
-    cur.execute('UPDATE event SET latest   = (SELECT MAX(date) FROM match JOIN eventadjacency '
-                'ON match.eventobj_id=eventadjacency.child_id WHERE eventadjacency.parent_id=event.id)')
     cur.execute('UPDATE player SET current_rating_id = (SELECT rating.id FROM rating '
                 'WHERE rating.period_id=%i AND rating.player_id=player.id)' % latest.id)
 
     os.system(PROJECT_PATH + 'event_sort.py')
 
+    print('[%s] Rebuilding player statistics and head-to-head records' % str(datetime.now()), flush=True)
+    PlayerStats.rebuild()
+    HeadToHead.rebuild()
+
+    print('[%s] Rebuilding peak ratings' % str(datetime.now()), flush=True)
+    PeakRating.rebuild()
+
+    # Event years change as matches are added
+    print('[%s] Rebuilding earnings summary' % str(datetime.now()), flush=True)
+    EarningsSummary.rebuild()
+
+    print('[%s] Updating clocks' % str(datetime.now()), flush=True)
+    update_clocks(full='all' in sys.argv)
+
 print('[%s] Finished' % str(datetime.now()), flush=True)
 
 subprocess.call(['touch', os.path.join(PROJECT_PATH, 'update')])
 
-cache.clear()
+bump_generation()
+
+if 'debug' not in sys.argv:
+    subprocess.call([os.path.join(PROJECT_PATH, 'warm_cache.py')])
@@ -9,110 +9,120 @@ django.setup()
 
 from datetime import date, datetime
 from dateutil.relativedelta import relativedelta
+import sys
 
 from django.db import connection
-from django.db.models import Sum
-from django.shortcuts import render_to_response
-
-from aligulac.cache import cache_page
-from aligulac.tools import (
-    base_ctx,
-    ntz,
-)
 
 from ratings.models import (
     BalanceEntry,
-    Match,
-)
-from ratings.tools import (
-    count_matchup_games,
-    icdf,
-    ntz,
-    PATCHES,
+    Period,
 )
+from ratings.tools import icdf
 # }}}
 
 def info(string):
     print("[{}] {}".format(datetime.now(), string))
 
 # {{{ Balance reports
-def balance():
+# Scores and rating sums (general rating plus the rating vs. the opponent's race) per month and matchup, for all
+# non-mirror matches between the three races.
+BALANCE_QUERY = """
+SELECT DATE_TRUNC('month', m.date)::date AS month, m.rca, m.rcb,
+       COALESCE(SUM(m.sca), 0), COALESCE(SUM(m.scb), 0),
+       COALESCE(SUM(ra.rating), 0) + COALESCE(SUM(CASE m.rcb
+           WHEN 'P' THEN ra.rating_vp WHEN 'T' THEN ra.rating_vt WHEN 'Z' THEN ra.rating_vz END), 0),
+       COALESCE(SUM(rb.rating), 0) + COALESCE(SUM(CASE m.rca
+           WHEN 'P' THEN rb.rating_vp WHEN 'T' THEN rb.rating_vt WHEN 'Z' THEN rb.rating_vz END), 0)
+FROM match m
+LEFT JOIN rating ra ON ra.id = m.rta_id
+LEFT JOIN rating rb ON rb.id = m.rtb_id
+WHERE m.date >= %(first)s AND m.date < %(end)s
+  AND m.rca IN ('P', 'T', 'Z') AND m.rcb IN ('P', 'T', 'Z') AND m.rca <> m.rcb
+GROUP BY 1, 2, 3
+"""
+
+# Only the months from the given date onwards are recomputed. Ratings of recomputed periods only affect matches
+# played later, so recompute.py passes the first recomputed period. Months that have no entry yet are always
+# computed.
+def balance(since=None):
     first = date(year=2010, month=7, day=1)
     last  = date.today().replace(day=1) - relativedelta(months=1)
 
+    existing = {be.date: be for be in BalanceEntry.objects.all()}
+    if since is not None:
+        missing = first
+        while missing.replace(day=15) in existing:
+            missing = missing + relativedelta(months=1)
+        first = max(first, min(since.replace(day=1), missing))
+
+    if first > last:
+        return 0
+
     # {{{ Auxiliary functions for updating
-    def get_data_perf_single(matches, rca, rcb):
-        res = (
-            matches.filter(rca=rca, rcb=rcb)
-                .aggregate(
-                    rta_sum      = Sum('rta__rating'),
-                    rta_spec_sum = Sum('rta__rating_v%s' % rcb.lower()),
-                    rtb_sum      = Sum('rtb__rating'),
-                    rtb_spec_sum = Sum('rtb__rating_v%s' % rca.lower()),
-                    sca_sum      = Sum('sca'),
-                    scb_sum      = Sum('scb'),
-                )
-        )
-        return (
-            ntz(res['rta_sum']) + ntz(res['rta_spec_sum']),
-            ntz(res['rtb_sum']) + ntz(res['rtb_spec_sum']),
-            ntz(res['sca_sum']),
-            ntz(res['scb_sum']),
-        )
-
-    def get_data_perf(matches, race):
+    def get_data_perf(data, race):
         wa, wb, diff = 0, 0, 0.0
         for rcb in [r for r in 'PTZ' if r != race]:
-            rta1, rtb1, sca1, scb1 = get_data_perf_single(matches, race, rcb)
-            rtb2, rta2, scb2, sca2 = get_data_perf_single(matches, rcb, race)
+            sca1, scb1, rta1, rtb1 = data.get((race, rcb), (0, 0, 0.0, 0.0))
+            scb2, sca2, rtb2, rta2 = data.get((rcb, race), (0, 0, 0.0, 0.0))
             wa += sca1 + sca2
             wb += scb1 + scb2
             diff += rta1 + rta2 - rtb1 - rtb2
 
+        if wa + wb == 0:
+            return 0.0
         perfdiff = icdf(wa/(wa+wb), loc=0.0, scale=1.0)
         return perfdiff - diff/(wa+wb)
+
+    def count_matchup_games(data, rca, rcb):
+        sca1, scb1, _, _ = data.get((rca, rcb), (0, 0, 0.0, 0.0))
+        scb2, sca2, _, _ = data.get((rcb, rca), (0, 0, 0.0, 0.0))
+        return sca1 + sca2, scb1 + scb2
+    # }}}
+
+    # {{{ Fetch data
+    months = {}
+    cur = connection.cursor()
+    cur.execute(BALANCE_QUERY, {'first': first, 'end': last + relativedelta(months=1)})
+    for month, rca, rcb, sca, scb, rta, rtb in cur.fetchall():
+        months.setdefault(month, {})[(rca, rcb)] = (sca, scb, rta, rtb)
     # }}}
 
     # {{{ Update data
+    new, changed = [], []
     while first <= last:
-        matches = Match.objects.filter(date__gte=first, date__lt=(first+relativedelta(months=1)))
-        pvt_w, pvt_l = count_matchup_games(matches, 'P', 'T')
-        pvz_w, pvz_l = count_matchup_games(matches, 'P', 'Z')
-        tvz_w, tvz_l = count_matchup_games(matches, 'T', 'Z')
-        p_diff = get_data_perf(matches, 'P')
-        t_diff = get_data_perf(matches, 'T')
-        z_diff = get_data_perf(matches, 'Z')
-
-        be, created = BalanceEntry.objects.get_or_create(
-            date=first.replace(day=15),
-            defaults={
-                'pvt_wins':    pvt_w,
-                'pvt_losses':  pvt_l,
-                'pvz_wins':    pvz_w,
-                'pvz_losses':  pvz_l,
-                'tvz_wins':    tvz_w,
-                'tvz_losses':  tvz_l,
-                'p_gains':     p_diff,
-                't_gains':     t_diff,
-                'z_gains':     z_diff,
-            }
-        )
-        if not created:
-            be.pvt_wins   = pvt_w
-            be.pvt_losses = pvt_l
-            be.pvz_wins   = pvz_w
-            be.pvz_losses = pvz_l
-            be.tvz_wins   = tvz_w
-            be.tvz_losses = tvz_l
-            be.p_gains    = p_diff
-            be.t_gains    = t_diff
-            be.z_gains    = z_diff
-        be.save()
+        data = months.get(first, {})
+        pvt_w, pvt_l = count_matchup_games(data, 'P', 'T')
+        pvz_w, pvz_l = count_matchup_games(data, 'P', 'Z')
+        tvz_w, tvz_l = count_matchup_games(data, 'T', 'Z')
+        values = {
+            'pvt_wins':    pvt_w,
+            'pvt_losses':  pvt_l,
+            'pvz_wins':    pvz_w,
+            'pvz_losses':  pvz_l,
+            'tvz_wins':    tvz_w,
+            'tvz_losses':  tvz_l,
+            'p_gains':     get_data_perf(data, 'P'),
+            't_gains':     get_data_perf(data, 'T'),
+            'z_gains':     get_data_perf(data, 'Z'),
+        }
+
+        be = existing.get(first.replace(day=15))
+        if be is None:
+            new.append(BalanceEntry(date=first.replace(day=15), **values))
+        elif any(getattr(be, k) != v for k, v in values.items()):
+            for k, v in values.items():
+                setattr(be, k, v)
+            changed.append(be)
 
         first = first + relativedelta(months=1)
+
+    BalanceEntry.objects.bulk_create(new)
+    BalanceEntry.objects.bulk_update(changed, list(values.keys()))
+    return len(new) + len(changed)
     # }}}
 # }}}
 
 if __name__ == '__main__':
-    balance()
-    info('Updated balance reports')
+    since = Period.objects.get(id=sys.argv[1]).start if len(sys.argv) > 1 else None
+    nchanged = balance(since)
+    info('Updated balance reports (%i months changed)' % nchanged)
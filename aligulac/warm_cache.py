@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+# {{{ Imports
+import os
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'aligulac.settings')
+import django
+django.setup()
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from time import perf_counter
+
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from aligulac.settings import (
+    CACHE_WARMING,
+    INACTIVE_THRESHOLD,
+    SHOW_PER_LIST_PAGE,
+)
+from aligulac.tools import get_current_period
+
+from ratings.models import Player
+from ratings.ranking_views import (
+    ORDER,
+    filter_ratings,
+)
+from ratings.templatetags.ratings_extras import urlfilter
+# }}}
+
+def info(string):
+    print("[{}] {}".format(datetime.now(), string), flush=True)
+
+# {{{ get_urls: The hottest pages, in the order they should be warmed
+def get_urls():
+    urls = ['/', '/periods/latest/']
+
+    # These must be formatted exactly like the links in periodpagenav.djhtml, or the cache keys won't match. Pages
+    # are linked both by number and with the last rating on the previous page as a cursor.
+    period = get_current_period()
+    npages = CACHE_WARMING['ranking_pages']
+    for race in CACHE_WARMING['races']:
+        for nats in CACHE_WARMING['nats']:
+            for page in range(1, npages + 1):
+                urls.append('/periods/latest/?page=%i&sort=&race=%s&nats=%s' % (page, race, nats))
+
+            ids = list(filter_ratings(period, race, nats).order_by(*ORDER).values_list('id', flat=True)[
+                :(npages - 1) * SHOW_PER_LIST_PAGE
+            ])
+            for page in range(2, npages + 1):
+                if len(ids) >= (page - 1) * SHOW_PER_LIST_PAGE:
+                    urls.append('/periods/latest/?page=%i&after=%i&sort=&race=%s&nats=%s' % (
+                        page, ids[(page - 1) * SHOW_PER_LIST_PAGE - 1], race, nats
+                    ))
+
+    players = (
+        Player.objects.filter(current_rating__decay__lt=INACTIVE_THRESHOLD)
+            .order_by('-current_rating__rating')
+            .values('id', 'tag')[:CACHE_WARMING['players']]
+    )
+    urls += ['/players/%i-%s/' % (p['id'], urlfilter(p['tag'])) for p in players]
+
+    urls += [
+        '/records/history/',
+        '/records/hof/',
+        '/records/race/?race=all',
+        '/records/race/?race=P',
+        '/records/race/?race=T',
+        '/records/race/?race=Z',
+    ]
+
+    return urls
+# }}}
+
+# {{{ render: Renders a single page in-process, returns status, time taken and number of queries. The page
+# cache is keyed on the resolved language, not on the raw headers or cookies, so visitors get these entries.
+def render(url, language):
+    client = Client(HTTP_HOST=CACHE_WARMING['host'], HTTP_ACCEPT_LANGUAGE=language)
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            start = perf_counter()
+            response = client.get(url, secure=CACHE_WARMING['secure'])
+            elapsed = perf_counter() - start
+        return response.status_code, elapsed, len(queries)
+    finally:
+        connection.close()
+# }}}
+
+if __name__ == '__main__':
+    info('Warming cache')
+
+    jobs = [(url, lang) for lang in CACHE_WARMING['languages'] for url in get_urls()]
+    total = perf_counter()
+
+    with ThreadPoolExecutor(max_workers=CACHE_WARMING['threads']) as pool:
+        futures = [(url, lang, pool.submit(render, url, lang)) for url, lang in jobs]
+        for url, lang, future in futures:
+            try:
+                status, elapsed, nqueries = future.result()
+                info('  %s %s: %i in %.2fs (%i queries)' % (lang, url, status, elapsed, nqueries))
+            except Exception as e:
+                info('  %s %s: failed (%s)' % (lang, url, e))
+
+    info('Warmed %i pages in %.2fs' % (len(jobs), perf_counter() - total))